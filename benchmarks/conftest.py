@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+
+Synthetic bundles for the benchmarks of `test_roundtrip.py`.
+"""
+
+import datetime
+import io
+import tracemalloc
+
+import lxml.etree
+import pytest
+import six
+
+import koppeltaal.connector
+import koppeltaal.fhir
+import koppeltaal.models
+
+from koppeltaal.fhir import bundle, codegen
+
+
+BASE = 'https://example.com/fhir/Koppeltaal'
+
+ATOM = 'http://www.w3.org/2005/Atom'
+FHIR = 'http://hl7.org/fhir'
+
+NOW = datetime.datetime(2020, 1, 1, 12, 0, 0)
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('koppeltaal benchmarks')
+    group.addoption(
+        '--patients', type=int, default=10,
+        help='Number of patients in the synthetic bundles.')
+    group.addoption(
+        '--activities', type=int, default=10,
+        help='Number of activities in the care plan of every patient.')
+    group.addoption(
+        '--subactivities', type=int, default=5,
+        help='Number of subactivities of every activity.')
+    group.addoption(
+        '--slotted', action='store_true', default=False,
+        help='Unpack into the slotted variants of the models.')
+    group.addoption(
+        '--compiled', action='store_true', default=False,
+        help='Use the generated pack and unpack functions.')
+
+
+class Integration(koppeltaal.connector.Integration):
+    """Integration giving every model a stable identifier, so the synthetic
+    bundles are the same from one run to another.
+    """
+
+    def __init__(self):
+        super(Integration, self).__init__(
+            name='Benchmark',
+            url=BASE,
+            software='Benchmark',
+            version='0.0')
+        self._ids = {}
+
+    def model_id(self, model):
+        return self._ids.setdefault(id(model), len(self._ids) + 1)
+
+
+def synthetic_models(patients, activities, subactivities):
+    """Return the patients with their practitioner, care team and care plan
+    of `activities` activities, having `subactivities` subactivities each.
+    """
+    models = []
+    for index in range(patients):
+        practitioner = koppeltaal.models.Practitioner(
+            name=koppeltaal.models.Name(
+                given=[u'John'],
+                family=[u'Practitioner {}'.format(index)]))
+        patient = koppeltaal.models.Patient(
+            name=[koppeltaal.models.Name(
+                given=[u'Jane'],
+                family=[u'Patient {}'.format(index)])],
+            age=30 + index % 50,
+            gender='F',
+            active=True)
+        careteam = koppeltaal.models.CareTeam(
+            name=u'Team {}'.format(index),
+            status='active',
+            subject=patient,
+            period=koppeltaal.models.Period(start=NOW))
+        participants = [koppeltaal.models.Participant(
+            member=practitioner,
+            role='Caregiver',
+            careteam=[careteam])]
+        careplan = koppeltaal.models.CarePlan(
+            patient=patient,
+            participants=participants,
+            status='active',
+            activities=[
+                koppeltaal.models.Activity(
+                    identifier=u'activity-{}-{}'.format(index, number),
+                    definition=u'KTSTESTGAME',
+                    kind='Game',
+                    participants=participants,
+                    planned=NOW,
+                    status='Available',
+                    subactivities=[
+                        koppeltaal.models.SubActivity(
+                            definition=u'sub-{}'.format(sub),
+                            status='Available')
+                        for sub in range(subactivities)])
+                for number in range(activities)])
+        models.extend([practitioner, patient, careteam, careplan])
+    return models
+
+
+def payload2xml(payload):
+    """Render a bundle payload as an atom feed, the way `fhir.xml.xml2json`
+    reads it.
+    """
+
+    def fhir_element(parent, name, value):
+        if isinstance(value, list):
+            for item in value:
+                fhir_element(parent, name, item)
+            return
+        node = lxml.etree.SubElement(parent, '{%s}%s' % (FHIR, name))
+        if isinstance(value, dict):
+            fhir_content(node, value)
+        elif isinstance(value, bool):
+            node.set('value', 'true' if value else 'false')
+        else:
+            node.set('value', six.text_type(value))
+
+    def fhir_content(node, content):
+        for key, value in content.items():
+            if key in ('id', 'url'):
+                node.set(key, value)
+            elif key != 'resourceType':
+                fhir_element(node, key, value)
+
+    feed = lxml.etree.Element('{%s}feed' % ATOM)
+    lxml.etree.SubElement(feed, '{%s}id' % ATOM).text = payload['id']
+    for entry in payload['entry']:
+        node = lxml.etree.SubElement(feed, '{%s}entry' % ATOM)
+        lxml.etree.SubElement(node, '{%s}id' % ATOM).text = entry['id']
+        for link in entry.get('link', ()):
+            lxml.etree.SubElement(node, '{%s}link' % ATOM, **link)
+        content = lxml.etree.SubElement(node, '{%s}content' % ATOM)
+        resource = lxml.etree.SubElement(
+            content, '{%s}%s' % (FHIR, entry['content']['resourceType']))
+        fhir_content(resource, entry['content'])
+    return lxml.etree.tostring(feed)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def slotted(request):
+    if request.config.getoption('--slotted'):
+        koppeltaal.fhir.use_slotted_models()
+        yield
+        koppeltaal.fhir.use_slotted_models(False)
+    else:
+        yield
+
+
+@pytest.fixture(scope='session', autouse=True)
+def compiled(request):
+    if request.config.getoption('--compiled'):
+        codegen.use_compiled_packer()
+        yield
+        codegen.use_compiled_packer(False)
+    else:
+        yield
+
+
+@pytest.fixture(scope='session')
+def integration():
+    return Integration()
+
+
+@pytest.fixture(scope='session')
+def models(request):
+    option = request.config.getoption
+    return synthetic_models(
+        option('--patients'),
+        option('--activities'),
+        option('--subactivities'))
+
+
+@pytest.fixture(scope='session')
+def payload(integration, models):
+    packaging = bundle.Bundle('benchmark', integration)
+    for model in models:
+        packaging.add_model(model)
+    return packaging.get_payload()
+
+
+@pytest.fixture(scope='session')
+def xml_payload(payload):
+    return payload2xml(payload)
+
+
+@pytest.fixture
+def xml_file(xml_payload):
+    return lambda: io.BytesIO(xml_payload)
+
+
+@pytest.fixture
+def measure(benchmark):
+    """Benchmark `function` and record the peak memory it allocates in the
+    `peak_memory_kib` extra information of the benchmark.
+    """
+
+    def measure(function, setup=None, rounds=5):
+        # `setup` returns the arguments of `function`, it is called before
+        # every round and not measured.
+        args = setup() if setup is not None else ()
+        tracemalloc.start()
+        try:
+            function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['peak_memory_kib'] = peak // 1024
+        if setup is None:
+            return benchmark(function)
+        return benchmark.pedantic(
+            function, setup=lambda: (setup(), {}), rounds=rounds)
+
+    return measure
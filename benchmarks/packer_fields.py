@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+
+Measure the per-field cost of packing and unpacking the bundles found in
+the test fixtures::
+
+  $ python benchmarks/packer_fields.py [repeat]
+"""
+
+import glob
+import json
+import os.path
+import sys
+import timeit
+
+import koppeltaal.connector
+import koppeltaal.interfaces
+
+from koppeltaal import fhir
+from koppeltaal.fhir import bundle, packer
+
+
+FIXTURES = os.path.join(
+    os.path.dirname(__file__), os.pardir,
+    'src', 'koppeltaal', 'tests', 'fixtures')
+
+INTEGRATION = koppeltaal.connector.Integration(
+    name='Benchmark',
+    url='https://example.com/fhir/Koppeltaal',
+    software='Benchmark',
+    version='0.0')
+
+
+def load_bundles():
+    bundles = []
+    for filename in sorted(glob.glob(os.path.join(FIXTURES, '*.json'))):
+        with open(filename) as fp:
+            payload = json.load(fp)
+        if payload.get('resourceType') == 'Bundle' and 'entry' in payload:
+            bundles.append(payload)
+    return bundles
+
+
+def unpack(payloads):
+    models = []
+    for payload in payloads:
+        packaging = bundle.Bundle('benchmark', INTEGRATION)
+        packaging.add_payload(payload)
+        models.append([
+            model for model in packaging.unpack()
+            if fhir.REGISTRY.definition_for_model(model) is not None
+            and packable(model)])
+    return models
+
+
+def packable(model):
+    """Whether a model can be packed again: bundles with broken resources
+    cannot.
+    """
+    for name, field, _, _, _ in packer.plan_for(
+            fhir.REGISTRY.definition_for_model(model)).fields:
+        values = getattr(model, name, None)
+        if not isinstance(values, list):
+            values = [values]
+        for value in values:
+            if koppeltaal.interfaces.IBrokenFHIRResource.providedBy(value):
+                return False
+    return True
+
+
+def pack(models):
+    for group in models:
+        packaging = bundle.Bundle('benchmark', INTEGRATION)
+        for model in group:
+            packaging.add_model(model)
+        list(packaging.pack())
+
+
+def count_fields(function, *args):
+    """Count the number of fields (un)packed by calling `function`.
+    """
+    counts = [0]
+    originals = {}
+
+    def counting(method):
+        def wrapper(self, field, *args):
+            counts[0] += 1
+            return method(self, field, *args)
+        return wrapper
+
+    for cls in (packer.Native, packer.Extension):
+        for name in ('pack', 'unpack'):
+            originals[(cls, name)] = getattr(cls, name)
+            setattr(cls, name, counting(getattr(cls, name)))
+    try:
+        function(*args)
+    finally:
+        for (cls, name), method in originals.items():
+            setattr(cls, name, method)
+    return counts[0]
+
+
+def measure(label, function, args, repeat):
+    fields = count_fields(function, *args)
+    best = min(timeit.repeat(
+        lambda: function(*args), number=repeat, repeat=5)) / repeat
+    print('{:<8} {:>6} fields {:>10.1f} us/run {:>8.2f} us/field'.format(
+        label, fields, best * 1e6, best * 1e6 / fields))
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    payloads = load_bundles()
+    models = unpack(payloads)
+    measure('unpack', unpack, (payloads,), repeat)
+    measure('pack', pack, (models,), repeat)
+
+
+if __name__ == '__main__':
+    main()
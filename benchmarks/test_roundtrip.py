@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+
+Benchmarks of packing, unpacking and converting synthetic bundles::
+
+  $ pytest benchmarks --patients 100 --benchmark-autosave
+
+Compare with a previous run with `--benchmark-compare`. The peak memory
+allocated by one run is reported as `peak_memory_kib` in the extra
+information of every benchmark (see `--benchmark-json`).
+"""
+
+from koppeltaal import fhir
+from koppeltaal.fhir import bundle, xml
+
+
+def test_packer_pack(measure, integration, models):
+    definitions = [fhir.REGISTRY.definition_for_model(m) for m in models]
+
+    def pack():
+        packer = bundle.Bundle('benchmark', integration).packer
+        for model, definition in zip(models, definitions):
+            packer.pack(model, definition)
+
+    measure(pack)
+
+
+def test_packer_unpack(measure, integration, payload):
+    contents = [
+        (entry['content'], fhir.REGISTRY.definition_for_type(
+            entry['content']['resourceType']))
+        for entry in payload['entry']]
+
+    def setup():
+        packaging = bundle.Bundle('benchmark', integration)
+        packaging.add_payload(payload)
+        return (packaging.packer,)
+
+    def unpack(packer):
+        for content, definition in contents:
+            packer.unpack(content, definition)
+
+    measure(unpack, setup=setup)
+
+
+def test_bundle_add_payload(measure, integration, payload):
+
+    def add_payload():
+        bundle.Bundle('benchmark', integration).add_payload(payload)
+
+    measure(add_payload)
+
+
+def test_bundle_unpack(measure, integration, payload):
+
+    def setup():
+        packaging = bundle.Bundle('benchmark', integration)
+        packaging.add_payload(payload)
+        return (packaging,)
+
+    def unpack(packaging):
+        return list(packaging.unpack())
+
+    measure(unpack, setup=setup)
+
+
+def test_bundle_get_payload(measure, integration, models):
+
+    def setup():
+        packaging = bundle.Bundle('benchmark', integration)
+        for model in models:
+            packaging.add_model(model)
+        return (packaging,)
+
+    def get_payload(packaging):
+        return packaging.get_payload()
+
+    measure(get_payload, setup=setup)
+
+
+def test_xml2json(measure, xml_file):
+    measure(lambda: xml.xml2json(xml_file()))
+
+
+def test_iterxml2json(measure, xml_file):
+
+    def iterxml2json():
+        return list(xml.iterxml2json(xml_file())['entry'])
+
+    measure(iterxml2json)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+
+Measure the conversion of a large atom feed, made of copies of the entries
+of the XML test fixtures, to JSON::
+
+  $ python benchmarks/xml_conversion.py [copies]
+"""
+
+import glob
+import io
+import os.path
+import sys
+import timeit
+
+import lxml.etree
+
+from koppeltaal.fhir import xml
+
+
+FIXTURES = os.path.join(
+    os.path.dirname(__file__), os.pardir,
+    'src', 'koppeltaal', 'tests', 'fixtures')
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+
+def load_feed(copies):
+    """Return a feed with `copies` copies of the fixture entries.
+    """
+    entries = []
+    for filename in sorted(glob.glob(os.path.join(FIXTURES, '*.xml'))):
+        entries.extend(lxml.etree.parse(filename).getroot().iter(
+            ATOM + 'entry'))
+    feed = lxml.etree.Element(ATOM + 'feed')
+    for _ in range(copies):
+        feed.extend(lxml.etree.fromstring(lxml.etree.tostring(entry))
+                    for entry in entries)
+    return lxml.etree.tostring(feed)
+
+
+def collect_leaves(data):
+    """Return the (parent tag, tag) of the leaves converted in `data`.
+    """
+    leaves = []
+    original = xml.type_for
+
+    def collecting(node_tag, child_tag):
+        leaves.append((node_tag, child_tag))
+        return original(node_tag, child_tag)
+
+    xml.type_for = collecting
+    try:
+        xml.xml2json(io.BytesIO(data))
+    finally:
+        xml.type_for = original
+    return leaves
+
+
+def measure(label, function, data, leaves, repeat):
+    best = min(timeit.repeat(
+        lambda: function(io.BytesIO(data)), number=repeat, repeat=5)) / repeat
+    print('{:<14} {:>8} leaves {:>10.2f} ms/run {:>8.3f} us/leaf'.format(
+        label, leaves, best * 1e3, best * 1e6 / leaves))
+
+
+def measure_type_for(leaves, repeat):
+    type_for = xml.type_for
+    best = min(timeit.repeat(
+        lambda: [type_for(*leaf) for leaf in leaves],
+        number=repeat, repeat=5)) / repeat
+    print('{:<14} {:>8} leaves {:>10.2f} ms/run {:>8.3f} us/leaf'.format(
+        'type_for', len(leaves), best * 1e3, best * 1e6 / len(leaves)))
+
+
+def iterxml2json(data):
+    bundle = xml.iterxml2json(data)
+    for entry in bundle.get('entry', ()):
+        pass
+
+
+def main():
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    data = load_feed(copies)
+    leaves = collect_leaves(data)
+    print('{} bytes'.format(len(data)))
+    measure('xml2json', xml.xml2json, data, len(leaves), 3)
+    measure('iterxml2json', iterxml2json, data, len(leaves), 3)
+    measure_type_for(leaves, 3)
+
+
+if __name__ == '__main__':
+    main()
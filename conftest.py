@@ -5,6 +5,7 @@
 """
 
 import os
+import sys
 import datetime
 import uuid
 import pytest
@@ -20,6 +21,14 @@ import koppeltaal.utils
 unicode = six.text_type
 
 
+collect_ignore = []
+if sys.version_info < (3, 6):
+    # Asyncio support requires Python 3.6.
+    collect_ignore.extend([
+        'src/koppeltaal/aio.py',
+        'src/koppeltaal/tests/test_aio.py'])
+
+
 def pytest_addoption(parser):
     '''Add server identifier to be passed in. Looks for corresponding part in
     ~/.koppeltaal.cfg
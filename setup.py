@@ -62,10 +62,16 @@ setup(
         'Topic :: Software Development :: Libraries :: Python Modules'
     ],
     install_requires=install_requires,
-    extras_require={'test': tests_require},
+    extras_require={
+        'async': ['aiohttp >= 3.3'],
+        'benchmark': ['pytest-benchmark'],
+        'speedups': ['orjson'],
+        'test': tests_require,
+        },
     entry_points={
         'console_scripts': [
-            'koppeltaal = koppeltaal.console:console'
+            'koppeltaal = koppeltaal.console:console',
+            'koppeltaal-loadtest = koppeltaal.loadtest:loadtest',
             ],
         }
     )
@@ -0,0 +1,579 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+
+Asyncio transport and connector. This requires Python 3.6 or later and
+aiohttp, available with the `async` extra.
+"""
+
+import asyncio
+import base64
+import inspect
+import time
+
+import aiohttp
+
+from koppeltaal.fhir import bundle, resource
+from koppeltaal import (
+    codec,
+    connector,
+    definitions,
+    interfaces,
+    logger,
+    transport,
+    utils)
+from six.moves.urllib.parse import urlparse
+
+
+REDIRECT_STATUSES = frozenset((301, 302, 303, 307, 308))
+
+
+async def _maybe_await(result):
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+class AsyncTransport(object):
+
+    def __init__(self, server, username, password, options=None):
+        parts = urlparse(server)
+
+        self.server = server
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.username = username
+        self.password = password
+        # Unlike requests, aiohttp does not open more connections to a
+        # server than its pool size, so there is no limit by default.
+        self.limit_per_host = transport.option(
+            options, 'pool_maxsize', 0, int)
+        self.keep_alive = transport.option(
+            options, 'keep_alive', True, transport.boolean)
+
+        # The session is bound to the event loop it is created in, so it
+        # is only created when the first request is made.
+        self.session = None
+
+    absolute_url = transport.Transport.absolute_url
+
+    def _session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=self.limit_per_host,
+                    force_close=not self.keep_alive),
+                timeout=aiohttp.ClientTimeout(total=interfaces.TIMEOUT))
+        return self.session
+
+    async def _request(
+            self, method, url, username=None, password=None, headers=None,
+            **kwargs):
+        username = username or self.username
+        password = password or self.password
+        headers = dict(headers or {})
+        if username is not None:
+            credentials = '{}:{}'.format(username, password or '')
+            headers['Authorization'] = 'Basic {}'.format(
+                base64.b64encode(credentials.encode('utf-8')).decode('ascii'))
+        start = time.time()
+        try:
+            async with self._session().request(
+                    method,
+                    self.absolute_url(url),
+                    headers=headers,
+                    allow_redirects=False,
+                    **kwargs) as http_response:
+                body = await http_response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            raise interfaces.ConnectionError(error)
+        logger.event(
+            'http.response',
+            method=method,
+            url=url,
+            status=http_response.status,
+            size=len(body),
+            duration=time.time() - start,
+            attempt=0)
+        return http_response, body
+
+    def _read_http_response(self, http_response, body):
+        if http_response.status == 304:
+            return transport.Response(
+                etag=http_response.headers.get('etag'),
+                last_modified=http_response.headers.get('last-modified'),
+                not_modified=True)
+        if not http_response.headers.get('content-type', '').startswith(
+                'application/json'):
+            raise interfaces.ConnectionError(http_response)
+        response = transport.Response(
+            json=codec.loads(body) if body else None,
+            location=http_response.headers.get('content-location'),
+            etag=http_response.headers.get('etag'),
+            last_modified=http_response.headers.get('last-modified'))
+        if 400 <= http_response.status < 600:
+            raise interfaces.ResponseError(response)
+        return response
+
+    async def query(
+            self, url, params=None, username=None, password=None,
+            headers=None):
+        """Query a url.
+        """
+        request_headers = {'Accept': 'application/json'}
+        if headers:
+            request_headers.update(headers)
+        http_response, body = await self._request(
+            'GET',
+            url,
+            username=username,
+            password=password,
+            params=params,
+            headers=request_headers)
+        return self._read_http_response(http_response, body)
+
+    async def query_redirect(self, url, params=None):
+        """Query a url for a redirect.
+        """
+        http_response, body = await self._request('GET', url, params=params)
+        if http_response.status not in REDIRECT_STATUSES:
+            raise interfaces.ConnectionError(http_response)
+        return transport.Response(
+            location=http_response.headers.get('location'))
+
+    async def create(self, url, data):
+        """Create a new resource at the given url with JSON data.
+        """
+        http_response, body = await self._request(
+            'POST', url, data=codec.dumps(data),
+            headers=transport.JSON_HEADERS)
+        return self._read_http_response(http_response, body)
+
+    async def update(self, url, data):
+        """Update an existing resource at the given url with JSON data.
+        """
+        http_response, body = await self._request(
+            'PUT', url, data=codec.dumps(data),
+            headers=transport.JSON_HEADERS)
+        return self._read_http_response(http_response, body)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncUpdate(connector.Update):
+    """Update to use as an asynchronous context manager.
+    """
+
+    async def __aenter__(self):
+        self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._close(exc_type, exc_val, exc_tb):
+            await self._ack_function(self.message)
+
+
+class AsyncAckBatcher(object):
+    """Asynchronous AckBatcher: buffer the acknowledgements of updates and
+    send them back in batches, with up to `workers` concurrent requests. A
+    batch is sent when `size` messages are waiting, every `interval`
+    seconds if set, and when the batcher is closed.
+
+    Acknowledgements that could not be sent are logged and kept in
+    `failed`. Those messages revert to new on the server eventually.
+    """
+
+    def __init__(
+            self,
+            send_function,
+            size=connector.DEFAULT_ACK_BATCH_SIZE,
+            interval=connector.DEFAULT_ACK_INTERVAL,
+            workers=connector.DEFAULT_WORKERS):
+        self._send_function = send_function
+        self.size = size
+        self.interval = interval
+        self.workers = workers
+        self.failed = []
+        self._messages = []
+        self._closed = False
+        self._stop = None
+        self._timer = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def add(self, message):
+        if self._closed:
+            await self._send([message])
+            return
+        self._messages.append(message)
+        if self._timer is None and self.interval:
+            self._stop = asyncio.Event()
+            self._timer = asyncio.ensure_future(self._flush_periodically())
+        if len(self._messages) >= self.size:
+            await self.flush()
+
+    async def _flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                await self.flush()
+            else:
+                break
+
+    async def _send(self, messages):
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def send(message):
+            async with semaphore:
+                try:
+                    await self._send_function(message)
+                except Exception as error:
+                    logger.error(
+                        "Error while acknowledging message '{}': {}".format(
+                            message.fhir_link, error))
+                    self.failed.append(message)
+
+        await asyncio.gather(*[send(message) for message in messages])
+
+    async def flush(self):
+        """Send back the waiting acknowledgements.
+        """
+        messages, self._messages = self._messages, []
+        if messages:
+            await self._send(messages)
+
+    async def close(self):
+        """Send back the waiting acknowledgements and stop batching. The
+        acknowledgements added afterwards are sent back right away.
+        """
+        self._closed = True
+        if self._timer is not None:
+            self._stop.set()
+            await self._timer
+        await self.flush()
+
+
+class AsyncConnector(connector.Connector):
+    """Connector of which the methods talking to the server are coroutines,
+    or asynchronous generators for `updates` and `search_stream`.
+
+    The `transaction_hook` of the integration can return an awaitable.
+    """
+    _create_transport = AsyncTransport
+
+    def _fetch_pages(self, url, params=None, batch_count=None, prefetch=0):
+        if prefetch:
+            return self._prefetch_pages(url, params, batch_count, prefetch)
+        return self._query_pages(url, params, batch_count)
+
+    async def _prefetch_pages(self, url, params, batch_count, depth):
+        # Query the next pages in a task while the current one is
+        # processed. At most `depth` pages are waiting to be processed.
+        pages = asyncio.Queue(maxsize=depth)
+
+        async def prefetch():
+            try:
+                async for page in self._query_pages(url, params, batch_count):
+                    await pages.put((page, None))
+            except Exception as error:
+                await pages.put((None, error))
+                return
+            await pages.put((None, None))
+
+        task = asyncio.ensure_future(prefetch())
+        try:
+            while True:
+                page, error = await pages.get()
+                if error is not None:
+                    raise error
+                if page is None:
+                    break
+                yield page
+        finally:
+            task.cancel()
+
+    async def _query_pages(self, url, params=None, batch_count=None):
+        count = 0
+        next_url = url
+        next_params = params
+        while next_url:
+            response = await self.transport.query(next_url, next_params)
+            yield response.json
+            next_url = utils.json2links(response.json).get('next')
+            next_params = None  # Parameters are already in the next link.
+            count += 1
+            if batch_count is not None and count >= batch_count:
+                break
+
+    async def _fetch_bundle(
+            self, url, params=None, batch_count=None, lazy=False):
+        packaging = bundle.Bundle(self.domain, self.integration, lazy=lazy)
+        async for page in self._fetch_pages(url, params, batch_count):
+            packaging.add_payload(page)
+        return packaging
+
+    async def metadata(self):
+        return (await self.transport.query(interfaces.METADATA_URL)).json
+
+    async def _activities(self, archived):
+        cached = self.activity_cache.get(archived)
+        if cached is not None and self.activity_cache.fresh(cached):
+            return cached
+        params = self._activities_parameters(archived)
+        headers = None
+        if cached is not None:
+            headers = cached.conditions() or None
+        response = await self.transport.query(
+            interfaces.ACTIVITY_DEFINITION_URL, params, headers=headers)
+        pages = []
+        if not response.not_modified:
+            next_url = utils.json2links(response.json).get('next')
+            if next_url:
+                pages = [page async for page in self._query_pages(next_url)]
+        return self._activities_catalogue(archived, cached, response, pages)
+
+    async def activities(self, archived=False):
+        return list((await self._activities(archived)).activities)
+
+    async def activity(self, identifier, archived=False):
+        return (await self._activities(archived)).index.get(identifier)
+
+    async def send_activity(self, activity):
+        packaging = resource.Resource(self.domain, self.integration)
+        packaging.add_model(activity)
+        payload = packaging.get_payload()
+        try:
+            if activity.fhir_link is not None:
+                response = await self.transport.update(
+                    activity.fhir_link, payload)
+            else:
+                response = await self.transport.create(
+                    interfaces.OTHER_URL, payload)
+        finally:
+            self.activity_cache.invalidate()
+        if response.location is None:
+            raise interfaces.ResponseError(response)
+        activity.fhir_link = response.location
+        return activity
+
+    async def launch(self, careplan, user=None, activity_identifier=None):
+        activity = self._launch_activity(careplan, activity_identifier)
+        if user is None:
+            user = careplan.patient
+        application_id = None
+        if activity.definition is not None:
+            activity_definition = await self.activity(activity.definition)
+            assert interfaces.IReferredFHIRResource.providedBy(
+                activity_definition.application)
+            application_id = activity_definition.application.display
+        return await self.launch_from_parameters(
+            application_id,
+            careplan.patient.fhir_link,
+            user.fhir_link,
+            activity.identifier)
+
+    async def launch_from_parameters(
+            self,
+            application_id,
+            patient_link,
+            user_link,
+            activity_identifier,
+            intent=None):
+        params = self._launch_parameters(
+            application_id,
+            patient_link,
+            user_link,
+            activity_identifier,
+            intent)
+        return (await self.transport.query_redirect(
+            interfaces.OAUTH_LAUNCH_URL, params)).location
+
+    async def token_from_parameters(self, code, redirect_url):
+        params, username, password = self._token_parameters(
+            code, redirect_url)
+        return (await self.transport.query(
+            interfaces.OAUTH_TOKEN_URL,
+            params=params,
+            username=username,
+            password=password)).json
+
+    async def _send_back(self, message):
+        packaging = resource.Resource(self.domain, self.integration)
+        packaging.add_model(message)
+        await self.transport.update(message.fhir_link, packaging.get_payload())
+        logger.event(
+            'message.acknowledged',
+            message_id=message.fhir_link,
+            status=message.status.status if message.status else None)
+
+    def ack_batcher(
+            self,
+            size=connector.DEFAULT_ACK_BATCH_SIZE,
+            interval=connector.DEFAULT_ACK_INTERVAL,
+            workers=connector.DEFAULT_WORKERS):
+        """Return an AsyncAckBatcher sending back messages with this
+        connector, to pass to `updates` or `consume`.
+        """
+        return AsyncAckBatcher(self._send_back, size, interval, workers)
+
+    async def updates(
+        self,
+        expected_events=None,
+        patient=None,
+        event=None,
+        lazy=False,
+        acks=None):
+
+        # The acknowledgement is sent back from the transaction hook, or
+        # handed over to `acks` to be sent back in a batch.
+        commit = self._send_back if acks is None else acks.add
+
+        async def send_back_on_transaction(message):
+            return await _maybe_await(
+                self.integration.transaction_hook(commit, message))
+
+        parameters = self._updates_parameters(patient, event)
+
+        while True:
+            try:
+                bundle = await self._fetch_bundle(
+                    interfaces.MESSAGE_HEADER_URL, parameters, lazy=lazy)
+                message = bundle.unpack_model(definitions.MessageHeader)
+            except interfaces.InvalidBundle as error:
+                logger.error(
+                    'Bundle error while reading message: {}'.format(error))
+                continue
+            except interfaces.TransportError as error:
+                logger.error(
+                    'Transport error while reading mailbox: {}'.format(error))
+                break
+
+            if message is None:
+                # We are out of messages
+                break
+
+            logger.event(
+                'message.claimed',
+                message_id=message.fhir_link,
+                message_event=message.event)
+            update = AsyncUpdate(
+                message, bundle.unpack, send_back_on_transaction)
+            acknowledge = self._screen(bundle, message, expected_events)
+            if acknowledge is None:
+                yield update
+            else:
+                async with update:
+                    acknowledge(update)
+
+    async def consume(
+            self,
+            handler,
+            workers=connector.DEFAULT_WORKERS,
+            expected_events=None,
+            patient=None,
+            event=None,
+            lazy=False,
+            stop=None,
+            acks=None):
+        """Process the new messages in the mailbox with `workers` tasks.
+        The `handler` can be a function or a coroutine function, `stop`
+        an asyncio.Event and `acks` an AsyncAckBatcher.
+        """
+        if stop is None:
+            stop = asyncio.Event()
+        processed = []
+
+        async def work():
+            updates = self.updates(
+                expected_events=expected_events,
+                patient=patient,
+                event=event,
+                lazy=lazy,
+                acks=acks)
+            try:
+                while not stop.is_set():
+                    try:
+                        update = await updates.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    async with update:
+                        await _maybe_await(handler(update))
+                    processed.append(update.message.fhir_link)
+            except Exception as error:
+                logger.error(
+                    'Error while processing update: {}'.format(error))
+                stop.set()
+                raise
+            finally:
+                await updates.aclose()
+
+        results = await asyncio.gather(
+            *[work() for index in range(workers)], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return len(processed)
+
+    async def search(
+            self, message_id=None, event=None, status=None, patient=None,
+            batch_size=connector.DEFAULT_COUNT, batch_count=None):
+        params = self._search_parameters(
+            message_id, event, status, patient, batch_size)
+        return (await self._fetch_bundle(
+            interfaces.MESSAGE_HEADER_URL, params, batch_count)).unpack()
+
+    async def search_stream(
+            self, message_id=None, event=None, status=None, patient=None,
+            batch_size=connector.DEFAULT_COUNT, batch_count=None, prefetch=0):
+        params = self._search_parameters(
+            message_id, event, status, patient, batch_size)
+        async for page in self._fetch_pages(
+                interfaces.MESSAGE_HEADER_URL, params, batch_count,
+                prefetch):
+            packaging = bundle.Bundle(
+                self.domain, self.integration, lazy=True)
+            packaging.add_payload(page)
+            for message in packaging.unpack_models(
+                    definitions.MessageHeader):
+                yield message
+
+    async def send(self, event, data, patient=None):
+        start = time.time()
+        identifier, request_payload = self._send_request(event, data, patient)
+        try:
+            response = await self.transport.create(
+                interfaces.MAILBOX_URL, request_payload)
+        except interfaces.ResponseError as error:
+            raise self._send_error(error)
+        result = self._send_response(response, event, identifier)
+        logger.event(
+            'message.sent',
+            message_id=identifier,
+            message_event=event,
+            duration=time.time() - start)
+        return result
+
+    async def send_many(
+            self, items, concurrency=connector.DEFAULT_WORKERS):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(event, data, patient):
+            async with semaphore:
+                try:
+                    return await self.send(event, data, patient)
+                except interfaces.KoppeltaalError as error:
+                    return error
+
+        return list(await asyncio.gather(
+            *[send(event, data, patient) for event, data, patient in items]))
+
+    async def close(self):
+        await self.transport.close()
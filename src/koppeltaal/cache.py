@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from koppeltaal import interfaces
+from six.moves.urllib.parse import parse_qsl, urlencode, urlparse
+
+
+DEFAULT_CACHE_SIZE = 128
+NEVER_CACHED_QUERIES = frozenset(['MessageHeader.GetNextNewAndClaim'])
+
+MAX_AGE = re.compile(r'max-age\s*=\s*(\d+)')
+
+
+class CachePolicy(object):
+    """How long the responses of an endpoint can be used without asking the
+    server, if it does not say so with a Cache-Control header. After that
+    they are revalidated if the server sent an ETag or a Last-Modified
+    date.
+
+    If `parameters` is given, only the requests with no other parameters
+    than those are cached.
+    """
+
+    def __init__(self, max_age=0, parameters=None):
+        self.max_age = max_age
+        self.parameters = parameters
+
+    def allows(self, params):
+        if self.parameters is None:
+            return True
+        return set(params).issubset(self.parameters)
+
+
+DEFAULT_POLICIES = {
+    interfaces.METADATA_URL: CachePolicy(max_age=3600),
+    interfaces.ACTIVITY_DEFINITION_URL: CachePolicy(
+        max_age=60, parameters=frozenset(['code', 'includearchived'])),
+    # Messages change, they are always revalidated.
+    interfaces.MESSAGE_HEADER_URL: CachePolicy(
+        max_age=0, parameters=frozenset(['_id'])),
+}
+
+
+class MemoryBackend(object):
+    """Keep the `size` most recently used responses in memory.
+    """
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DiskBackend(object):
+    """Keep the responses as JSON files in `directory`.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _filename(self, key):
+        return os.path.join(
+            self.directory,
+            hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key):
+        try:
+            with open(self._filename(key)) as stream:
+                entry = json.load(stream)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        return entry
+
+    def set(self, key, entry):
+        entry = dict(entry, key=key)
+        filename = self._filename(key)
+        # Write to a temporary file first, so that readers never see a
+        # partial entry.
+        temporary = '{}.{}.tmp'.format(
+            filename, threading.current_thread().ident)
+        with open(temporary, 'w') as stream:
+            json.dump(entry, stream)
+        os.rename(temporary, filename)
+
+    def delete(self, key):
+        try:
+            os.remove(self._filename(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
+
+
+class ResponseCache(object):
+    """Cache of the responses to the safe queries of the transport, with a
+    policy per endpoint path. Queries for endpoints without a policy are
+    not cached, nor is the query to claim the next new message.
+    """
+
+    def __init__(self, backend=None, policies=None, clock=time.time):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.policies = DEFAULT_POLICIES if policies is None else policies
+        self.clock = clock
+
+    @classmethod
+    def from_options(cls, options=None):
+        """Return a cache configured by the `cache` option, either `memory`
+        or the directory to keep the responses in, or None.
+        """
+        location = (options or {}).get('cache')
+        if not location:
+            return None
+        if location == 'memory':
+            size = (options or {}).get('cache_size')
+            return cls(MemoryBackend(int(size or DEFAULT_CACHE_SIZE)))
+        return cls(DiskBackend(os.path.expanduser(location)))
+
+    def key(self, url, params=None, username=None):
+        """Return the key for a query, or None if it cannot be cached.
+        """
+        parts = urlparse(url)
+        policy = self.policies.get(parts.path)
+        if policy is None:
+            return None
+        parameters = dict(parse_qsl(parts.query))
+        parameters.update(params or {})
+        if parameters.get('_query') in NEVER_CACHED_QUERIES:
+            return None
+        if not policy.allows(parameters):
+            return None
+        return '{}?{} {}'.format(
+            parts.path,
+            urlencode(sorted((k, str(v)) for k, v in parameters.items())),
+            username or '')
+
+    def get(self, key):
+        """Return the entry for `key` and whether it is still fresh.
+        """
+        entry = self.backend.get(key)
+        if entry is None:
+            return None, False
+        return entry, self.clock() < entry['expires']
+
+    def conditions(self, entry):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _max_age(self, key, cache_control):
+        cache_control = (cache_control or '').lower()
+        if 'no-store' in cache_control:
+            return None
+        if 'no-cache' in cache_control:
+            return 0
+        match = MAX_AGE.search(cache_control)
+        if match is not None:
+            return int(match.group(1))
+        return self.policies[key.split('?', 1)[0]].max_age
+
+    def store(self, key, body, headers):
+        """Store the response `body` with its `headers`, unless the server
+        forbids it. Return the stored entry.
+        """
+        max_age = self._max_age(key, headers.get('cache-control'))
+        if max_age is None:
+            self.backend.delete(key)
+            return None
+        entry = {
+            'body': body,
+            'location': headers.get('content-location'),
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'expires': self.clock() + max_age}
+        if not max_age and not (entry['etag'] or entry['last_modified']):
+            # It could neither be used nor revalidated.
+            self.backend.delete(key)
+            return None
+        self.backend.set(key, entry)
+        return entry
+
+    def refresh(self, key, entry, headers):
+        """Extend the freshness of an entry that was revalidated.
+        """
+        max_age = self._max_age(key, headers.get('cache-control'))
+        if max_age is None:
+            self.backend.delete(key)
+            return entry
+        entry = dict(entry, expires=self.clock() + max_age)
+        self.backend.set(key, entry)
+        return entry
+
+    def clear(self):
+        self.backend.clear()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+
+JSON (de)serialization with the fastest library installed: orjson, ujson
+or the json module of the standard library.
+"""
+
+import json
+
+
+class StandardCodec(object):
+    name = 'json'
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+    def dumps(self, data):
+        return json.dumps(
+            data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def pretty(self, data):
+        return json.dumps(data, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+class OrjsonCodec(object):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self.loads = orjson.loads
+        self.dumps = orjson.dumps
+
+    def pretty(self, data):
+        return self._orjson.dumps(
+            data,
+            option=self._orjson.OPT_INDENT_2 | self._orjson.OPT_SORT_KEYS
+        ).decode('utf-8')
+
+
+class UjsonCodec(object):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+        self.loads = ujson.loads
+
+    def dumps(self, data):
+        return self._ujson.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    def pretty(self, data):
+        return self._ujson.dumps(
+            data, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+CODECS = [OrjsonCodec, UjsonCodec, StandardCodec]
+
+codec = None
+
+
+def use(name=None):
+    """Use the codec called `name`, or the first one that is installed.
+    """
+    global codec
+    for factory in CODECS:
+        if name is not None and factory.name != name:
+            continue
+        try:
+            codec = factory()
+        except ImportError:
+            if name is not None:
+                raise
+            continue
+        return codec
+    raise ValueError('Unknown JSON codec {}'.format(name))
+
+
+def loads(data):
+    """Decode JSON text or UTF-8 encoded bytes.
+    """
+    return codec.loads(data)
+
+
+def dumps(data):
+    """Encode to compact UTF-8 encoded JSON bytes.
+    """
+    return codec.dumps(data)
+
+
+def pretty(data):
+    """Encode to indented JSON text, with sorted keys.
+    """
+    return codec.pretty(data)
+
+
+use()
@@ -8,13 +8,50 @@ import koppeltaal.interfaces
 import koppeltaal.definitions
 
 
-class Code(dict):
+class Frozen(dict):
+    """A dictionary that cannot be modified, use `copy()` to get a regular
+    dictionary.
+    """
+
+    def _frozen(self, *args, **kwargs):
+        raise TypeError(
+            '{} cannot be modified.'.format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = \
+        setdefault = update = _frozen
+
+
+class Coding(Frozen):
+    """A coding shared between all the payloads it is packed in.
+    """
+
+    def __reduce__(self):
+        return (Coding, (dict(self),))
+
+
+class Code(Frozen):
+    """Codes of a system, with their display. Codes are constants: they
+    cannot be modified, as the codings are computed from them once.
+    """
 
     def __init__(self, system, items):
         super(Code, self).__init__(items)
         if not system.startswith('http:'):
             system = koppeltaal.interfaces.NAMESPACE + system
         self.system = system
+        # Codes are constants: compute the codings to pack and the index
+        # of codings to unpack once.
+        self._codings = {}
+        self._values = {}
+        for value, display in self.items():
+            coding = {"code": value, "system": self.system}
+            if display is not None:
+                coding["display"] = display
+            self._codings[value] = Coding(coding)
+            self._values[(self.system, value)] = value
+
+    def __reduce__(self):
+        return (Code, (self.system, dict(self)))
 
     def pack_code(self, value):
         if value not in self:
@@ -22,12 +59,9 @@ class Code(dict):
         return value
 
     def pack_coding(self, value):
-        if value not in self:
+        coding = self._codings.get(value)
+        if coding is None:
             raise koppeltaal.interfaces.InvalidCode(self, value)
-        display = self[value]
-        coding = {"code": value, "system": self.system}
-        if display is not None:
-            coding["display"] = display
         return coding
 
     def unpack_code(self, code):
@@ -38,14 +72,16 @@ class Code(dict):
     def unpack_coding(self, coding):
         value = coding.get("code")
         system = coding.get("system")
+        try:
+            return self._values[(system, value)]
+        except (KeyError, TypeError):
+            pass
         if system == koppeltaal.definitions.NULL_SYSTEM \
                 and value == koppeltaal.definitions.NULL_VALUE:
             return None
         if system != self.system:
             raise koppeltaal.interfaces.InvalidSystem(self, system)
-        if value not in self:
-            raise koppeltaal.interfaces.InvalidCode(self, value)
-        return value
+        raise koppeltaal.interfaces.InvalidCode(self, value)
 
 
 ACTIVITY_KIND = Code(
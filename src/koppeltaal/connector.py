@@ -4,7 +4,10 @@
 :license: AGPL, see `LICENSE.md` for more details.
 """
 
+import functools
 import six
+import threading
+import time
 import zope.interface
 
 from koppeltaal.fhir import bundle, resource
@@ -15,6 +18,7 @@ from koppeltaal import (
     models,
     transport,
     utils)
+from six.moves import queue
 from six.moves.urllib.parse import urlencode
 
 
@@ -22,6 +26,11 @@ unicode = six.text_type
 
 
 DEFAULT_COUNT = 100
+DEFAULT_WORKERS = 4
+DEFAULT_ACK_BATCH_SIZE = 20
+DEFAULT_ACK_INTERVAL = 1.0
+CONSUMER_JOIN_INTERVAL = 0.5
+PREFETCH_POLL_INTERVAL = 0.1
 
 
 @zope.interface.implementer(interfaces.IIntegration)
@@ -70,6 +79,11 @@ class Update(object):
         self.acked = False
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._close(exc_type, exc_val, exc_tb):
+            self._ack_function(self.message)
+
+    def _close(self, exc_type, exc_val, exc_tb):
+        # Return True if the message needs to be sent back.
         if exc_type is None and exc_val is None and exc_tb is None:
             if self.acked is False:
                 self.success()
@@ -77,8 +91,7 @@ class Update(object):
             # There was an exception. We put back the message to new
             # since we assume we can be solved after.
             self.ack('New')
-        if self.acked is not None:
-            self._ack_function(self.message)
+        return self.acked is not None
 
     def ack(self, status, exception=None):
         self.acked = True
@@ -98,6 +111,165 @@ class Update(object):
         self.acked = None
 
 
+class AckBatcher(object):
+    """Buffer the acknowledgements of updates and send them back in
+    batches, with up to `workers` concurrent requests. A batch is sent when
+    `size` messages are waiting, every `interval` seconds if set, and when
+    the batcher is closed.
+
+    Acknowledgements that could not be sent are logged and kept in
+    `failed`. Those messages revert to new on the server eventually.
+    """
+
+    def __init__(
+            self,
+            send_function,
+            size=DEFAULT_ACK_BATCH_SIZE,
+            interval=DEFAULT_ACK_INTERVAL,
+            workers=DEFAULT_WORKERS):
+        self._send_function = send_function
+        self.size = size
+        self.interval = interval
+        self.workers = workers
+        self.failed = []
+        self._lock = threading.Lock()
+        self._messages = []
+        self._closed = threading.Event()
+        self._timer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, message):
+        with self._lock:
+            closed = self._closed.is_set()
+            if not closed:
+                self._messages.append(message)
+                full = len(self._messages) >= self.size
+                if self._timer is None and self.interval:
+                    self._timer = threading.Thread(
+                        target=self._flush_periodically,
+                        name='koppeltaal-ack-flush')
+                    self._timer.daemon = True
+                    self._timer.start()
+        if closed:
+            self._send([message])
+        elif full:
+            self.flush()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.interval):
+            self.flush()
+
+    def _send(self, messages):
+        pending = queue.Queue()
+        for message in messages:
+            pending.put(message)
+
+        def send():
+            while True:
+                try:
+                    message = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self._send_function(message)
+                except Exception as error:
+                    logger.error(
+                        "Error while acknowledging message '{}': {}".format(
+                            message.fhir_link, error))
+                    with self._lock:
+                        self.failed.append(message)
+
+        threads = []
+        for index in range(min(self.workers, len(messages))):
+            thread = threading.Thread(
+                target=send, name='koppeltaal-ack-{}'.format(index))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    def flush(self):
+        """Send back the waiting acknowledgements.
+        """
+        with self._lock:
+            messages, self._messages = self._messages, []
+        if messages:
+            self._send(messages)
+
+    def close(self):
+        """Send back the waiting acknowledgements and stop batching. The
+        acknowledgements added afterwards are sent back right away.
+        """
+        self._closed.set()
+        if self._timer is not None:
+            self._timer.join()
+        self.flush()
+
+
+class ActivityCatalogue(object):
+    """Activity definitions fetched from the server, indexed by identifier.
+    """
+
+    def __init__(self, activities, etag=None, last_modified=None):
+        self.activities = activities
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = None
+        self.index = {}
+        for activity in activities:
+            self.index.setdefault(activity.identifier, activity)
+
+    def conditions(self):
+        """Return the headers to revalidate the catalogue with.
+        """
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ActivityCache(object):
+    """Cache of the activity catalogues, with and without the archived
+    activity definitions. A catalogue is used for `ttl` seconds. After
+    that it is revalidated with the server if it provided an ETag or a
+    Last-Modified date, and fetched again otherwise.
+
+    Nothing is cached if `ttl` is not set.
+    """
+
+    def __init__(self, ttl=0, clock=getattr(time, 'monotonic', time.time)):
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._catalogues = {}
+
+    def get(self, archived):
+        with self._lock:
+            return self._catalogues.get(archived)
+
+    def fresh(self, catalogue):
+        return catalogue.expires is not None and \
+            self.clock() < catalogue.expires
+
+    def put(self, archived, catalogue):
+        if not self.ttl:
+            return
+        catalogue.expires = self.clock() + self.ttl
+        with self._lock:
+            self._catalogues[archived] = catalogue
+
+    def invalidate(self):
+        with self._lock:
+            self._catalogues.clear()
+
+
 @zope.interface.implementer(interfaces.IConnector)
 class Connector(object):
     _create_transport = transport.Transport
@@ -107,63 +279,166 @@ class Connector(object):
         self.transport = self._create_transport(
             self._credentials.url,
             self._credentials.username,
-            self._credentials.password)
+            self._credentials.password,
+            options=self._credentials.options)
         self.domain = self._credentials.domain
         self.integration = integration
-
-    def _fetch_bundle(self, url, params=None, batch_count=None):
+        self.activity_cache = ActivityCache(
+            ttl=transport.option(
+                self._credentials.options, 'activity_ttl', 0, float))
+
+    def _fetch_pages(
+            self, url, params=None, batch_count=None, prefetch=0,
+            replay=True):
+        if prefetch:
+            return self._prefetch_pages(
+                url, params, batch_count, prefetch, replay)
+        return self._query_pages(url, params, batch_count, replay)
+
+    def _prefetch_pages(self, url, params, batch_count, depth, replay=True):
+        # Query the next pages in a background thread while the current
+        # one is processed. At most `depth` pages are waiting to be
+        # processed. The thread stops querying pages as soon as the
+        # iteration is stopped.
+        pages = queue.Queue(maxsize=depth)
+        stopped = threading.Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=PREFETCH_POLL_INTERVAL)
+                except queue.Full:
+                    continue
+                return True
+            return False
+
+        def prefetch():
+            try:
+                for page in self._query_pages(
+                        url, params, batch_count, replay):
+                    if not put((page, None)):
+                        return
+            except Exception as error:
+                put((None, error))
+                return
+            put((None, None))
+
+        thread = threading.Thread(
+            target=prefetch, name='koppeltaal-prefetch')
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                page, error = pages.get()
+                if error is not None:
+                    raise error
+                if page is None:
+                    break
+                yield page
+        finally:
+            stopped.set()
+
+    def _query_pages(self, url, params=None, batch_count=None, replay=True):
         count = 0
         next_url = url
         next_params = params
-        packaging = bundle.Bundle(self.domain, self.integration)
         while next_url:
-            response = self.transport.query(next_url, next_params)
-            packaging.add_payload(response.json)
+            response = self.transport.query(
+                next_url, next_params, replay=replay)
+            yield response.json
             next_url = utils.json2links(response.json).get('next')
             next_params = None  # Parameters are already in the next link.
             count += 1
             if batch_count is not None and count >= batch_count:
                 break
+
+    def _fetch_bundle(
+            self, url, params=None, batch_count=None, lazy=False,
+            replay=True):
+        packaging = bundle.Bundle(self.domain, self.integration, lazy=lazy)
+        for page in self._fetch_pages(
+                url, params, batch_count, replay=replay):
+            packaging.add_payload(page)
         return packaging
 
     def metadata(self):
         return self.transport.query(interfaces.METADATA_URL).json
 
-    def activities(self, archived=False):
+    def _activities_parameters(self, archived):
         params = {'code': 'ActivityDefinition'}
         if archived:
             params['includearchived'] = 'yes'
-        return self._fetch_bundle(
-            interfaces.ACTIVITY_DEFINITION_URL, params).unpack()
+        return params
+
+    def _activities_catalogue(self, archived, cached, response, pages):
+        # Store the catalogue read from the response and the next pages,
+        # or the cached one if it was not modified.
+        if response.not_modified:
+            catalogue = cached
+        else:
+            packaging = bundle.Bundle(self.domain, self.integration)
+            packaging.add_payload(response.json)
+            for page in pages:
+                packaging.add_payload(page)
+            catalogue = ActivityCatalogue(
+                list(packaging.unpack()),
+                etag=response.etag,
+                last_modified=response.last_modified)
+        self.activity_cache.put(archived, catalogue)
+        return catalogue
+
+    def _activities(self, archived):
+        cached = self.activity_cache.get(archived)
+        if cached is not None and self.activity_cache.fresh(cached):
+            return cached
+        params = self._activities_parameters(archived)
+        if cached is not None and cached.conditions():
+            response = self.transport.query(
+                interfaces.ACTIVITY_DEFINITION_URL, params,
+                headers=cached.conditions())
+        else:
+            response = self.transport.query(
+                interfaces.ACTIVITY_DEFINITION_URL, params)
+        pages = ()
+        if not response.not_modified:
+            next_url = utils.json2links(response.json).get('next')
+            if next_url:
+                pages = self._query_pages(next_url)
+        return self._activities_catalogue(archived, cached, response, pages)
+
+    def activities(self, archived=False):
+        return list(self._activities(archived).activities)
 
     def activity(self, identifier, archived=False):
-        for activity in self.activities(archived=archived):
-            if activity.identifier == identifier:
-                return activity
-        return None
+        return self._activities(archived).index.get(identifier)
 
     def send_activity(self, activity):
         packaging = resource.Resource(self.domain, self.integration)
         packaging.add_model(activity)
         payload = packaging.get_payload()
-        if activity.fhir_link is not None:
-            response = self.transport.update(activity.fhir_link, payload)
-        else:
-            response = self.transport.create(interfaces.OTHER_URL, payload)
+        try:
+            if activity.fhir_link is not None:
+                response = self.transport.update(
+                    activity.fhir_link, payload)
+            else:
+                response = self.transport.create(
+                    interfaces.OTHER_URL, payload)
+        finally:
+            self.activity_cache.invalidate()
         if response.location is None:
             raise interfaces.ResponseError(response)
         activity.fhir_link = response.location
         return activity
 
-    def launch(self, careplan, user=None, activity_identifier=None):
-        activity = None
+    def _launch_activity(self, careplan, activity_identifier):
         for candidate in careplan.activities:
             if (activity_identifier is None or
                     candidate.identifier == activity_identifier):
-                activity = candidate
-                break
-        if activity is None:
-            raise interfaces.KoppeltaalError('No activity found')
+                return candidate
+        raise interfaces.KoppeltaalError('No activity found')
+
+    def launch(self, careplan, user=None, activity_identifier=None):
+        activity = self._launch_activity(careplan, activity_identifier)
         if user is None:
             user = careplan.patient
         application_id = None
@@ -178,7 +453,7 @@ class Connector(object):
             user.fhir_link,
             activity.identifier)
 
-    def launch_from_parameters(
+    def _launch_parameters(
             self,
             application_id,
             patient_link,
@@ -195,6 +470,21 @@ class Connector(object):
             'resource': activity_identifier}
         if intent is not None:
             params['intent'] = intent
+        return params
+
+    def launch_from_parameters(
+            self,
+            application_id,
+            patient_link,
+            user_link,
+            activity_identifier,
+            intent=None):
+        params = self._launch_parameters(
+            application_id,
+            patient_link,
+            user_link,
+            activity_identifier,
+            intent)
         return self.transport.query_redirect(
             interfaces.OAUTH_LAUNCH_URL, params).location
 
@@ -212,7 +502,7 @@ class Connector(object):
                  ('response_type', 'code'),
                  ('scope', 'patient/*.read launch:{}'.format(launch_id)))))
 
-    def token_from_parameters(self, code, redirect_url):
+    def _token_parameters(self, code, redirect_url):
         params = {
             'code': code,
             'grant_type': 'authorization_code',
@@ -226,36 +516,94 @@ class Connector(object):
         password = self.integration.client_secret
         assert username is not None, 'client id missing'
         assert password is not None, 'client secret missing'
+        return params, username, password
+
+    def token_from_parameters(self, code, redirect_url):
+        params, username, password = self._token_parameters(
+            code, redirect_url)
         return self.transport.query(
             interfaces.OAUTH_TOKEN_URL,
             params=params,
             username=username,
             password=password).json
 
+    def _updates_parameters(self, patient, event):
+        parameters = {'_query': 'MessageHeader.GetNextNewAndClaim'}
+        if patient is not None:
+            parameters['Patient'] = patient
+        if event is not None:
+            parameters['event'] = event
+        return parameters
+
+    def _screen(self, bundle, message, expected_events):
+        # Return None if the message is to be processed, or a function to
+        # acknowledge its update with right away otherwise.
+        errors = bundle.errors()
+        if errors:
+            reason = u', '.join([str(error) for error in errors])
+            logger.error(
+                "Error while reading message '{}': {}".format(
+                    message.fhir_link, reason))
+            return functools.partial(Update.fail, exception=reason)
+        if (expected_events is not None
+                and message.event not in expected_events):
+            logger.warning(
+                "Event '{}' not expected in message '{}'".format(
+                    message.event, message.fhir_link))
+            return functools.partial(
+                Update.fail, exception='Event not expected')
+        if (message.source is not None and
+                message.source.endpoint == self.integration.url):
+            logger.info(
+                'Event "{}" originated from our endpoint '
+                '"{}"'.format(message.event, self.integration.url))
+            # We are the sender ourselves. Ack those messages.
+            return Update.success
+        return None
+
+    def _send_back(self, message):
+        packaging = resource.Resource(self.domain, self.integration)
+        packaging.add_model(message)
+        self.transport.update(message.fhir_link, packaging.get_payload())
+        logger.event(
+            'message.acknowledged',
+            message_id=message.fhir_link,
+            status=message.status.status if message.status else None)
+
+    def ack_batcher(
+            self,
+            size=DEFAULT_ACK_BATCH_SIZE,
+            interval=DEFAULT_ACK_INTERVAL,
+            workers=DEFAULT_WORKERS):
+        """Return an AckBatcher sending back messages with this connector,
+        to pass to `updates` or `consume`.
+        """
+        return AckBatcher(self._send_back, size, interval, workers)
+
     def updates(
         self,
         expected_events=None,
         patient=None,
-        event=None):
+        event=None,
+        lazy=False,
+        acks=None):
 
-        def send_back(message):
-            packaging = resource.Resource(self.domain, self.integration)
-            packaging.add_model(message)
-            self.transport.update(message.fhir_link, packaging.get_payload())
+        # The acknowledgement is sent back from the transaction hook, or
+        # handed over to `acks` to be sent back in a batch.
+        commit = self._send_back if acks is None else acks.add
 
         def send_back_on_transaction(message):
-            return self.integration.transaction_hook(send_back, message)
+            return self.integration.transaction_hook(commit, message)
 
-        parameters = {'_query': 'MessageHeader.GetNextNewAndClaim'}
-        if patient is not None:
-            parameters['Patient'] = patient
-        if event is not None:
-            parameters['event'] = event
+        parameters = self._updates_parameters(patient, event)
 
         while True:
             try:
+                # Claiming a message changes the state of the server, the
+                # query is not replayed if its response is lost.
                 bundle = self._fetch_bundle(
-                    interfaces.MESSAGE_HEADER_URL, parameters)
+                    interfaces.MESSAGE_HEADER_URL, parameters, lazy=lazy,
+                    replay=False)
                 message = bundle.unpack_model(definitions.MessageHeader)
             except interfaces.InvalidBundle as error:
                 logger.error(
@@ -270,36 +618,20 @@ class Connector(object):
                 # We are out of messages
                 break
 
+            logger.event(
+                'message.claimed',
+                message_id=message.fhir_link,
+                message_event=message.event)
             update = Update(message, bundle.unpack, send_back_on_transaction)
-            errors = bundle.errors()
-            if errors:
-                reason = u', '.join([str(error) for error in errors])
-                logger.error(
-                    "Error while reading message '{}': {}".format(
-                        message.fhir_link, reason))
-                with update:
-                    update.fail(reason)
-            elif (expected_events is not None
-                  and message.event not in expected_events):
-                logger.warning(
-                    "Event '{}' not expected in message '{}'".format(
-                        message.event, message.fhir_link))
-                with update:
-                    update.fail('Event not expected')
-            elif (message.source is not None and
-                  message.source.endpoint == self.integration.url):
-                logger.info(
-                    'Event "{}" originated from our endpoint '
-                    '"{}"'.format(message.event, self.integration.url))
-                with update:
-                    # We are the sender ourselves. Ack those messages.
-                    update.success()
-            else:
+            acknowledge = self._screen(bundle, message, expected_events)
+            if acknowledge is None:
                 yield update
+            else:
+                with update:
+                    acknowledge(update)
 
-    def search(
-            self, message_id=None, event=None, status=None, patient=None,
-            batch_size=DEFAULT_COUNT, batch_count=None):
+    def _search_parameters(
+            self, message_id, event, status, patient, batch_size):
         params = {}
         if message_id:
             params['_id'] = message_id
@@ -312,10 +644,103 @@ class Connector(object):
             params['ProcessingStatus'] = status
         if patient:
             params['Patient'] = patient.fhir_link
+        return params
+
+    def consume(
+            self,
+            handler,
+            workers=DEFAULT_WORKERS,
+            expected_events=None,
+            patient=None,
+            event=None,
+            lazy=False,
+            stop=None,
+            acks=None):
+        if stop is None:
+            stop = threading.Event()
+        lock = threading.Lock()
+        processed = []
+        errors = []
+
+        def work():
+            # Every worker claims, processes and acknowledges one message
+            # at a time, so there are at most as many messages in flight
+            # as there are workers.
+            updates = self.updates(
+                expected_events=expected_events,
+                patient=patient,
+                event=event,
+                lazy=lazy,
+                acks=acks)
+            try:
+                while not stop.is_set():
+                    update = next(updates, None)
+                    if update is None:
+                        break
+                    with update:
+                        handler(update)
+                    with lock:
+                        processed.append(update.message.fhir_link)
+            except Exception as error:
+                logger.error(
+                    'Error while processing update: {}'.format(error))
+                with lock:
+                    errors.append(error)
+                stop.set()
+            finally:
+                updates.close()
+
+        threads = []
+        for index in range(workers):
+            thread = threading.Thread(
+                target=work, name='koppeltaal-consumer-{}'.format(index))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(CONSUMER_JOIN_INTERVAL)
+        except KeyboardInterrupt:
+            # Let the workers finish the message they are processing.
+            stop.set()
+            for thread in threads:
+                thread.join()
+            raise
+        if errors:
+            raise errors[0]
+        return len(processed)
+
+    def search(
+            self, message_id=None, event=None, status=None, patient=None,
+            batch_size=DEFAULT_COUNT, batch_count=None):
+        # All the pages are unpacked together once they are fetched, so
+        # that references between them are resolved. Use `search_stream`
+        # to prefetch pages while the current one is unpacked.
+        params = self._search_parameters(
+            message_id, event, status, patient, batch_size)
         return self._fetch_bundle(
             interfaces.MESSAGE_HEADER_URL, params, batch_count).unpack()
 
-    def send(self, event, data, patient=None):
+    def search_stream(
+            self, message_id=None, event=None, status=None, patient=None,
+            batch_size=DEFAULT_COUNT, batch_count=None, prefetch=0):
+        params = self._search_parameters(
+            message_id, event, status, patient, batch_size)
+        for page in self._fetch_pages(
+                interfaces.MESSAGE_HEADER_URL, params, batch_count,
+                prefetch):
+            # Every page is unpacked on its own and released once its
+            # messages are consumed. References to resources that are not
+            # in the same page are not resolved.
+            packaging = bundle.Bundle(
+                self.domain, self.integration, lazy=True)
+            packaging.add_payload(page)
+            for message in packaging.unpack_models(
+                    definitions.MessageHeader):
+                yield message
+
+    def _send_request(self, event, data, patient):
         identifier = utils.messageid()
         source = models.MessageHeaderSource(
             name=unicode(self.integration.name),
@@ -331,19 +756,16 @@ class Connector(object):
             patient=patient)
         request_bundle = bundle.Bundle(self.domain, self.integration)
         request_bundle.add_model(request_message)
-        request_payload = request_bundle.get_payload()
+        return identifier, request_bundle.get_payload()
 
-        try:
-            response = self.transport.create(
-                interfaces.MAILBOX_URL, request_payload)
-        except interfaces.ResponseError as error:
-            response_resource = resource.Resource(
-                self.domain, self.integration)
-            response_resource.add_payload(error.response.json)
-            outcome = response_resource.unpack_model(
-                definitions.OperationOutcome)
-            raise interfaces.OperationOutcomeError(outcome)
+    def _send_error(self, error):
+        response_resource = resource.Resource(self.domain, self.integration)
+        response_resource.add_payload(error.response.json)
+        outcome = response_resource.unpack_model(
+            definitions.OperationOutcome)
+        return interfaces.OperationOutcomeError(outcome)
 
+    def _send_response(self, response, event, identifier):
         response_bundle = bundle.Bundle(self.domain, self.integration)
         response_bundle.add_payload(response.json)
         response_message = response_bundle.unpack_model(
@@ -356,6 +778,61 @@ class Connector(object):
             raise interfaces.MessageResponseError(response_message)
         return response_message.data
 
+    def send(self, event, data, patient=None):
+        start = time.time()
+        identifier, request_payload = self._send_request(event, data, patient)
+        try:
+            response = self.transport.create(
+                interfaces.MAILBOX_URL, request_payload)
+        except interfaces.ResponseError as error:
+            raise self._send_error(error)
+        result = self._send_response(response, event, identifier)
+        logger.event(
+            'message.sent',
+            message_id=identifier,
+            message_event=event,
+            duration=time.time() - start)
+        return result
+
+    def send_many(self, items, concurrency=DEFAULT_WORKERS):
+        # The transport pool should keep at least `concurrency` connections
+        # for them to be reused, see the `pool_maxsize` option.
+        items = list(items)
+        results = [None] * len(items)
+        # Other errors than Koppeltaal errors are raised once all the
+        # items are sent, like `AsyncConnector.send_many` does.
+        failures = []
+        pending = queue.Queue()
+        for index, item in enumerate(items):
+            pending.put((index, item))
+
+        def work():
+            while True:
+                try:
+                    index, item = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    event, data, patient = item
+                    results[index] = self.send(event, data, patient)
+                except interfaces.KoppeltaalError as error:
+                    results[index] = error
+                except Exception as error:
+                    failures.append((index, error))
+
+        threads = []
+        for index in range(min(concurrency, len(items))):
+            thread = threading.Thread(
+                target=work, name='koppeltaal-sender-{}'.format(index))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise min(failures, key=lambda failure: failure[0])[1]
+        return results
+
     def close(self):
         self.transport.close()
 
@@ -408,15 +885,37 @@ class DummyConnector(object):
     def token_from_parameters(self, code, redirect_url):
         return {}
 
-    def updates(self, expected_events=None):
+    def ack_batcher(
+            self,
+            size=DEFAULT_ACK_BATCH_SIZE,
+            interval=DEFAULT_ACK_INTERVAL,
+            workers=DEFAULT_WORKERS):
+        return AckBatcher(lambda message: None, size, interval, workers)
+
+    def updates(
+            self, expected_events=None, patient=None, event=None,
+            lazy=False, acks=None):
         return []
 
+    def consume(
+            self, handler, workers=1, expected_events=None, patient=None,
+            event=None, lazy=False, stop=None, acks=None):
+        return 0
+
     def search(
             self, message_id=None, event=None, status=None, patient=None):
         return None
 
+    def search_stream(
+            self, message_id=None, event=None, status=None, patient=None,
+            batch_size=DEFAULT_COUNT, batch_count=None, prefetch=0):
+        return []
+
     def send(self, event, data, patient=None):
         raise interfaces.DummyError()
 
+    def send_many(self, items, concurrency=DEFAULT_WORKERS):
+        raise interfaces.DummyError()
+
     def close(self):
         pass
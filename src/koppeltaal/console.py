@@ -5,7 +5,7 @@
 """
 
 import argparse
-import json
+import io
 import logging
 import os
 import os.path
@@ -13,7 +13,7 @@ import pdb
 import sys
 import dateutil
 
-from koppeltaal import connector, codes, definitions, interfaces
+from koppeltaal import codec, connector, codes, definitions, interfaces
 from koppeltaal import models, logger, utils
 from koppeltaal.fhir import xml, bundle
 
@@ -63,6 +63,8 @@ OUTPUT = {
     models.Patient: PATIENT_OUTPUT,
     models.Practitioner: PRACTITIONER_OUTPUT,
 }
+OUTPUT.update(
+    (models.slotted(model), output) for model, output in list(OUTPUT.items()))
 
 
 def print_model(model):
@@ -74,7 +76,7 @@ def print_model(model):
 
 
 def print_json(data):
-    print(json.dumps(data, indent=2, sort_keys=True))
+    print(codec.pretty(data))
 
 
 def get_credentials(args):
@@ -126,12 +128,8 @@ def download(connection, directory, msgid=None, msg=None):
     if not os.path.exists(directory):
         os.mkdir(directory)
     filename = os.path.join(directory, '{}-{}.json'.format(ts, msgid))
-    with open(filename, 'w') as output:
-        json.dump(
-            response,
-            output,
-            indent=2,
-            sort_keys=True)
+    with io.open(filename, 'w', encoding='utf-8') as output:
+        output.write(codec.pretty(response))
     print('Wrote message "{}" to "{}"'.format(msgid, filename))
 
 
@@ -142,9 +140,9 @@ def _metadata(args, connection):
 def _validate(args, connection):
     payload = None
     if args.xml:
-        payload = xml.xml2json(args.xml)
+        payload = xml.iterxml2json(args.xml)
     if args.json:
-        payload = json.load(args.json)
+        payload = codec.loads(args.json.read())
     if payload is None:
         print("Please provide an XML or JSON file.")
         return
@@ -160,12 +158,13 @@ def _activities(args, connection):
 
 
 def _messages(args, connection):
-    for message in connection.search(
+    for message in connection.search_stream(
             event=args.event,
             status=args.status,
             patient=DummyResource(args.patient),
             batch_size=args.batch_size,
-            batch_count=args.batch_count):
+            batch_count=args.batch_count,
+            prefetch=args.prefetch):
         if args.save_in_dir:
             download(connection, args.save_in_dir, msg=message)
         else:
@@ -255,6 +254,11 @@ def console():
         '--batch-count',
         type=int,
         help='Number of bundles.')
+    messages.add_argument(
+        '--prefetch',
+        type=int,
+        default=0,
+        help='Number of bundles to fetch ahead while printing.')
     messages.add_argument(
         '--save-in-dir', type=directory,
         help='Save the source for each messsage listed in the query in '
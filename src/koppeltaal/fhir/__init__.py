@@ -38,3 +38,15 @@ REGISTRY = Registry({
     definitions.SubActivity: models.SubActivity,
     definitions.SubActivityDefinition: models.SubActivityDefinition,
 })
+
+
+MODELS = dict(REGISTRY)
+
+
+def use_slotted_models(slotted=True):
+    """Unpack resources into the slotted variants of the models, that use
+    less memory, or back into the regular models.
+    """
+    REGISTRY.update(
+        (definition, models.slotted(factory) if slotted else factory)
+        for definition, factory in MODELS.items())
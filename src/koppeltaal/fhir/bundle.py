@@ -34,6 +34,13 @@ class Entry(resource.Entry):
         self._atom_id = utils.strip_history_from_link(link)
         return self._atom_id
 
+    def references(self):
+        if super(Entry, self).references() is None:
+            return None
+        return tuple(filter(
+            None,
+            (self.history_less_fhir_link, self.fhir_link, self.atom_id)))
+
     def pack(self):
         entry = {
             "content": super(Entry, self).pack(),
@@ -57,7 +64,7 @@ class Bundle(resource.Resource):
         if response['resourceType'] != 'Bundle' or 'entry' not in response:
             raise interfaces.InvalidBundle(self, response)
         for entry in response['entry']:
-            self.items.append(self._create_entry(self.packer, entry=entry))
+            self._add_entry(self._create_entry(self.packer, entry=entry))
 
     def get_payload(self):
         assert self.domain is not None, 'Domain is required to create payloads'
@@ -79,6 +86,14 @@ class Bundle(resource.Resource):
 
     def errors(self):
         errors = []
+        if self.lazy:
+            # Validate the entries that are not unpacked yet, without
+            # unpacking them.
+            for item in self.items:
+                broken = item.validate()
+                if broken is not None:
+                    errors.append(broken)
+            return errors
         for model in self.unpack():
             if interfaces.IBrokenFHIRResource.providedBy(model):
                 errors.append(model)
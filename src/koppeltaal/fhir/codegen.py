@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+
+Pack and unpack functions generated for every definition. They do the
+same work as the `Extension` and `Native` handlers of the packer, with
+the fields of the definition and the validation of their values written
+out, and produce the same payloads, models and errors.
+"""
+
+import datetime
+import six
+
+from koppeltaal import (
+    compat,
+    interfaces,
+    utils)
+from koppeltaal.fhir import (
+    packer,
+    resource)
+
+
+# Key of the value in an extension, by field type.
+EXTENSION_KEYS = {
+    'boolean': 'valueBoolean',
+    'codeable': 'valueCodeableConcept',
+    'code': 'valueCode',
+    'coding': 'valueCoding',
+    'date': 'valueDate',
+    'datetime': 'valueDateTime',
+    'instant': 'valueInstant',
+    'integer': 'valueInteger',
+    'reference': 'valueResource',
+    'string': 'valueString',
+    'versioned reference': 'valueResource',
+}
+
+# Checks of an unpacked `value`, by field type.
+UNPACK_CHECKS = {
+    'boolean': ['not isinstance(value, bool)'],
+    'codeable': [
+        'not isinstance(value, dict)',
+        "'coding' not in value",
+        "not isinstance(value['coding'], list)",
+        "len(value['coding']) != 1"],
+    'code': ['not isinstance(value, unicode)'],
+    'coding': ['not isinstance(value, dict)'],
+    'date': ['not isinstance(value, unicode)'],
+    'datetime': ['not isinstance(value, unicode)'],
+    'instant': ['not isinstance(value, unicode)'],
+    'integer': ['not isinstance(value, int)'],
+    'object': ['not isinstance(value, dict)'],
+    'reference': ['not isinstance(value, dict)'],
+    'string': ['not isinstance(value, unicode)'],
+    'versioned reference': ['not isinstance(value, dict)'],
+}
+
+# Unpacked item, by field type.
+UNPACK_ITEMS = {
+    'boolean': 'value',
+    'codeable': "{binding}.unpack_coding(value['coding'][0])",
+    'code': '{binding}.unpack_code(value)',
+    'coding': '{binding}.unpack_coding(value)',
+    'date': 'parse_date(value)',
+    'datetime': 'parse_datetime(value)',
+    'instant': 'parse_datetime(value)',
+    'integer': 'value',
+    'object': 'packer.unpack(value, {binding})',
+    'reference': 'packer.unpack_reference(value)',
+    'string': 'value',
+    'versioned reference': 'packer.unpack_reference(value)',
+}
+
+# Checks of a `value` to pack, by field type. Objects and references are
+# not checked: every value is an instance of object.
+PACK_CHECKS = {
+    'boolean': 'not isinstance(value, bool)',
+    'codeable': 'not isinstance(value, basestring)',
+    'code': 'not isinstance(value, basestring)',
+    'coding': 'not isinstance(value, basestring)',
+    'date': 'not isinstance(value, date)',
+    'datetime': 'not isinstance(value, datetime)',
+    'instant': 'not isinstance(value, datetime)',
+    'integer': 'not isinstance(value, int)',
+    'string': 'not isinstance(value, unicode)',
+}
+
+# Packed item, by field type.
+PACK_ITEMS = {
+    'boolean': 'value',
+    'codeable': "{{'coding': [{binding}.pack_coding(value)]}}",
+    'code': '{binding}.pack_code(value)',
+    'coding': '{binding}.pack_coding(value)',
+    'date': 'value.isoformat()',
+    'datetime': 'value.isoformat()',
+    'instant': 'value.isoformat()',
+    'integer': 'value',
+    'object': 'packer.pack(value, {binding})',
+    'reference': 'packer.pack_reference(value)',
+    'string': 'value',
+    'versioned reference': 'packer.pack_reference(value, versioned=True)',
+}
+
+NAMESPACE = {
+    'InvalidResource': interfaces.InvalidResource,
+    'InvalidValue': interfaces.InvalidValue,
+    'RequiredMissing': interfaces.RequiredMissing,
+    'basestring': six.string_types,
+    'compat': compat,
+    'date': datetime.date,
+    'missing': object(),
+    'datetime': datetime.datetime,
+    'parse_date': utils.parse_date,
+    'parse_datetime': utils.parse_datetime,
+    'unicode': six.text_type,
+    'utc': utils.utc,
+}
+
+
+class Source(object):
+    """Lines of Python source defining `function`, and the objects they
+    refer to.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.lines = []
+        self.namespace = dict(NAMESPACE)
+        self._level = 0
+
+    def __call__(self, line, *args, **kwargs):
+        self.lines.append(
+            '    ' * self._level + line.format(*args, **kwargs))
+        return self
+
+    def __enter__(self):
+        self._level += 1
+
+    def __exit__(self, *args):
+        self._level -= 1
+
+    def bind(self, name, value):
+        self.namespace[name] = value
+        return name
+
+    def __str__(self):
+        return '\n'.join(self.lines) + '\n'
+
+    def compile(self, name):
+        """Compile the source and return the function it defines.
+        """
+        namespace = dict(self.namespace)
+        code = compile(
+            str(self), '<koppeltaal.fhir.codegen {}>'.format(name), 'exec')
+        exec(code, namespace)
+        return namespace[self.function]
+
+
+class Names(object):
+    """Names of a field, its binding and its default in the generated
+    source.
+    """
+
+    def __init__(self, source, index, field):
+        self.field = source.bind('field{}'.format(index), field)
+        self.binding = None
+        if field.binding is not None:
+            self.binding = source.bind(
+                'binding{}'.format(index), field.binding)
+        self.default = 'None'
+        if field.default is not None:
+            self.default = source.bind(
+                'default{}'.format(index), field.default)
+        self.result = 'result{}'.format(index)
+
+
+def _unpack_item(source, field, names, error):
+    """Write the unpacking of `value` into `item`, raising `InvalidValue`
+    with `error` for invalid values.
+    """
+    for check in UNPACK_CHECKS[field.field_type]:
+        source('if {}:', check)
+        with source:
+            source('raise InvalidValue({}, {})', names.field, error)
+    item = UNPACK_ITEMS[field.field_type].format(binding=names.binding)
+    if field.field_type in ('date', 'datetime', 'instant'):
+        source('try:')
+        with source:
+            source('item = {}', item)
+        source('except ValueError:')
+        with source:
+            source('raise InvalidValue({}, {})', names.field, error)
+    else:
+        source('item = {}', item)
+
+
+def _unpack_extension_item(source, field, names):
+    key = EXTENSION_KEYS.get(field.field_type)
+    if field.field_type == 'object':
+        key = field.binding.queryTaggedValue('extension data type')
+        if key is None:
+            # The extension holds the extensions of the object.
+            source("value = extension.get('extension')")
+            source('if not isinstance(value, list):')
+            with source:
+                source('raise InvalidValue({}, extension)', names.field)
+            source('item = packer.unpack(extension, {})', names.binding)
+            return
+    source('value = extension.get({!r})', key)
+    _unpack_item(source, field, names, 'extension')
+
+
+def _unpack_missing(source, field, names):
+    if not field.optional:
+        source('raise RequiredMissing({})', names.field)
+    elif field.multiple:
+        source('{} = []', names.result)
+    else:
+        source('{} = {}', names.result, names.default)
+
+
+def _unpack_native(source, field, names):
+    value = 'values' if field.multiple else 'value'
+    source('{} = content.get({!r}, missing)', value, field.name)
+    source('if {} is not missing:', value)
+    with source:
+        if field.multiple:
+            source('if not isinstance(values, list):')
+            with source:
+                source('raise InvalidValue({}, values)', names.field)
+            source('if not len(values):')
+            with source:
+                source('raise RequiredMissing({})', names.field)
+            source('{} = []', names.result)
+            source('for value in values:')
+            with source:
+                _unpack_item(source, field, names, 'value')
+                source('{}.append(item)', names.result)
+        else:
+            _unpack_item(source, field, names, 'value')
+            source('{} = item', names.result)
+    source('else:')
+    with source:
+        _unpack_missing(source, field, names)
+
+
+def _unpack_extension(source, field, names):
+    source('extensions = index.get({!r})', field.url)
+    source('if extensions is not None:')
+    with source:
+        if field.multiple:
+            source('{} = []', names.result)
+            source('for extension in extensions:')
+            with source:
+                _unpack_extension_item(source, field, names)
+                source('{}.append(item)', names.result)
+        else:
+            source('if len(extensions) != 1:')
+            with source:
+                source('raise InvalidValue({})', names.field)
+            source('extension = extensions[0]')
+            _unpack_extension_item(source, field, names)
+            source('{} = item', names.result)
+    source('else:')
+    with source:
+        _unpack_missing(source, field, names)
+
+
+def _pack_item(source, field, names):
+    """Write the packing of `value` into `item`.
+    """
+    check = PACK_CHECKS.get(field.field_type)
+    if check is not None:
+        source('if {}:', check)
+        with source:
+            source('raise InvalidValue({}, value)', names.field)
+    if field.field_type == 'instant':
+        # We need a timezone! We assume timezone-naive datetimes
+        # represent UTC times.
+        source('if value.tzinfo is None:')
+        with source:
+            source('value = value.replace(tzinfo=utc, microsecond=0)')
+    source('item = {}', PACK_ITEMS[field.field_type].format(
+        binding=names.binding))
+
+
+def _pack_extension_item(source, field, names):
+    key = EXTENSION_KEYS.get(field.field_type)
+    if field.field_type == 'object':
+        key = field.binding.queryTaggedValue('extension data type')
+        if key is None:
+            # The object is packed in the extension itself.
+            source('extension = {{"url": {!r}}}', field.url)
+            source('extension.update(packer.pack(value, {}))', names.binding)
+            source('extensions.append(extension)')
+            return
+    _pack_item(source, field, names)
+    source('extensions.append({{"url": {!r}, {!r}: item}})', field.url, key)
+
+
+def _pack_native(source, field, names):
+    if field.multiple:
+        source('items = []')
+        source('for value in values:')
+        with source:
+            _pack_item(source, field, names)
+            source('items.append(item)')
+        source('content[{!r}] = items', field.name)
+    else:
+        _pack_item(source, field, names)
+        source('content[{!r}] = item', field.name)
+
+
+def _pack_extension(source, field, names):
+    if field.multiple:
+        source('for value in values:')
+        with source:
+            _pack_extension_item(source, field, names)
+    else:
+        _pack_extension_item(source, field, names)
+
+
+def _pack_field(source, attribute, field, is_extension, names):
+    source('value = getattr(model, {!r}, {})', attribute, names.default)
+    empty = 'value is None'
+    if field.multiple:
+        empty += ' or (isinstance(value, list) and len(value) == 0)'
+    if field.optional:
+        source('if not ({}):', empty)
+    else:
+        source('if {}:', empty)
+        with source:
+            source('raise InvalidValue({}, value)', names.field)
+        source('else:')
+    with source:
+        if field.multiple:
+            source('if not isinstance(value, list):')
+            with source:
+                source('raise InvalidValue({}, value)', names.field)
+            source('values = value')
+        if is_extension:
+            _pack_extension(source, field, names)
+        else:
+            _pack_native(source, field, names)
+
+
+def generate_unpack(definition):
+    """Return the source of the function unpacking the fields of a payload
+    of the definition, as `Packer._unpack_fields`.
+    """
+    plan = packer.plan_for(definition)
+    source = Source('unpack')
+    source('def unpack(packer, payload):')
+    with source:
+        if plan.has_extension:
+            source('index = {{}}')
+            source("if payload and 'extension' in payload:")
+            with source:
+                source("for extension in payload['extension']:")
+                with source:
+                    source("index.setdefault(extension['url'], [])"
+                           ".append(extension)")
+            source('compat.extensions(index)')
+        if plan.has_native:
+            source('content = payload or {{}}')
+        results = []
+        for index, (attribute, field, is_extension, _, _) in enumerate(
+                plan.fields):
+            names = Names(source, index, field)
+            source('# {}', attribute)
+            if is_extension:
+                _unpack_extension(source, field, names)
+            else:
+                _unpack_native(source, field, names)
+            results.append((attribute, names.result))
+        source('return {{')
+        with source:
+            for attribute, result in results:
+                source('{!r}: {},', attribute, result)
+        source('}}')
+    return source
+
+
+def generate_pack(definition):
+    """Return the source of the function packing a model of the
+    definition, as `Packer.pack`.
+    """
+    plan = packer.plan_for(definition)
+    source = Source('pack')
+    source.bind('definition', definition)
+    source('def pack(packer, model):')
+    with source:
+        source('if not definition.providedBy(model):')
+        with source:
+            source('raise InvalidResource(definition, model)')
+        source('content = {{}}')
+        if plan.has_extension:
+            source('extensions = []')
+        for index, (attribute, field, is_extension, _, _) in enumerate(
+                plan.fields):
+            source('# {}', attribute)
+            _pack_field(
+                source, attribute, field, is_extension,
+                Names(source, index, field))
+        # We do not have to add an idref because we do not refer back to
+        # any object. However due to a bug the Javascript connector
+        # requires it in some cases.
+        source("payload = {{'id': packer.idref()}}")
+        if plan.has_extension:
+            source('if extensions:')
+            with source:
+                source("payload['extension'] = extensions")
+        source('payload.update(content)')
+        source('return payload')
+    return source
+
+
+def _unique_urls(definition):
+    urls = [
+        entry.field.url for entry in packer.plan_for(definition).fields
+        if entry.is_extension]
+    return len(urls) == len(set(urls))
+
+
+class Compiled(object):
+    """Pack and unpack functions generated for a definition.
+    """
+
+    def __init__(self, definition):
+        self.definition = definition
+        name = definition.__name__
+        self.unpack = generate_unpack(definition).compile(name)
+        self.pack = generate_pack(definition).compile(name)
+
+
+COMPILED = {}
+
+
+def compiled_for(definition):
+    """Return the (cached) functions generated for the given definition,
+    or None if the definition is not supported.
+    """
+    try:
+        return COMPILED[definition]
+    except KeyError:
+        pass
+    compiled = None
+    # Extensions sharing an URL are packed in the order of their first
+    # value, the generated functions do not support that.
+    if _unique_urls(definition):
+        compiled = Compiled(definition)
+    COMPILED[definition] = compiled
+    return compiled
+
+
+class CompiledFields(object):
+    """Unpack the fields with the functions generated for the definitions.
+    """
+
+    def _unpack_fields(self, payload, definition):
+        compiled = compiled_for(definition)
+        if compiled is None:
+            return super(CompiledFields, self)._unpack_fields(
+                payload, definition)
+        return compiled.unpack(self, payload)
+
+
+class CompiledValidator(CompiledFields, packer.Validator):
+    pass
+
+
+class CompiledPacker(CompiledFields, packer.Packer):
+    """Packer using the functions generated for the definitions.
+    """
+    _create_validator = CompiledValidator
+
+    def pack(self, model, definition):
+        compiled = compiled_for(definition)
+        if compiled is None:
+            return super(CompiledPacker, self).pack(model, definition)
+        return compiled.pack(self, model)
+
+
+def use_compiled_packer(compiled=True):
+    """Pack and unpack resources with the generated functions, or with
+    the regular packer.
+    """
+    resource.Resource._create_packer = (
+        CompiledPacker if compiled else packer.Packer)
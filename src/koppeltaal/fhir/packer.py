@@ -4,8 +4,8 @@
 :license: AGPL, see `LICENSE.md` for more details.
 """
 
+import collections
 import datetime
-import dateutil.parser
 import six
 import zope.interface
 
@@ -47,102 +47,114 @@ class Extension(object):
                 self._index.setdefault(url, []).append(extension)
         compat.extensions(self._index)
 
-    def _unpack_item(self, field, extension):
-        if field.field_type == 'boolean':
-            value = extension.get('valueBoolean')
-            if not isinstance(value, bool):
-                raise interfaces.InvalidValue(field, extension)
-            return value
-
-        if field.field_type == 'codeable':
-            # Note how 'codeable' is actually an extension data type but we
-            # treat it specially here.
-            value = extension.get('valueCodeableConcept')
-            if not isinstance(value, dict):
-                raise interfaces.InvalidValue(field, extension)
-            if 'coding' not in value:
-                raise interfaces.InvalidValue(field, extension)
-            if not isinstance(value['coding'], list):
-                raise interfaces.InvalidValue(field, extension)
-            if len(value['coding']) != 1:
-                raise interfaces.InvalidValue(field, extension)
-            return field.binding.unpack_coding(value['coding'][0])
-
-        if field.field_type == 'code':
-            value = extension.get('valueCode')
-            if not isinstance(value, unicode):
-                raise interfaces.InvalidValue(field, extension)
-            return field.binding.unpack_code(value)
-
-        if field.field_type == 'coding':
-            # Note how 'coding' is actually an extension data type but we
-            # treat it specially here.
-            value = extension.get('valueCoding')
-            if not isinstance(value, dict):
-                raise interfaces.InvalidValue(field, extension)
-            return field.binding.unpack_coding(value)
-
-        if field.field_type == 'date':
-            value = extension.get('valueDate')
-            if not isinstance(value, unicode):
-                raise interfaces.InvalidValue(field, extension)
-            try:
-                return dateutil.parser.parse(value).date()
-            except ValueError:
-                raise interfaces.InvalidValue(field, extension)
-
-        if field.field_type == 'datetime':
-            value = extension.get('valueDateTime')
-            if not isinstance(value, unicode):
-                raise interfaces.InvalidValue(field, extension)
-            try:
-                return dateutil.parser.parse(value)
-            except ValueError:
-                raise interfaces.InvalidValue(field, extension)
-
-        if field.field_type == 'instant':
-            value = extension.get('valueInstant')
-            if not isinstance(value, unicode):
-                raise interfaces.InvalidValue(field, extension)
-            try:
-                return dateutil.parser.parse(value)
-            except ValueError:
-                raise interfaces.InvalidValue(field, extension)
-
-        if field.field_type == 'integer':
-            value = extension.get('valueInteger')
-            if not isinstance(value, int):
-                raise interfaces.InvalidValue(field, extension)
-            return value
-
-        if field.field_type == 'object':
-            key = field.binding.queryTaggedValue('extension data type')
-            if key is None:
-                value = extension.get('extension')
-                if not isinstance(value, list):
-                    raise interfaces.InvalidValue(field, extension)
-                return self._packer.unpack(extension, field.binding)
-
-            value = extension.get(key)
-            if not isinstance(value, dict):
-                raise interfaces.InvalidValue(field, extension)
-            return self._packer.unpack(value, field.binding)
-
-        if field.field_type in {'reference', 'versioned reference'}:
-            value = extension.get('valueResource')
-            if not isinstance(value, dict):
-                raise interfaces.InvalidValue(field, extension)
-            return self._packer.unpack_reference(value)
-
-        if field.field_type == 'string':
-            value = extension.get('valueString')
-            if not isinstance(value, unicode):
+    def _unpack_boolean(self, field, extension):
+        value = extension.get('valueBoolean')
+        if not isinstance(value, bool):
+            raise interfaces.InvalidValue(field, extension)
+        return value
+
+    def _unpack_codeable(self, field, extension):
+        # Note how 'codeable' is actually an extension data type but we
+        # treat it specially here.
+        value = extension.get('valueCodeableConcept')
+        if not isinstance(value, dict):
+            raise interfaces.InvalidValue(field, extension)
+        if 'coding' not in value:
+            raise interfaces.InvalidValue(field, extension)
+        if not isinstance(value['coding'], list):
+            raise interfaces.InvalidValue(field, extension)
+        if len(value['coding']) != 1:
+            raise interfaces.InvalidValue(field, extension)
+        return field.binding.unpack_coding(value['coding'][0])
+
+    def _unpack_code(self, field, extension):
+        value = extension.get('valueCode')
+        if not isinstance(value, unicode):
+            raise interfaces.InvalidValue(field, extension)
+        return field.binding.unpack_code(value)
+
+    def _unpack_coding(self, field, extension):
+        # Note how 'coding' is actually an extension data type but we
+        # treat it specially here.
+        value = extension.get('valueCoding')
+        if not isinstance(value, dict):
+            raise interfaces.InvalidValue(field, extension)
+        return field.binding.unpack_coding(value)
+
+    def _unpack_date(self, field, extension):
+        value = extension.get('valueDate')
+        if not isinstance(value, unicode):
+            raise interfaces.InvalidValue(field, extension)
+        try:
+            return utils.parse_date(value)
+        except ValueError:
+            raise interfaces.InvalidValue(field, extension)
+
+    def _unpack_datetime(self, field, extension):
+        value = extension.get('valueDateTime')
+        if not isinstance(value, unicode):
+            raise interfaces.InvalidValue(field, extension)
+        try:
+            return utils.parse_datetime(value)
+        except ValueError:
+            raise interfaces.InvalidValue(field, extension)
+
+    def _unpack_instant(self, field, extension):
+        value = extension.get('valueInstant')
+        if not isinstance(value, unicode):
+            raise interfaces.InvalidValue(field, extension)
+        try:
+            return utils.parse_datetime(value)
+        except ValueError:
+            raise interfaces.InvalidValue(field, extension)
+
+    def _unpack_integer(self, field, extension):
+        value = extension.get('valueInteger')
+        if not isinstance(value, int):
+            raise interfaces.InvalidValue(field, extension)
+        return value
+
+    def _unpack_object(self, field, extension):
+        key = field.binding.queryTaggedValue('extension data type')
+        if key is None:
+            value = extension.get('extension')
+            if not isinstance(value, list):
                 raise interfaces.InvalidValue(field, extension)
-            return value
-
-        raise NotImplementedError()
-
-    def unpack(self, field):
+            return self._packer.unpack(extension, field.binding)
+
+        value = extension.get(key)
+        if not isinstance(value, dict):
+            raise interfaces.InvalidValue(field, extension)
+        return self._packer.unpack(value, field.binding)
+
+    def _unpack_reference(self, field, extension):
+        value = extension.get('valueResource')
+        if not isinstance(value, dict):
+            raise interfaces.InvalidValue(field, extension)
+        return self._packer.unpack_reference(value)
+
+    def _unpack_string(self, field, extension):
+        value = extension.get('valueString')
+        if not isinstance(value, unicode):
+            raise interfaces.InvalidValue(field, extension)
+        return value
+
+    _unpackers = {
+        'boolean': _unpack_boolean,
+        'codeable': _unpack_codeable,
+        'code': _unpack_code,
+        'coding': _unpack_coding,
+        'date': _unpack_date,
+        'datetime': _unpack_datetime,
+        'instant': _unpack_instant,
+        'integer': _unpack_integer,
+        'object': _unpack_object,
+        'reference': _unpack_reference,
+        'string': _unpack_string,
+        'versioned reference': _unpack_reference,
+    }
+
+    def unpack(self, field, unpack_item):
         if field.url not in self._index:
             if field.optional:
                 if field.multiple:
@@ -153,12 +165,12 @@ class Extension(object):
         if field.multiple:
             values = []
             for extension in extensions:
-                values.append(self._unpack_item(field, extension))
+                values.append(unpack_item(self, field, extension))
             return values
 
         if len(extensions) != 1:
             raise interfaces.InvalidValue(field)
-        return self._unpack_item(field, extensions[0])
+        return unpack_item(self, field, extensions[0])
 
     @property
     def payload(self):
@@ -169,83 +181,95 @@ class Extension(object):
             return {"extension": all_extensions}
         return {}
 
-    def _pack_item(self, field, value):
-        if field.field_type == 'boolean':
-            if not isinstance(value, bool):
-                raise interfaces.InvalidValue(field, value)
-            return {'valueBoolean': value}
-
-        if field.field_type == 'code':
-            if not isinstance(value, basestring):
-                raise interfaces.InvalidValue(field, value)
-            return {'valueCode': field.binding.pack_code(value)}
-
-        if field.field_type == 'codeable':
-            # Note how 'codeable' is actually an extension data type but we
-            # treat it specially here.
-            if not isinstance(value, basestring):
-                raise interfaces.InvalidValue(field, value)
-            return {"valueCodeableConcept":
-                    {"coding": [field.binding.pack_coding(value)]}}
-
-        if field.field_type == 'coding':
-            # Note how 'coding' is actually an extension data type but we
-            # treat it specially here.
-            if not isinstance(value, basestring):
-                raise interfaces.InvalidValue(field, value)
-            return {'valueCoding': field.binding.pack_coding(value)}
-
-        if field.field_type == 'date':
-            if not isinstance(value, datetime.date):
-                raise interfaces.InvalidValue(field, value)
-            return {'valueDate': value.isoformat()}
-
-        if field.field_type == 'datetime':
-            if not isinstance(value, datetime.datetime):
-                raise interfaces.InvalidValue(field, value)
-            return {'valueDateTime': value.isoformat()}
-
-        if field.field_type == 'instant':
-            if not isinstance(value, datetime.datetime):
-                raise interfaces.InvalidValue(field, value)
-            if value.tzinfo is None:
-                # We need a timezone! We assume timezone-naive datetimes
-                # represent UTC times. So we add the UTC tzinfo here.
-                value = value.replace(tzinfo=utils.utc, microsecond=0)
-            return {'valueInstant': value.isoformat()}
-
-        if field.field_type == 'integer':
-            if not isinstance(value, int):
-                raise interfaces.InvalidValue(field, value)
-            return {'valueInteger': value}
-
-        if field.field_type == 'object':
-            if not isinstance(value, object):
-                raise interfaces.InvalidValue(field, value)
-            key = field.binding.queryTaggedValue('extension data type')
-            if key is None:
-                return self._packer.pack(value, field.binding)
-            return {key: self._packer.pack(value, field.binding)}
-
-        if field.field_type == 'reference':
-            if not isinstance(value, object):
-                raise interfaces.InvalidValue(field, value)
-            return {'valueResource': self._packer.pack_reference(value)}
-
-        if field.field_type == 'versioned reference':
-            if not isinstance(value, object):
-                raise interfaces.InvalidValue(field, value)
-            ref = self._packer.pack_reference(value, versioned=True)
-            return {'valueResource': ref}
-
-        if field.field_type == 'string':
-            if not isinstance(value, unicode):
-                raise interfaces.InvalidValue(field, value)
-            return {'valueString': value}
-
-        raise NotImplementedError()
-
-    def pack(self, field, value):
+    def _pack_boolean(self, field, value):
+        if not isinstance(value, bool):
+            raise interfaces.InvalidValue(field, value)
+        return {'valueBoolean': value}
+
+    def _pack_code(self, field, value):
+        if not isinstance(value, basestring):
+            raise interfaces.InvalidValue(field, value)
+        return {'valueCode': field.binding.pack_code(value)}
+
+    def _pack_codeable(self, field, value):
+        # Note how 'codeable' is actually an extension data type but we
+        # treat it specially here.
+        if not isinstance(value, basestring):
+            raise interfaces.InvalidValue(field, value)
+        return {"valueCodeableConcept":
+                {"coding": [field.binding.pack_coding(value)]}}
+
+    def _pack_coding(self, field, value):
+        # Note how 'coding' is actually an extension data type but we
+        # treat it specially here.
+        if not isinstance(value, basestring):
+            raise interfaces.InvalidValue(field, value)
+        return {'valueCoding': field.binding.pack_coding(value)}
+
+    def _pack_date(self, field, value):
+        if not isinstance(value, datetime.date):
+            raise interfaces.InvalidValue(field, value)
+        return {'valueDate': value.isoformat()}
+
+    def _pack_datetime(self, field, value):
+        if not isinstance(value, datetime.datetime):
+            raise interfaces.InvalidValue(field, value)
+        return {'valueDateTime': value.isoformat()}
+
+    def _pack_instant(self, field, value):
+        if not isinstance(value, datetime.datetime):
+            raise interfaces.InvalidValue(field, value)
+        if value.tzinfo is None:
+            # We need a timezone! We assume timezone-naive datetimes
+            # represent UTC times. So we add the UTC tzinfo here.
+            value = value.replace(tzinfo=utils.utc, microsecond=0)
+        return {'valueInstant': value.isoformat()}
+
+    def _pack_integer(self, field, value):
+        if not isinstance(value, int):
+            raise interfaces.InvalidValue(field, value)
+        return {'valueInteger': value}
+
+    def _pack_object(self, field, value):
+        if not isinstance(value, object):
+            raise interfaces.InvalidValue(field, value)
+        key = field.binding.queryTaggedValue('extension data type')
+        if key is None:
+            return self._packer.pack(value, field.binding)
+        return {key: self._packer.pack(value, field.binding)}
+
+    def _pack_reference(self, field, value):
+        if not isinstance(value, object):
+            raise interfaces.InvalidValue(field, value)
+        return {'valueResource': self._packer.pack_reference(value)}
+
+    def _pack_versioned_reference(self, field, value):
+        if not isinstance(value, object):
+            raise interfaces.InvalidValue(field, value)
+        ref = self._packer.pack_reference(value, versioned=True)
+        return {'valueResource': ref}
+
+    def _pack_string(self, field, value):
+        if not isinstance(value, unicode):
+            raise interfaces.InvalidValue(field, value)
+        return {'valueString': value}
+
+    _packers = {
+        'boolean': _pack_boolean,
+        'codeable': _pack_codeable,
+        'code': _pack_code,
+        'coding': _pack_coding,
+        'date': _pack_date,
+        'datetime': _pack_datetime,
+        'instant': _pack_instant,
+        'integer': _pack_integer,
+        'object': _pack_object,
+        'reference': _pack_reference,
+        'string': _pack_string,
+        'versioned reference': _pack_versioned_reference,
+    }
+
+    def pack(self, field, value, pack_item):
         if field.is_empty(value):
             if not field.optional:
                 raise interfaces.InvalidValue(field, value)
@@ -255,10 +279,11 @@ class Extension(object):
                 raise interfaces.InvalidValue(field, value)
         else:
             value = [value]
+        extensions = self._index.setdefault(field.url, [])
         for single_value in value:
             extension = {"url": field.url}
-            extension.update(self._pack_item(field, single_value))
-            self._index.setdefault(field.url, []).append(extension)
+            extension.update(pack_item(self, field, single_value))
+            extensions.append(extension)
 
 
 class Native(object):
@@ -271,84 +296,88 @@ class Native(object):
     def payload(self):
         return self._content.copy()
 
-    def _unpack_item(self, field, value):
-        if field.field_type == 'boolean':
-            if not isinstance(value, bool):
-                raise interfaces.InvalidValue(field, value)
-            return value
-
-        if field.field_type == 'codeable':
-            # Note how 'codeable' is actually an extension data type but we
-            # treat it specially here.
-            if not isinstance(value, dict):
-                raise interfaces.InvalidValue(field, value)
-            if 'coding' not in value:
-                raise interfaces.InvalidValue(field, value)
-            if not isinstance(value['coding'], list):
-                raise interfaces.InvalidValue(field, value)
-            if len(value['coding']) != 1:
-                raise interfaces.InvalidValue(field, value)
-            return field.binding.unpack_coding(value['coding'][0])
-
-        if field.field_type == 'code':
-            if not isinstance(value, unicode):
-                raise interfaces.InvalidValue(field, value)
-            return field.binding.unpack_code(value)
-
-        if field.field_type == 'coding':
-            # Note how 'coding' is actually an extension data type but we
-            # treat it specially here.
-            if not isinstance(value, dict):
-                raise interfaces.InvalidValue(field, value)
-            return field.binding.unpack_coding(value)
-
-        if field.field_type == 'date':
-            if not isinstance(value, unicode):
-                raise interfaces.InvalidValue(field, value)
-            try:
-                return dateutil.parser.parse(value).date()
-            except ValueError:
-                raise interfaces.InvalidValue(field, value)
-
-        if field.field_type == 'datetime':
-            if not isinstance(value, unicode):
-                raise interfaces.InvalidValue(field, value)
-            try:
-                return dateutil.parser.parse(value)
-            except ValueError:
-                raise interfaces.InvalidValue(field, value)
-
-        if field.field_type == 'instant':
-            if not isinstance(value, unicode):
-                raise interfaces.InvalidValue(field, value)
-            try:
-                return dateutil.parser.parse(value)
-            except ValueError:
-                raise interfaces.InvalidValue(field, value)
-
-        if field.field_type == 'integer':
-            if not isinstance(value, int):
-                raise interfaces.InvalidValue(field, value)
-            return value
-
-        if field.field_type == 'object':
-            if not isinstance(value, dict):
-                raise interfaces.InvalidValue(field, value)
-            return self._packer.unpack(value, field.binding)
-
-        if field.field_type in {'reference', 'versioned reference'}:
-            if not isinstance(value, dict):
-                raise interfaces.InvalidValue(field, value)
-            return self._packer.unpack_reference(value)
-
-        if field.field_type == 'string':
-            if not isinstance(value, unicode):
-                raise interfaces.InvalidValue(field, value)
-            return value
-
-        raise NotImplementedError()
+    def _unpack_boolean(self, field, value):
+        if not isinstance(value, bool):
+            raise interfaces.InvalidValue(field, value)
+        return value
+
+    def _unpack_codeable(self, field, value):
+        # Note how 'codeable' is actually an extension data type but we
+        # treat it specially here.
+        if not isinstance(value, dict):
+            raise interfaces.InvalidValue(field, value)
+        if 'coding' not in value:
+            raise interfaces.InvalidValue(field, value)
+        if not isinstance(value['coding'], list):
+            raise interfaces.InvalidValue(field, value)
+        if len(value['coding']) != 1:
+            raise interfaces.InvalidValue(field, value)
+        return field.binding.unpack_coding(value['coding'][0])
+
+    def _unpack_code(self, field, value):
+        if not isinstance(value, unicode):
+            raise interfaces.InvalidValue(field, value)
+        return field.binding.unpack_code(value)
+
+    def _unpack_coding(self, field, value):
+        # Note how 'coding' is actually an extension data type but we
+        # treat it specially here.
+        if not isinstance(value, dict):
+            raise interfaces.InvalidValue(field, value)
+        return field.binding.unpack_coding(value)
+
+    def _unpack_date(self, field, value):
+        if not isinstance(value, unicode):
+            raise interfaces.InvalidValue(field, value)
+        try:
+            return utils.parse_date(value)
+        except ValueError:
+            raise interfaces.InvalidValue(field, value)
 
-    def unpack(self, field):
+    def _unpack_datetime(self, field, value):
+        if not isinstance(value, unicode):
+            raise interfaces.InvalidValue(field, value)
+        try:
+            return utils.parse_datetime(value)
+        except ValueError:
+            raise interfaces.InvalidValue(field, value)
+
+    def _unpack_integer(self, field, value):
+        if not isinstance(value, int):
+            raise interfaces.InvalidValue(field, value)
+        return value
+
+    def _unpack_object(self, field, value):
+        if not isinstance(value, dict):
+            raise interfaces.InvalidValue(field, value)
+        return self._packer.unpack(value, field.binding)
+
+    def _unpack_reference(self, field, value):
+        if not isinstance(value, dict):
+            raise interfaces.InvalidValue(field, value)
+        return self._packer.unpack_reference(value)
+
+    def _unpack_string(self, field, value):
+        if not isinstance(value, unicode):
+            raise interfaces.InvalidValue(field, value)
+        return value
+
+    _unpackers = {
+        'boolean': _unpack_boolean,
+        'codeable': _unpack_codeable,
+        'code': _unpack_code,
+        'coding': _unpack_coding,
+        'date': _unpack_date,
+        'datetime': _unpack_datetime,
+        'instant': _unpack_datetime,
+        'integer': _unpack_integer,
+        'object': _unpack_object,
+        'reference': _unpack_reference,
+        'string': _unpack_string,
+        'versioned reference': _unpack_reference,
+    }
+
+    def unpack(self, field, unpack_item):
         if field.name not in self._content:
             if field.optional:
                 if field.multiple:
@@ -364,93 +393,150 @@ class Native(object):
                 raise interfaces.InvalidValue(field, value)
             if not len(value):
                 raise interfaces.RequiredMissing(field)
-            if field.multiple:
-                return [self._unpack_item(field, v) for v in value]
-            value = value[0]
-        return self._unpack_item(field, value)
-
-    def _pack_item(self, field, value):
-        if field.field_type == 'boolean':
-            if not isinstance(value, bool):
-                raise interfaces.InvalidValue(field, value)
-            return value
-
-        if field.field_type == 'codeable':
-            # Note how 'codeable' is actually an extension data type but we
-            # treat it specially here.
-            if not isinstance(value, basestring):
-                raise interfaces.InvalidValue(field, value)
-            return {"coding": [field.binding.pack_coding(value)]}
-
-        if field.field_type == 'code':
-            if not isinstance(value, basestring):
+            return [unpack_item(self, field, v) for v in value]
+        return unpack_item(self, field, value)
+
+    def _pack_boolean(self, field, value):
+        if not isinstance(value, bool):
+            raise interfaces.InvalidValue(field, value)
+        return value
+
+    def _pack_codeable(self, field, value):
+        # Note how 'codeable' is actually an extension data type but we
+        # treat it specially here.
+        if not isinstance(value, basestring):
+            raise interfaces.InvalidValue(field, value)
+        return {"coding": [field.binding.pack_coding(value)]}
+
+    def _pack_code(self, field, value):
+        if not isinstance(value, basestring):
+            raise interfaces.InvalidValue(field, value)
+        return field.binding.pack_code(value)
+
+    def _pack_coding(self, field, value):
+        # Note how 'coding' is actually an extension data type but we
+        # treat it specially here.
+        if not isinstance(value, basestring):
+            raise interfaces.InvalidValue(field, value)
+        return field.binding.pack_coding(value)
+
+    def _pack_date(self, field, value):
+        if not isinstance(value, datetime.date):
+            raise interfaces.InvalidValue(field, value)
+        return value.isoformat()
+
+    def _pack_datetime(self, field, value):
+        if not isinstance(value, datetime.datetime):
+            raise interfaces.InvalidValue(field, value)
+        return value.isoformat()
+
+    def _pack_instant(self, field, value):
+        if not isinstance(value, datetime.datetime):
+            raise interfaces.InvalidValue(field, value)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=utils.utc, microsecond=0)
+        return value.isoformat()
+
+    def _pack_integer(self, field, value):
+        if not isinstance(value, int):
+            raise interfaces.InvalidValue(field, value)
+        return value
+
+    def _pack_object(self, field, value):
+        if not isinstance(value, object):
+            raise interfaces.InvalidValue(field, value)
+        return self._packer.pack(value, field.binding)
+
+    def _pack_reference(self, field, value):
+        if not isinstance(value, object):
+            raise interfaces.InvalidValue(field, value)
+        return self._packer.pack_reference(value)
+
+    def _pack_versioned_reference(self, field, value):
+        if not isinstance(value, object):
+            raise interfaces.InvalidValue(field, value)
+        return self._packer.pack_reference(value, versioned=True)
+
+    def _pack_string(self, field, value):
+        if not isinstance(value, unicode):
+            raise interfaces.InvalidValue(field, value)
+        return value
+
+    _packers = {
+        'boolean': _pack_boolean,
+        'codeable': _pack_codeable,
+        'code': _pack_code,
+        'coding': _pack_coding,
+        'date': _pack_date,
+        'datetime': _pack_datetime,
+        'instant': _pack_instant,
+        'integer': _pack_integer,
+        'object': _pack_object,
+        'reference': _pack_reference,
+        'string': _pack_string,
+        'versioned reference': _pack_versioned_reference,
+    }
+
+    def pack(self, field, value, pack_item):
+        if field.is_empty(value):
+            if not field.optional:
                 raise interfaces.InvalidValue(field, value)
-            return field.binding.pack_code(value)
-
-        if field.field_type == 'coding':
-            # Note how 'coding' is actually an extension data type but we
-            # treat it specially here.
-            if not isinstance(value, basestring):
+            return
+        if field.multiple:
+            if not isinstance(value, list):
                 raise interfaces.InvalidValue(field, value)
-            return field.binding.pack_coding(value)
+            item = [pack_item(self, field, v) for v in value]
+        else:
+            assert field.multiple is False
+            item = pack_item(self, field, value)
+        self._content[field.name] = item
 
-        if field.field_type == 'date':
-            if not isinstance(value, datetime.date):
-                raise interfaces.InvalidValue(field, value)
-            return value.isoformat()
 
-        if field.field_type == 'datetime':
-            if not isinstance(value, datetime.datetime):
-                raise interfaces.InvalidValue(field, value)
-            return value.isoformat()
+PlanField = collections.namedtuple(
+    'PlanField',
+    ['name', 'field', 'is_extension', 'unpack_item', 'pack_item'])
 
-        if field.field_type == 'instant':
-            if not isinstance(value, datetime.datetime):
-                raise interfaces.InvalidValue(field, value)
-            if value.tzinfo is None:
-                value = value.replace(tzinfo=utils.utc, microsecond=0)
-            return value.isoformat()
 
-        if field.field_type == 'integer':
-            if not isinstance(value, int):
-                raise interfaces.InvalidValue(field, value)
-            return value
+class Plan(object):
+    """Fields of a definition, computed once so that (un)packing a
+    resource does not need to inspect the definition again.
 
-        if field.field_type == 'object':
-            if not isinstance(value, object):
-                raise interfaces.InvalidValue(field, value)
-            return self._packer.pack(value, field.binding)
+    The fields are kept in definition order, as packing nested objects
+    allocates idrefs in that order. Each field is flagged as either a
+    native or an extension field, and comes with the functions of Native
+    or Extension (un)packing its items.
+    """
 
-        if field.field_type == 'reference':
-            if not isinstance(value, object):
-                raise interfaces.InvalidValue(field, value)
-            return self._packer.pack_reference(value)
+    def __init__(self, definition):
+        self.definition = definition
+        self.fields = []
+        for name, field in definition.namesAndDescriptions():
+            if not isinstance(field, definitions.Field):
+                continue
+            is_extension = field.extension is not None
+            handlers = Extension if is_extension else Native
+            self.fields.append(PlanField(
+                name,
+                field,
+                is_extension,
+                handlers._unpackers[field.field_type],
+                handlers._packers[field.field_type]))
+        self.has_native = any(
+            not entry.is_extension for entry in self.fields)
+        self.has_extension = any(
+            entry.is_extension for entry in self.fields)
 
-        if field.field_type == 'versioned reference':
-            if not isinstance(value, object):
-                raise interfaces.InvalidValue(field, value)
-            return self._packer.pack_reference(value, versioned=True)
 
-        if field.field_type == 'string':
-            if not isinstance(value, unicode):
-                raise interfaces.InvalidValue(field, value)
-            return value
+PLANS = {}
 
-        raise NotImplementedError()
 
-    def pack(self, field, value):
-        if field.is_empty(value):
-            if not field.optional:
-                raise interfaces.InvalidValue(field, value)
-            return
-        if field.multiple:
-            if not isinstance(value, list):
-                raise interfaces.InvalidValue(field, value)
-            item = [self._pack_item(field, v) for v in value]
-        else:
-            assert field.multiple is False
-            item = self._pack_item(field, value)
-        self._content[field.name] = item
+def plan_for(definition):
+    """Return the (cached) plan for the given definition.
+    """
+    plan = PLANS.get(definition)
+    if plan is None:
+        plan = PLANS[definition] = Plan(definition)
+    return plan
 
 
 class Packer(object):
@@ -464,48 +550,59 @@ class Packer(object):
         self._idref += 1
         return 'ref{0:03}'.format(self._idref)
 
+    def _unpack_fields(self, payload, definition):
+        plan = plan_for(definition)
+        # Indexed by the is_extension flag of the plan. Definitions
+        # without extension fields do not need to index extensions.
+        unpackers = (
+            Native(self, payload),
+            Extension(self, payload) if plan.has_extension else None)
+        data = {}
+        for name, field, is_extension, unpack_item, _ in plan.fields:
+            data[name] = unpackers[is_extension].unpack(field, unpack_item)
+        return data
+
     def unpack(self, payload, definition, allow_broken=False):
         factory = fhir.REGISTRY.model_for_definition(definition)
         if factory is None:
             return None
 
         try:
-            extension = Extension(self, payload)
-            native = Native(self, payload)
-            data = {}
-            for name, field in definition.namesAndDescriptions():
-                if not isinstance(field, definitions.Field):
-                    continue
-                if field.extension is None:
-                    data[name] = native.unpack(field)
-                else:
-                    data[name] = extension.unpack(field)
-            return factory(**data)
+            return factory(**self._unpack_fields(payload, definition))
         except interfaces.InvalidValue as error:
             if allow_broken:
                 return BrokenResource(error, payload)
             raise
 
-    def pack(self, model, definition):
-        extension = Extension(self)
-        native = Native(self)
+    def validate(self, payload, definition):
+        """Validate the payload against the definition without creating
+        models or resolving references. Return the error if the payload
+        is invalid, None otherwise.
+        """
+        try:
+            self._create_validator(self.resource, self.fhir_link).unpack(
+                payload, definition)
+        except interfaces.InvalidValue as error:
+            return error
+        return None
 
+    def pack(self, model, definition):
         if not definition.providedBy(model):
             raise interfaces.InvalidResource(definition, model)
 
-        for name, field in definition.namesAndDescriptions():
-            if not isinstance(field, definitions.Field):
-                continue
+        plan = plan_for(definition)
+        native = Native(self)
+        extension = Extension(self) if plan.has_extension else None
+        packers = (native, extension)
+        for name, field, is_extension, _, pack_item in plan.fields:
             value = getattr(model, name, field.default)
-            if field.extension is None:
-                native.pack(field, value)
-            else:
-                extension.pack(field, value)
+            packers[is_extension].pack(field, value, pack_item)
         # We do not have to add an idref because we do not refer back to
         # any object. However due to a bug the Javascript connector
         # requires it in some cases.
         payload = {'id': self.idref()}
-        payload.update(extension.payload)
+        if extension is not None:
+            payload.update(extension.payload)
         payload.update(native.payload)
         return payload
 
@@ -534,3 +631,24 @@ class Packer(object):
         if not versioned:
             ref = utils.strip_history_from_link(ref)
         return {'reference': ref}
+
+
+class Validator(Packer):
+    """Packer that only validates payloads. It does not create any model
+    nor resolve references to other resources.
+    """
+
+    def unpack(self, payload, definition, allow_broken=False):
+        if fhir.REGISTRY.model_for_definition(definition) is None:
+            return None
+        self._unpack_fields(payload, definition)
+        return payload
+
+    def unpack_reference(self, value):
+        if not ('reference' in value or 'display' in value):
+            raise interfaces.InvalidReference(value)
+        return value
+
+
+# Validator is a Packer, it can only be set once both are defined.
+Packer._create_validator = Validator
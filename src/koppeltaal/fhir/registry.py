@@ -21,53 +21,134 @@ def _inspect_definition(fields, definition):
             _inspect_definition(fields, field.binding)
 
 
+def _inspect_field_types(types, parent_name, definition):
+    for name, field in definition.namesAndDescriptions():
+        if not isinstance(field, definitions.Field):
+            continue
+        if field.extension:
+            continue
+        if field.field_type == 'object':
+            _inspect_field_types(types, field.name, field.binding)
+            continue
+        key = (parent_name, field.name)
+        assert types.get(key, field.field_type) == field.field_type, \
+            'Conflicting field types for {}.{}'.format(*key)
+        types[key] = field.field_type
+
+
+def _invalidating(method):
+
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.invalidate()
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
 class Registry(dict):
+    """Mapping of definitions to model factories.
 
-    def repeatable_field_names(self, fhir_type):
-        fields = {'extension', 'coding'}
-        if fhir_type == 'Other':
-            return fields
-
-        for definition in self.keys():
-            defined_type = definition.queryTaggedValue('resource type')
-            if not defined_type:
-                continue
-            if defined_type[0] != fhir_type:
-                continue
-            _inspect_definition(fields, definition)
+    Lookups by resource type, by model, of repeatable field names and of
+    field types are answered from indexes. Those are built on first use and
+    discarded whenever the registry is modified.
+    """
+    _types = None
+    _repeatable = None
+    _specifications = None
+    _field_types = None
+
+    __setitem__ = _invalidating(dict.__setitem__)
+    __delitem__ = _invalidating(dict.__delitem__)
+    clear = _invalidating(dict.clear)
+    pop = _invalidating(dict.pop)
+    popitem = _invalidating(dict.popitem)
+    setdefault = _invalidating(dict.setdefault)
+    update = _invalidating(dict.update)
 
+    def invalidate(self):
+        self._types = None
+        self._repeatable = None
+        self._specifications = None
+        self._field_types = None
+
+    def _type_index(self):
+        types = self._types
+        if types is None:
+            types = {}
+            for definition in self.keys():
+                defined_type = definition.queryTaggedValue('resource type')
+                if not defined_type:
+                    continue
+                assert defined_type[0] not in types, \
+                    'Too many definitions for resource type'
+                types[defined_type[0]] = definition
+            self._types = types
+        return types
+
+    def repeatable_field_names(self, fhir_type):
+        repeatable = self._repeatable
+        if repeatable is None:
+            repeatable = self._repeatable = {}
+        fields = repeatable.get(fhir_type)
+        if fields is None:
+            fields = {'extension', 'coding'}
+            if fhir_type != 'Other':
+                definition = self._type_index().get(fhir_type)
+                if definition is not None:
+                    _inspect_definition(fields, definition)
+            fields = repeatable[fhir_type] = frozenset(fields)
         return fields
 
+    def field_type(self, parent_name, field_name):
+        """Return the type of the field `field_name` of the resource type or
+        object field `parent_name`, or None if there is no such field.
+        """
+        types = self._field_types
+        if types is None:
+            types = {}
+            for definition in self.keys():
+                defined_type = definition.queryTaggedValue('resource type')
+                if defined_type:
+                    _inspect_field_types(types, defined_type[0], definition)
+            self._field_types = types
+        return types.get((parent_name, field_name))
+
     def definition_for_type(self, resource_type):
-        definitions = []
-        for definition in self.keys():
-            defined_type = definition.queryTaggedValue('resource type')
-            if defined_type and defined_type[0] == resource_type:
-                definitions.append(definition)
-        assert len(definitions) < 2, 'Too many definitions for resource type'
-        if definitions:
-            return definitions[0]
-        return None
+        return self._type_index().get(resource_type)
 
     def model_for_definition(self, definition):
         return self.get(definition)
 
     def definition_for_model(self, model):
+        # The specification provided by a model is shared by all the
+        # instances of its class, unless interfaces are directly provided
+        # by the instance.
+        specification = zope.interface.providedBy(model)
+        specifications = self._specifications
+        if specifications is None:
+            specifications = self._specifications = {}
+        try:
+            return specifications[specification]
+        except KeyError:
+            pass
         definitions = [
-            d for d in zope.interface.providedBy(model).interfaces()
-            if d in self]
+            d for d in specification.interfaces() if d in self]
         assert len(definitions) < 2, \
             'Too many definitions implemented by model'
-        if definitions:
-            return definitions[0]
-        return None
+        definition = definitions[0] if definitions else None
+        specifications[specification] = definition
+        return definition
 
     def type_for_definition(self, definition):
         assert definition in self, 'Unknown definition'
         return definition.queryTaggedValue('resource type')
 
     def type_for_model(self, model):
-        definition = self.definition_for_model()
+        definition = self.definition_for_model(model)
         if definition is None:
             return None
         return definition.queryTaggedValue('resource type')
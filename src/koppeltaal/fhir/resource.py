@@ -4,11 +4,11 @@
 :license: AGPL, see `LICENSE.md` for more details.
 """
 
-import json
 import koppeltaal
 
 from koppeltaal.fhir import packer
 from koppeltaal import (
+    codec,
     codes,
     fhir,
     interfaces,
@@ -104,6 +104,19 @@ class Entry(object):
 
         return None
 
+    def references(self):
+        """Return the references this entry can be found with, or None
+        if they are not known yet.
+
+        This does not compute the fhir link: it is only known once it has
+        been read from the payload or computed for the model.
+        """
+        if self._fhir_link is MARKER:
+            return None
+        if self._fhir_link is None:
+            return ()
+        return (self._fhir_link,)
+
     def unpack(self):
         if self._model is not MARKER:
             return self._model
@@ -116,6 +129,26 @@ class Entry(object):
                 self._model.fhir_link = self.fhir_link
         return self._model
 
+    def validate(self):
+        """Return a broken resource if the entry is not valid, None
+        otherwise. An entry that is not unpacked yet is validated without
+        being unpacked.
+        """
+        if self._model is not MARKER:
+            if interfaces.IBrokenFHIRResource.providedBy(self._model):
+                return self._model
+            return None
+
+        if self.definition is None:
+            return None
+        error = self._packer.validate(self._content, self.definition)
+        if error is None:
+            return None
+        broken = packer.BrokenResource(error, self._content)
+        if self._fhir_link is not MARKER:
+            broken.fhir_link = self._fhir_link
+        return broken
+
     def pack(self):
         if self._content is MARKER:
             if self.definition is None:
@@ -147,33 +180,84 @@ class Entry(object):
             self.__class__.__name__,
             self.fhir_link,
             self.resource_type,
-            json.dumps(self._content, indent=2, sort_keys=True),
+            codec.pretty(self._content),
             self.__class__.__name__)
 
 
 class Resource(object):
     _create_entry = Entry
+    _create_packer = packer.Packer
 
-    def __init__(self, domain=None, integration=None):
+    def __init__(self, domain=None, integration=None, lazy=False):
         self.items = []
         self.domain = domain
         self.integration = integration
-        self.packer = packer.Packer(self, integration.fhir_link)
+        # In lazy mode, entries are only unpacked when they are expected
+        # or referred to.
+        self.lazy = lazy
+        self.packer = self._create_packer(self, integration.fhir_link)
+        # Indexes to find entries, see find().
+        self._models = {}
+        self._links = {}
+        self._references = {}
+        self._unindexed = []
+
+    def _add_entry(self, entry):
+        self.items.append(entry)
+        if entry._model is not MARKER:
+            self._models.setdefault(id(entry._model), entry)
+        self._unindexed.append(entry)
+        return entry
+
+    def _update_index(self):
+        unindexed = []
+        for item in self._unindexed:
+            references = item.references()
+            if references is None:
+                unindexed.append(item)
+                continue
+            for reference in references:
+                self._references.setdefault(reference, item)
+            if item.fhir_link is not None:
+                self._links.setdefault(item.fhir_link, item)
+        self._unindexed = unindexed
 
     def add_payload(self, response):
-        self.items.append(self._create_entry(self.packer, content=response))
+        self._add_entry(self._create_entry(self.packer, content=response))
 
     def add_model(self, model):
         assert interfaces.IFHIRResource.providedBy(model), \
             'Can only add resources'
         entry = self.find(model)
         if entry is None:
-            entry = self._create_entry(self.packer, model=model)
-            self.items.append(entry)
+            entry = self._add_entry(
+                self._create_entry(self.packer, model=model))
         return entry
 
     def find(self, entry):
-        for item in self.items:
+        # Entries are indexed by model and by the references they can be
+        # found with. Entries for which those are not yet known are
+        # compared one by one.
+        if isinstance(entry, dict):
+            if 'reference' not in entry:
+                return None
+            self._update_index()
+            item = self._references.get(entry['reference'])
+            if item is not None:
+                return item
+        elif interfaces.IFHIRResource.providedBy(entry):
+            item = self._models.get(id(entry))
+            if item is not None:
+                return item
+            if entry.fhir_link is not None:
+                self._update_index()
+                item = self._links.get(entry.fhir_link)
+                if item is not None and (
+                        item._model is MARKER or item._model is entry):
+                    return item
+        else:
+            return None
+        for item in self._unindexed:
             if entry == item:
                 # Entry provides a smart "comparison".
                 return item
@@ -191,9 +275,22 @@ class Resource(object):
         for item in self.items:
             yield item.unpack()
 
+    def _unpack_candidates(self, definition):
+        if not self.lazy:
+            return self.unpack()
+        return (
+            item.unpack() for item in self.items
+            if item.definition is not None
+            and item.definition.isOrExtends(definition))
+
+    def unpack_models(self, definition):
+        for model in self._unpack_candidates(definition):
+            if definition.providedBy(model):
+                yield model
+
     def unpack_model(self, definition):
         expected_model = None
-        for model in self.unpack():
+        for model in self._unpack_candidates(definition):
             if interfaces.IBrokenFHIRResource.providedBy(model):
                 logger.error(
                     'Trying to unpack an expected resource, '
@@ -13,21 +13,24 @@ from koppeltaal import fhir
 unicode = six.text_type
 
 
-TYPES = [
-    (('extension', 'valueInteger'), 'int'),
-    (('extension', 'valueDecimal'), 'float'),
-    (('extension', 'valueBoolean'), 'boolean'),
-    (('activity', 'prohibited'), 'boolean'),
-    (('Patient', 'active'), 'boolean'),
-]
+# The value types of extensions are not described by the definitions.
+EXTENSION_TYPES = {
+    'valueInteger': 'int',
+    'valueDecimal': 'float',
+    'valueBoolean': 'boolean',
+}
+
+FIELD_TYPES = {
+    'boolean': 'boolean',
+    'integer': 'int',
+}
 
 
 def type_for(node_tag, child_tag):
-    # Replace this by checking the definition.
-    for key, value in TYPES:
-        if (node_tag, child_tag) == key:
-            return value
-    return 'string'
+    if node_tag == 'extension':
+        return EXTENSION_TYPES.get(child_tag, 'string')
+    return FIELD_TYPES.get(
+        fhir.REGISTRY.field_type(node_tag, child_tag), 'string')
 
 
 def tag(node, namespace="atom"):
@@ -44,12 +47,12 @@ def tag(node, namespace="atom"):
 def fhir2json(node, repeatable_field_names):
     node_tag = tag(node, "fhir")
     result = dict(node.attrib)
-    for child in node.getchildren():
+    for child in node:
         child_tag = tag(child, "fhir")
         if child_tag == '{http://www.w3.org/1999/xhtml}div':
             child_tag = 'div'
             child_value = lxml.etree.tostring(child)
-        elif len(child.getchildren()):
+        elif len(child):
             child_value = fhir2json(child, repeatable_field_names)
             child_value.update(child.attrib)
         else:
@@ -72,28 +75,32 @@ def fhir2json(node, repeatable_field_names):
     return result
 
 
+def _atom_child(result, child, is_entry):
+    child_tag = tag(child, "atom")
+    if child_tag in {'id', 'updated', 'title'}:
+        result[child_tag] = child.text
+    if child_tag in {'category', 'link'}:
+        child_value = result.setdefault(child_tag, [])
+        child_value.append(dict(child.attrib))
+    if child_tag == 'entry':
+        assert not is_entry, 'Invalid atom file'
+        child_value = result.setdefault(child_tag, [])
+        child_value.append(atom2json(child, is_entry=True))
+    if child_tag == 'content':
+        assert is_entry, 'Invalid atom file'
+        assert len(child.getchildren()), 'Invalid fhir file'
+        fhir_node = child.getchildren()[0]
+        fhir_type = tag(fhir_node, "fhir")
+        field_names = fhir.REGISTRY.repeatable_field_names(fhir_type)
+        child_value = {'resourceType': fhir_type}
+        child_value.update(fhir2json(fhir_node, field_names))
+        result[child_tag] = child_value
+
+
 def atom2json(node, is_entry=False):
     result = {}
     for child in node.getchildren():
-        child_tag = tag(child, "atom")
-        if child_tag in {'id', 'updated', 'title'}:
-            result[child_tag] = child.text
-        if child_tag in {'category', 'link'}:
-            child_value = result.setdefault(child_tag, [])
-            child_value.append(dict(child.attrib))
-        if child_tag == 'entry':
-            assert not is_entry, 'Invalid atom file'
-            child_value = result.setdefault(child_tag, [])
-            child_value.append(atom2json(child, is_entry=True))
-        if child_tag == 'content':
-            assert is_entry, 'Invalid atom file'
-            assert len(child.getchildren()), 'Invalid fhir file'
-            fhir_node = child.getchildren()[0]
-            fhir_type = tag(fhir_node, "fhir")
-            field_names = fhir.REGISTRY.repeatable_field_names(fhir_type)
-            child_value = {'resourceType': fhir_type}
-            child_value.update(fhir2json(fhir_node, field_names))
-            result[child_tag] = child_value
+        _atom_child(result, child, is_entry)
     return result
 
 
@@ -104,3 +111,47 @@ def xml2json(xml_file):
     bundle = {'resourceType': 'Bundle'}
     bundle.update(atom2json(feed))
     return bundle
+
+
+def iterxml2json(xml_file):
+    """Convert an atom feed like `xml2json`, without reading the whole file
+    in memory. The entries of the returned bundle are a generator that
+    parses them one at a time, to be passed to `Bundle.add_payload`. The
+    elements of the feed that follow the first entry are only added to the
+    bundle once all entries are read.
+    """
+    events = lxml.etree.iterparse(xml_file, events=('start', 'end'))
+    _, feed = next(events)
+    assert tag(feed, "atom") == 'feed', 'Invalid atom file'
+
+    bundle = {'resourceType': 'Bundle'}
+
+    def children():
+        depth = 0
+        for event, node in events:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 0:
+                yield node
+                # Forget the elements that were converted.
+                node.clear()
+                while node.getprevious() is not None:
+                    del feed[0]
+
+    def entries(first):
+        yield first
+        for child in nodes:
+            if tag(child, "atom") == 'entry':
+                yield atom2json(child, is_entry=True)
+            else:
+                _atom_child(bundle, child, False)
+
+    nodes = children()
+    for child in nodes:
+        if tag(child, "atom") == 'entry':
+            bundle['entry'] = entries(atom2json(child, is_entry=True))
+            break
+        _atom_child(bundle, child, False)
+    return bundle
@@ -301,19 +301,56 @@ class IConnector(zope.interface.Interface):
         parameters can be extracted from a careplan.
         """
 
-    def updates():
+    def updates(expected_events=None, patient=None, event=None, lazy=False):
         """Iterate over the available new messages in the mailbox for
         processing.
+
+        If `lazy` is true, only the resources reachable from the message
+        are unpacked. The other resources in the message bundle are
+        validated without being unpacked.
+        """
+
+    def consume(
+            handler, workers=4, expected_events=None, patient=None,
+            event=None, lazy=False, stop=None):
+        """Process the new messages in the mailbox concurrently, with
+        `workers` threads, until there are no new messages left or `stop`
+        (a threading.Event) is set.
+
+        Each worker claims a message, calls `handler` with its update
+        and acknowledges the message, like iterating over `updates` does.
+        If `handler` raises an error, all workers stop after their
+        current message and the error is raised. Return the number of
+        processed messages.
         """
 
     def search(message_id=None, event=None, status=None, patient=None):
         """Return a list of messages matching the given criteria.
         """
 
+    def search_stream(
+            message_id=None, event=None, status=None, patient=None,
+            batch_size=None, batch_count=None, prefetch=0):
+        """Iterate over the messages matching the given criteria, one page
+        of search results at a time.
+
+        If `prefetch` is given, up to that many next pages are queried in
+        the background while the current page is processed.
+        """
+
     def send(event, data, patient):
         """Send an update about event with data for patient.
         """
 
+    def send_many(items, concurrency=4):
+        """Send updates for the (event, data, patient) `items`, with up to
+        `concurrency` messages in flight.
+
+        Return the result of `send` for each item, in order. If the
+        update for an item could not be sent, its result is the error,
+        for instance an OperationOutcomeError.
+        """
+
     def close():
         """Close any connection left to the server.
         """
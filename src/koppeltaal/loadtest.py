@@ -0,0 +1,636 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+
+Local stand-in for a Koppeltaal server and a load generator driving a
+connector against it::
+
+  $ koppeltaal-loadtest --messages 1000 --concurrency 8 --latency 0.01
+
+The stand-in keeps the messages posted to its mailbox in memory. It answers
+message searches, claims of new messages, updates of their processing
+status, activity definition searches, the metadata and launch requests. It
+can delay its responses and fail a fraction of the requests.
+"""
+
+import argparse
+import collections
+import logging
+import pkg_resources
+import random
+import six
+import threading
+import time
+
+from koppeltaal import (
+    codec,
+    connector,
+    interfaces,
+    logger,
+    models,
+    utils)
+from koppeltaal.testing import ThreadingHTTPServer
+from six.moves import BaseHTTPServer
+from six.moves.urllib.parse import parse_qsl, urlencode, urlparse
+
+
+unicode = six.text_type
+
+FHIR_URL = '/FHIR/Koppeltaal'
+MESSAGE_HEADER_PATH = FHIR_URL + '/MessageHeader/'
+MESSAGE_HEADER_EXTENSION = interfaces.NAMESPACE + 'MessageHeader#'
+PROCESSING_STATUS_URL = MESSAGE_HEADER_EXTENSION + 'ProcessingStatus'
+PROCESSING_STATUS_STATUS_URL = PROCESSING_STATUS_URL + 'Status'
+PROCESSING_STATUS_CHANGED_URL = PROCESSING_STATUS_URL + 'StatusLastChanged'
+PATIENT_URL = MESSAGE_HEADER_EXTENSION + 'Patient'
+
+DEFAULT_PAGE_SIZE = 100
+PERCENTILES = (50, 90, 99)
+
+
+class Message(object):
+    """Message posted to the mailbox of the stand-in.
+    """
+
+    def __init__(self, number, payload):
+        self.number = number
+        self.payload = payload
+        self.version = 1
+        for entry in payload['entry']:
+            if entry['content'].get('resourceType') == 'MessageHeader':
+                self.entry = entry
+                self.header = entry['content']
+                break
+        else:
+            raise ValueError('No message header in bundle.')
+
+    @property
+    def event(self):
+        return self.header.get('event', {}).get('code')
+
+    @property
+    def patient(self):
+        for extension in self.header.get('extension', ()):
+            if extension.get('url') == PATIENT_URL:
+                return extension.get('valueResource', {}).get('reference')
+        return None
+
+    @property
+    def status(self):
+        for extension in self.header.get('extension', ()):
+            if extension.get('url') != PROCESSING_STATUS_URL:
+                continue
+            for field in extension.get('extension', ()):
+                if field.get('url') == PROCESSING_STATUS_STATUS_URL:
+                    return field.get('valueCode')
+        return None
+
+    def set_status(self, status):
+        extensions = [
+            extension for extension in self.header.get('extension', ())
+            if extension.get('url') != PROCESSING_STATUS_URL]
+        extensions.append({
+            'url': PROCESSING_STATUS_URL,
+            'extension': [{
+                'url': PROCESSING_STATUS_STATUS_URL,
+                'valueCode': status,
+            }, {
+                'url': PROCESSING_STATUS_CHANGED_URL,
+                'valueInstant': utils.now().isoformat(),
+            }]})
+        self.header['extension'] = extensions
+
+    def matches(self, params):
+        if 'event' in params and self.event != params['event']:
+            return False
+        if 'Patient' in params and self.patient != params['Patient']:
+            return False
+        if ('ProcessingStatus' in params and
+                self.status != params['ProcessingStatus']):
+            return False
+        return True
+
+
+class StandInServer(object):
+    """Local HTTP server behaving like a Koppeltaal server for one domain.
+
+    Every response is delayed by `latency` seconds plus up to `jitter`
+    seconds. A fraction `error_rate` of the requests fails with
+    `error_status`, before it is processed.
+    """
+
+    def __init__(
+            self,
+            domain='StandIn',
+            latency=0.0,
+            jitter=0.0,
+            error_rate=0.0,
+            error_status=503,
+            page_size=DEFAULT_PAGE_SIZE,
+            activities=None,
+            seed=None):
+        self.domain = domain
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.page_size = page_size
+        if activities is None:
+            activities = codec.loads(pkg_resources.resource_string(
+                'koppeltaal.tests', 'fixtures/activities_game.json'))
+        self.activities = activities
+        self.requests = collections.Counter()
+        self.errors = collections.Counter()
+        self.messages = collections.OrderedDict()
+        self._new = collections.deque()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        stand_in = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stand_in._handle(self)
+
+            do_POST = do_PUT = do_GET
+
+            def end_headers(self):
+                if self.close_connection:
+                    self.send_header('Connection', 'close')
+                BaseHTTPServer.BaseHTTPRequestHandler.end_headers(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self._server.server_port)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={'poll_interval': 0.05},
+            name='koppeltaal-stand-in')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _link(self, *parts):
+        return '/'.join((self.url + FHIR_URL,) + tuple(map(unicode, parts)))
+
+    def _bundle(self, entries, links=()):
+        return {
+            'resourceType': 'Bundle',
+            'id': 'urn:uuid:{}'.format(utils.uniqueid()),
+            'updated': utils.now().isoformat(),
+            'category': [{
+                'term': '{}Domain#{}'.format(
+                    interfaces.NAMESPACE, self.domain),
+                'label': self.domain,
+                'scheme': 'http://hl7.org/fhir/tag/security'
+            }, {
+                'term': 'http://hl7.org/fhir/tag/message',
+                'scheme': 'http://hl7.org/fhir/tag'
+            }],
+            'link': list(links),
+            'entry': entries}
+
+    def _outcome(self, details):
+        return {
+            'resourceType': 'OperationOutcome',
+            'issue': [{
+                'severity': 'error',
+                'type': {
+                    'system': 'http://hl7.org/fhir/issue-type',
+                    'code': 'processing'},
+                'details': details}]}
+
+    def _response(self, identifier, event, data):
+        # Message header answering a message sent to the mailbox.
+        return self._bundle([{
+            'id': 'urn:uuid:{}'.format(utils.uniqueid()),
+            'content': {
+                'resourceType': 'MessageHeader',
+                'identifier': utils.uniqueid(),
+                'timestamp': utils.now().isoformat(),
+                'event': event,
+                'response': {'identifier': identifier, 'code': 'ok'},
+                'source': {
+                    'endpoint': self.url + interfaces.MAILBOX_URL,
+                    'name': 'Koppeltaal stand-in',
+                    'software': 'koppeltaal.loadtest',
+                    'version': interfaces.VERSION},
+                'data': data}}])
+
+    def _handle(self, request):
+        parts = urlparse(request.path)
+        params = dict(parse_qsl(parts.query))
+        payload = None
+        if request.command in ('POST', 'PUT'):
+            length = int(request.headers.get('content-length') or 0)
+            payload = request.rfile.read(length)
+        route = self._route(request.command, parts.path)
+        with self._lock:
+            self.requests[route] += 1
+            failed = self._random.random() < self.error_rate
+            delay = self.latency + self._random.random() * self.jitter
+        if delay:
+            time.sleep(delay)
+        if failed:
+            with self._lock:
+                self.errors[route] += 1
+            self._send(request, self.error_status, self._outcome(
+                'Injected error'))
+            return
+        handler = getattr(self, '_' + route, None)
+        if handler is None:
+            self._send(request, 404, self._outcome(
+                'Unknown endpoint {}'.format(parts.path)))
+            return
+        try:
+            if payload is not None:
+                payload = codec.loads(payload)
+            status, body, location = handler(parts.path, params, payload)
+        except (KeyError, TypeError, ValueError) as error:
+            status, body, location = 400, self._outcome(unicode(error)), None
+        self._send(request, status, body, location)
+
+    def _route(self, method, path):
+        if method == 'GET':
+            if path == interfaces.METADATA_URL:
+                return 'metadata'
+            if path == interfaces.ACTIVITY_DEFINITION_URL:
+                return 'activities'
+            if path == interfaces.MESSAGE_HEADER_URL:
+                return 'search'
+            if path == interfaces.OAUTH_LAUNCH_URL:
+                return 'launch'
+        if method == 'POST' and path == interfaces.MAILBOX_URL:
+            return 'mailbox'
+        if method == 'PUT' and path.startswith(MESSAGE_HEADER_PATH):
+            return 'update'
+        return 'unknown'
+
+    def _send(self, request, status, body=None, location=None):
+        if location is not None and body is None:
+            request.send_response(status)
+            request.send_header('Location', location)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+        data = codec.dumps(body)
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json; charset=utf-8')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def _metadata(self, path, params, payload):
+        return 200, {
+            'resourceType': 'Conformance',
+            'name': 'Koppeltaal stand-in',
+            'software': {
+                'name': 'koppeltaal.loadtest',
+                'version': interfaces.VERSION},
+            'fhirVersion': '0.0.82'}, None
+
+    def _activities(self, path, params, payload):
+        return 200, self.activities, None
+
+    def _launch(self, path, params, payload):
+        location = '{}/Application/{}/launch?{}'.format(
+            self.url, params['client_id'], urlencode({
+                'iss': self.url + FHIR_URL,
+                'launch': utils.uniqueid()}))
+        return 302, None, location
+
+    def _mailbox(self, path, params, payload):
+        if payload.get('resourceType') != 'Bundle':
+            return 400, self._outcome('Not a bundle'), None
+        with self._lock:
+            number = len(self.messages) + 1
+            message = Message(number, payload)
+            message.entry['id'] = self._link('MessageHeader', number)
+            message.entry['link'] = [{
+                'rel': 'self',
+                'href': self._link(
+                    'MessageHeader', number, '_history', message.version)}]
+            message.set_status('New')
+            self.messages[number] = message
+            self._new.append(number)
+        data = [
+            {'reference': link['href']}
+            for entry in payload['entry'] if entry is not message.entry
+            for link in entry.get('link', ()) if link.get('rel') == 'self']
+        return 200, self._response(
+            message.header.get('identifier'), message.header.get('event'),
+            data), None
+
+    def _search(self, path, params, payload):
+        if params.get('_query') == 'MessageHeader.GetNextNewAndClaim':
+            return 200, self._claim(params), None
+        if '_id' in params:
+            message = self.messages.get(int(params['_id'].rsplit('/', 1)[-1]))
+            entries = [] if message is None else message.payload['entry']
+            return 200, self._bundle(entries), None
+        count = int(params.get('_count') or self.page_size)
+        page = int(params.get('page') or 1)
+        with self._lock:
+            found = [
+                message.entry for message in self.messages.values()
+                if message.matches(params)]
+        entries = found[(page - 1) * count:page * count]
+        links = []
+        if page * count < len(found):
+            links.append({
+                'rel': 'next',
+                'href': '{}{}?{}'.format(
+                    self.url, path, urlencode(sorted(
+                        dict(params, page=page + 1).items())))})
+        return 200, self._bundle(entries, links), None
+
+    def _claim(self, params):
+        with self._lock:
+            for _ in range(len(self._new)):
+                number = self._new.popleft()
+                message = self.messages[number]
+                if message.status != 'New':
+                    continue
+                if not message.matches(params):
+                    self._new.append(number)
+                    continue
+                message.set_status('Claimed')
+                self._new_version(message)
+                return self._bundle(message.payload['entry'])
+        return self._bundle([])
+
+    def _new_version(self, message):
+        message.version += 1
+        message.entry['link'] = [{
+            'rel': 'self',
+            'href': self._link(
+                'MessageHeader', message.number, '_history',
+                message.version)}]
+
+    def _update(self, path, params, payload):
+        parts = path[len(MESSAGE_HEADER_PATH):].split('/')
+        version = int(parts[2]) if len(parts) > 2 else None
+        header = payload
+        with self._lock:
+            message = self.messages.get(int(parts[0]))
+            if message is None:
+                return 404, self._outcome('Unknown message'), None
+            if version is not None and version != message.version:
+                return 409, self._outcome('Version conflict'), None
+            for extension in header.get('extension', ()):
+                if extension.get('url') == PROCESSING_STATUS_URL:
+                    message.header['extension'] = [
+                        item for item in message.header.get('extension', ())
+                        if item.get('url') != PROCESSING_STATUS_URL]
+                    message.header['extension'].append(extension)
+            self._new_version(message)
+            if message.status == 'New':
+                self._new.append(message.number)
+        return 200, self._response(
+            header.get('identifier'), header.get('event'),
+            [{'reference': message.entry['link'][0]['href']}]), None
+
+
+def percentile(values, percent):
+    """Return the `percent` percentile of the sorted `values`, by nearest
+    rank.
+    """
+    if not values:
+        return None
+    index = max(0, int(round(percent / 100.0 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+class Collector(logging.Handler):
+    """Collect the durations of the HTTP responses logged by the transport,
+    by request method.
+    """
+
+    def __init__(self):
+        super(Collector, self).__init__(logging.DEBUG)
+        self.durations = collections.defaultdict(list)
+        self._lock_durations = threading.Lock()
+
+    def emit(self, record):
+        if getattr(record, 'event', None) != 'http.response':
+            return
+        with self._lock_durations:
+            self.durations[record.method].append(record.duration)
+
+    def __enter__(self):
+        self._level = logger.logger.level
+        logger.logger.setLevel(logging.DEBUG)
+        logger.logger.addHandler(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        logger.logger.removeHandler(self)
+        logger.logger.setLevel(self._level)
+
+
+class Report(object):
+
+    def __init__(self, name, count, errors, elapsed, durations):
+        self.name = name
+        self.count = count
+        self.errors = errors
+        self.elapsed = elapsed
+        self.durations = {
+            key: sorted(values) for key, values in durations.items()}
+
+    @property
+    def rate(self):
+        return self.count / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        lines = [
+            '{}: {} messages in {:.2f} s, {:.1f} messages/s, {} errors'.format(
+                self.name, self.count, self.elapsed, self.rate, self.errors)]
+        for key, values in sorted(self.durations.items()):
+            lines.append('  {:<6} {:>6} requests, latency {}'.format(
+                key, len(values), ' '.join(
+                    'p{}={:.1f}ms'.format(p, percentile(values, p) * 1000)
+                    for p in PERCENTILES)))
+        return '\n'.join(lines)
+
+
+def patient_message(index):
+    patient = models.Patient(
+        name=[models.Name(
+            given=[u'Load'], family=[u'Test {}'.format(index)])],
+        gender='F',
+        active=True)
+    return ('CreateOrUpdatePatient', patient, patient)
+
+
+def run_send(sender, count, concurrency):
+    messages = [patient_message(index) for index in range(count)]
+    with Collector() as collector:
+        start = time.time()
+        results = sender.send_many(messages, concurrency=concurrency)
+        elapsed = time.time() - start
+    errors = sum(
+        1 for result in results
+        if isinstance(result, interfaces.KoppeltaalError))
+    return Report(
+        'send', count - errors, errors, elapsed, collector.durations)
+
+
+def run_consume(receiver, concurrency, handler=None):
+    """Process the new messages like `Connector.consume`, but count the
+    messages that could not be processed or acknowledged instead of
+    stopping at the first one. Messages failing in the handler are
+    acknowledged as failed.
+    """
+    if handler is None:
+        handler = success
+    lock = threading.Lock()
+    counts = collections.Counter()
+
+    def work():
+        updates = receiver.updates()
+        try:
+            for update in updates:
+                failed = False
+                try:
+                    with update:
+                        try:
+                            handler(update)
+                        except Exception as error:
+                            # Putting the message back to new would have
+                            # it claimed again and again.
+                            logger.error(
+                                'Error while processing update: {}'.format(
+                                    error))
+                            update.fail(error)
+                            failed = True
+                except Exception as error:
+                    logger.error(
+                        'Error while acknowledging update: {}'.format(error))
+                    failed = True
+                with lock:
+                    counts['errors' if failed else 'processed'] += 1
+        finally:
+            updates.close()
+
+    with Collector() as collector:
+        start = time.time()
+        threads = [
+            threading.Thread(
+                target=work, name='koppeltaal-loadtest-{}'.format(index))
+            for index in range(concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    return Report(
+        'consume', counts['processed'], counts['errors'], elapsed,
+        collector.durations)
+
+
+def success(update):
+    update.success()
+
+
+class Integration(connector.Integration):
+
+    def __init__(self, name, url):
+        super(Integration, self).__init__(
+            name=name,
+            url=url,
+            software='koppeltaal.loadtest',
+            version=interfaces.VERSION)
+        self._ids = {}
+        self._ids_lock = threading.Lock()
+
+    def model_id(self, model):
+        with self._ids_lock:
+            return self._ids.setdefault(id(model), len(self._ids) + 1)
+
+
+def loadtest():
+    parser = argparse.ArgumentParser(
+        description='Send and consume messages to measure the throughput '
+        'of the connector, against a stand-in Koppeltaal server.')
+    parser.add_argument(
+        '--server',
+        help='Koppeltaal server to connect to instead of a stand-in.')
+    parser.add_argument(
+        '--claim-all', action='store_true',
+        help='Allow --server: the load test claims and acknowledges all '
+        'the new messages in the mailbox, also the ones it did not send.')
+    parser.add_argument('--username', default='loadtest')
+    parser.add_argument('--password', default='loadtest')
+    parser.add_argument('--domain', default='StandIn')
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='Seconds the stand-in waits before every response.')
+    parser.add_argument(
+        '--jitter', type=float, default=0.0,
+        help='Maximum random seconds added to the latency.')
+    parser.add_argument(
+        '--error-rate', type=float, default=0.0,
+        help='Fraction of the requests failed by the stand-in.')
+    parser.add_argument(
+        '--retries', type=int, default=0,
+        help='Number of retries of failed requests.')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    if args.server is not None and not args.claim_all:
+        parser.error(
+            '--server claims and acknowledges all the new messages in its '
+            'mailbox, pass --claim-all to allow it.')
+
+    stand_in = None
+    url = args.server
+    if url is None:
+        stand_in = StandInServer(
+            domain=args.domain,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            seed=args.seed)
+        stand_in.start()
+        url = stand_in.url
+    credentials = utils.Credentials(
+        url, args.username, args.password, args.domain, {
+            'pool_maxsize': args.concurrency,
+            'retries': args.retries,
+            'retry_backoff': 0.01})
+    sender = connector.Connector(credentials, Integration(
+        'Load test sender', 'https://sender.example.com/fhir/Koppeltaal'))
+    receiver = connector.Connector(credentials, Integration(
+        'Load test receiver', 'https://receiver.example.com/fhir/Koppeltaal'))
+    try:
+        print(run_send(sender, args.messages, args.concurrency))
+        print(run_consume(receiver, args.concurrency))
+    finally:
+        sender.close()
+        receiver.close()
+        if stand_in is not None:
+            stand_in.stop()
+            print('stand-in: {} requests, {} injected errors'.format(
+                sum(stand_in.requests.values()),
+                sum(stand_in.errors.values())))
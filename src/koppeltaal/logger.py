@@ -5,7 +5,8 @@
 """
 
 import logging
-import json
+
+from koppeltaal import codec
 
 logger = logging.getLogger('koppeltaal.connector')
 requests_logger = logging.getLogger("requests.packages.urllib3")
@@ -22,7 +23,57 @@ def set_log_level(level):
     requests_logger.setLevel(level)
 
 
+class LazyJSON(object):
+    """JSON data that is only rendered when the log record is formatted.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return codec.pretty(self.data)
+
+
+class LazyMessage(object):
+    """Message that is only formatted when the log record is formatted.
+    """
+
+    def __init__(self, message, data):
+        self.message = message
+        self.data = data
+
+    def __str__(self):
+        return self.message.format(**self.data)
+
+
+class EventMessage(object):
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __str__(self):
+        return ' '.join(
+            [self.name] +
+            ['{}={}'.format(key, value)
+             for key, value in sorted(self.fields.items())])
+
+
 def debug_json(message, **data):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     if 'json' in data:
-        data['json'] = json.dumps(data['json'], indent=2, sort_keys=True)
-    debug(message.format(**data))
+        data['json'] = LazyJSON(data['json'])
+    logger.debug('%s', LazyMessage(message, data))
+
+
+def event(name, level=logging.DEBUG, **fields):
+    """Log a structured record for the event `name`. The record has the
+    `event` attribute and one attribute per field, for instance
+    `message_id`, `size` (in bytes) or `duration` (in seconds), for log
+    handlers to consume as is.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    extra = dict(fields, event=name)
+    logger.log(level, '%s', EventMessage(name, fields), extra=extra)
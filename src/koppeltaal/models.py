@@ -4,6 +4,7 @@
 :license: AGPL, see `LICENSE.md` for more details.
 """
 
+import inspect
 import zope.interface
 
 from koppeltaal import (definitions, interfaces)
@@ -476,3 +477,81 @@ class OperationOutcome(FHIRResource):
             self,
             issue=None):
         self.issue = issue
+
+
+@zope.interface.implementer(interfaces.IFHIRResource)
+class SlottedFHIRResource(object):
+    __slots__ = ('fhir_link',)
+
+    def __getattr__(self, name):
+        # Only called when the slot is not set.
+        if name == 'fhir_link':
+            return None
+        raise AttributeError(name)
+
+
+def _slotted(cls):
+    init = cls.__dict__['__init__']
+    getargspec = getattr(inspect, 'getfullargspec', None) or \
+        inspect.getargspec
+    names = tuple(getargspec(init).args[1:])
+    if issubclass(cls, FHIRResource):
+        base = SlottedFHIRResource
+        names = tuple(name for name in names if name != 'fhir_link')
+    else:
+        base = object
+    variant = type('Slotted' + cls.__name__, (base,), {
+        '__slots__': names,
+        '__init__': init,
+        '__module__': cls.__module__,
+        '__doc__': cls.__doc__})
+    zope.interface.classImplements(
+        variant, *zope.interface.implementedBy(cls).declared)
+    return variant
+
+
+SLOTTED = {}
+
+
+def slotted(cls):
+    """Return the variant of the model class `cls` that keeps its attributes
+    in slots instead of a dictionary. It has the same constructor and
+    provides the same definitions.
+    """
+    variant = SLOTTED.get(cls)
+    if variant is None:
+        variant = SLOTTED[cls] = _slotted(cls)
+    return variant
+
+
+for _cls in (
+        ReferredResource,
+        SubActivityDefinition,
+        ActivityDefinition,
+        Name,
+        Contact,
+        Identifier,
+        Participant,
+        OrganizationContactPerson,
+        Organization,
+        Patient,
+        Practitioner,
+        RelatedPerson,
+        Goal,
+        SubActivity,
+        ActivityDetails,
+        Activity,
+        CarePlan,
+        ProcessingStatus,
+        ActivityStatus,
+        MessageHeaderResponse,
+        MessageHeaderSource,
+        MessageHeader,
+        Period,
+        CareTeam,
+        Address,
+        Issue,
+        OperationOutcome):
+    # Make the variants importable, for instance to be pickled.
+    globals()[slotted(_cls).__name__] = slotted(_cls)
+del _cls
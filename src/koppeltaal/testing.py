@@ -9,9 +9,11 @@ import hamcrest
 import json
 import pkg_resources
 import six
+import threading
 
 from hamcrest.core.base_matcher import BaseMatcher
 from koppeltaal import interfaces, transport
+from six.moves import BaseHTTPServer, socketserver
 from six.moves.urllib.parse import urlparse, urlunparse, urlencode
 
 
@@ -47,14 +49,20 @@ class MockTransport(object):
                     request_method=method,
                     json=self._load(fixture['respond_error']),
                     location=location))
-        return Response(
+        response = Response(
             request_method=method,
             json=self._load(fixture.get('respond_with')),
             location=location)
+        response.etag = fixture.get('etag')
+        response.last_modified = fixture.get('last_modified')
+        response.not_modified = fixture.get('not_modified', False)
+        response.cache_control = fixture.get('cache_control')
+        return response
 
     def clear(self):
         self.expected = {}
         self.called = {}
+        self.headers = {}
 
     def expect(self, method, url, **fixture):
         """Register an URL that the transport expects to be called for.
@@ -79,8 +87,9 @@ class MockTransport(object):
     def absolute_url(self, url):
         return url
 
-    def query(self, url, params=None):
+    def query(self, url, params=None, headers=None, replay=True):
         url = self.relative_url(url, params)
+        self.headers[url] = headers
         if not len(self.expected.get(url, [])):
             raise AssertionError('Unexpected url call', url)
         expect = self.expected[url].pop(0)
@@ -133,6 +142,119 @@ class MockTransport(object):
         pass
 
 
+class ThreadingHTTPServer(
+        socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class StubServer(object):
+    """Local HTTP server answering requests with the fixtures registered
+    with `expect`, like the MockTransport does, to test transports with.
+    """
+
+    def __init__(self, module_name):
+        self.fixtures = MockTransport(module_name)
+        self.errors = []
+        stub = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            # Keep connections open between requests.
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub._respond(self, functools.partial(
+                    stub.fixtures.query, headers=dict(self.headers)))
+
+            def do_POST(self):
+                stub._respond(self, stub.fixtures.create)
+
+            def do_PUT(self):
+                stub._respond(self, stub.fixtures.update)
+
+            def end_headers(self):
+                # Tell the client when the connection is not kept open.
+                if self.close_connection:
+                    self.send_header('Connection', 'close')
+                BaseHTTPServer.BaseHTTPRequestHandler.end_headers(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self._server.server_port)
+        self._thread = None
+
+    @property
+    def called(self):
+        return self.fixtures.called
+
+    def expect(self, method, url, **fixture):
+        self.fixtures.expect(method, url, **fixture)
+
+    def _respond(self, request, method):
+        args = [request.path]
+        if request.command in ('POST', 'PUT'):
+            length = int(request.headers.get('content-length') or 0)
+            args.append(json.loads(request.rfile.read(length).decode('utf-8')))
+        status = 200
+        try:
+            response = method(*args)
+        except interfaces.ResponseError as error:
+            status = 400
+            response = error.response
+        except AssertionError as error:
+            self.errors.append(error)
+            request.send_response(500)
+            request.send_header('Content-Type', 'text/plain')
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+        if response.not_modified:
+            request.send_response(304)
+            self._send_validators(request, response)
+            request.end_headers()
+            return
+        if response.json is None and response.location is not None:
+            request.send_response(302)
+            request.send_header('Location', response.location)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+        body = b''
+        if response.json is not None:
+            body = json.dumps(response.json).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json; charset=utf-8')
+        request.send_header('Content-Length', str(len(body)))
+        if response.location is not None:
+            request.send_header('Content-Location', response.location)
+        self._send_validators(request, response)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _send_validators(self, request, response):
+        if response.etag is not None:
+            request.send_header('ETag', response.etag)
+        if response.last_modified is not None:
+            request.send_header('Last-Modified', response.last_modified)
+        if getattr(response, 'cache_control', None) is not None:
+            request.send_header('Cache-Control', response.cache_control)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={'poll_interval': 0.05},
+            name='koppeltaal-stub-server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
 class HasFHIRResource(BaseMatcher):
 
     def __init__(self, resourcetype, containing=None):
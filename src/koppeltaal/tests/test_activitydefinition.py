@@ -5,6 +5,7 @@
 """
 
 import zope.interface.verify
+import koppeltaal.connector
 import koppeltaal.definitions
 import koppeltaal.interfaces
 import koppeltaal.models
@@ -169,3 +170,85 @@ def test_update_activitydefinition(connector, transport):
     assert definition.fhir_link == (
         'https://example.com/fhir/Koppeltaal/ActivityDefinition/1/'
         '_history/1970-02-02T02:02:02:02.2')
+
+
+def test_activity_cache(connector, transport, monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(
+        connector, 'activity_cache',
+        koppeltaal.connector.ActivityCache(ttl=60, clock=lambda: clock[0]))
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/Other/_search?code=ActivityDefinition',
+        respond_with='fixtures/activities_game.json')
+
+    activity = connector.activity('KTSTESTGAME')
+    assert activity.name == 'Test game'
+    assert connector.activity('RANJKA') is not None
+    assert connector.activity('UNKNOWN') is None
+    assert len(connector.activities()) == 2
+    # The catalogue was only fetched once.
+    assert transport.expected[
+        '/FHIR/Koppeltaal/Other/_search?code=ActivityDefinition'] == []
+
+    # Once expired, it is fetched again.
+    clock[0] = 60.0
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/Other/_search?code=ActivityDefinition',
+        respond_with='fixtures/activities_game.json')
+    assert connector.activity('KTSTESTGAME') is not activity
+    assert transport.expected[
+        '/FHIR/Koppeltaal/Other/_search?code=ActivityDefinition'] == []
+
+
+def test_activity_cache_revalidate(connector, transport, monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(
+        connector, 'activity_cache',
+        koppeltaal.connector.ActivityCache(ttl=60, clock=lambda: clock[0]))
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/Other/_search?code=ActivityDefinition',
+        respond_with='fixtures/activities_game.json',
+        etag='"v1"')
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/Other/_search?code=ActivityDefinition',
+        not_modified=True)
+
+    activity = connector.activity('KTSTESTGAME')
+    assert transport.headers[
+        '/FHIR/Koppeltaal/Other/_search?code=ActivityDefinition'] is None
+    clock[0] = 90.0
+    assert connector.activity('KTSTESTGAME') is activity
+    assert transport.headers[
+        '/FHIR/Koppeltaal/Other/_search?code=ActivityDefinition'] == {
+            'If-None-Match': '"v1"'}
+    # The catalogue is fresh again.
+    clock[0] = 149.0
+    assert connector.activity('KTSTESTGAME') is activity
+
+
+def test_activity_cache_invalidated(connector, transport, monkeypatch):
+    monkeypatch.setattr(
+        connector, 'activity_cache',
+        koppeltaal.connector.ActivityCache(ttl=60))
+    for index in range(2):
+        transport.expect(
+            'GET',
+            '/FHIR/Koppeltaal/Other/_search?code=ActivityDefinition',
+            respond_with='fixtures/activities_game.json')
+    transport.expect(
+        'POST',
+        koppeltaal.interfaces.OTHER_URL,
+        redirect_to=(
+            'https://example.com/fhir/Koppeltaal/ActivityDefinition/1/'
+            '_history/1970-01-01T01:01:01:01.1'))
+
+    activity = connector.activity('KTSTESTGAME')
+    activity.fhir_link = None
+    connector.send_activity(activity)
+    assert connector.activity('KTSTESTGAME') is not activity
+    assert transport.expected[
+        '/FHIR/Koppeltaal/Other/_search?code=ActivityDefinition'] == []
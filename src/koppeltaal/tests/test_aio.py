@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+import asyncio  # noqa: E402
+import hamcrest  # noqa: E402
+import zope.interface.verify  # noqa: E402
+import koppeltaal.aio  # noqa: E402
+import koppeltaal.connector  # noqa: E402
+import koppeltaal.definitions  # noqa: E402
+import koppeltaal.interfaces  # noqa: E402
+import koppeltaal.testing  # noqa: E402
+import koppeltaal.utils  # noqa: E402
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def server():
+    server = koppeltaal.testing.StubServer('koppeltaal.tests')
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def async_connector(monkeypatch, connector, server):
+    credentials = koppeltaal.utils.Credentials(
+        server.url, 'username', 'password', connector.domain, {})
+    integration = koppeltaal.connector.Integration(
+        'Koppeltaal Python Adapter Tests',
+        'https://example.com/fhir/Koppeltaal',
+        software='Koppeltaal Python Adapter Tests Runner',
+        version=koppeltaal.interfaces.VERSION)
+    monkeypatch.setattr(integration, 'model_id', lambda m: u'1')
+    monkeypatch.setattr(koppeltaal.utils, 'messageid', lambda: u'1234-5678')
+    return koppeltaal.aio.AsyncConnector(credentials, integration)
+
+
+def test_async_connector(async_connector):
+    assert zope.interface.verify.verifyObject(
+        koppeltaal.interfaces.IConnector, async_connector)
+
+
+def test_activities(async_connector, server):
+    server.expect(
+        'GET',
+        '/FHIR/Koppeltaal/Other/_search?code=ActivityDefinition',
+        respond_with='fixtures/activities_game.json')
+
+    async def scenario():
+        try:
+            return list(await async_connector.activities())
+        finally:
+            await async_connector.close()
+
+    activities = run(scenario())
+    assert len(activities) > 0
+    assert zope.interface.verify.verifyObject(
+        koppeltaal.definitions.ActivityDefinition, activities[0])
+
+
+def test_search_stream(async_connector, server):
+    server.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?_summary=true&_count=2',
+        respond_with='fixtures/bundle_search_page_1.json')
+    server.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_summary=true&_count=2&page=2',
+        respond_with='fixtures/bundle_search_page_2.json')
+
+    async def scenario():
+        try:
+            return [message async for message in
+                    async_connector.search_stream(batch_size=2, prefetch=1)]
+        finally:
+            await async_connector.close()
+
+    messages = run(scenario())
+    assert [m.fhir_link.split('/')[6] for m in messages] == [
+        '45909', '45910', '45911']
+
+
+def test_updates(async_connector, server):
+    for fixture in ['bundle_one_message.json', 'bundle_zero_messages.json']:
+        server.expect(
+            'GET',
+            '/FHIR/Koppeltaal/MessageHeader/_search?'
+            '_query=MessageHeader.GetNextNewAndClaim',
+            respond_with='fixtures/' + fixture)
+    server.expect(
+        'PUT',
+        '/FHIR/Koppeltaal/MessageHeader/45909'
+        '/_history/2016-07-15T11:50:24:494.7839',
+        respond_with='fixtures/resource_put_message.json')
+
+    async def scenario():
+        events = []
+        try:
+            async for update in async_connector.updates():
+                async with update:
+                    events.append(update.message.event)
+                    assert zope.interface.verify.verifyObject(
+                        koppeltaal.definitions.CarePlan, update.data)
+        finally:
+            await async_connector.close()
+        return events
+
+    assert run(scenario()) == ['CreateOrUpdateCarePlan']
+    assert server.errors == []
+    hamcrest.assert_that(
+        server.called.get(
+            '/FHIR/Koppeltaal/MessageHeader/45909'
+            '/_history/2016-07-15T11:50:24:494.7839'),
+        koppeltaal.testing.has_extension(
+            '#ProcessingStatus',
+            koppeltaal.testing.has_extension(
+                '#ProcessingStatusStatus',
+                hamcrest.has_entry('valueCode', 'Success'))))
+
+
+def test_send_operation_outcome_error(async_connector, server, patient):
+    server.expect(
+        'POST',
+        '/FHIR/Koppeltaal/Mailbox',
+        respond_error='fixtures/operation_outcome.json')
+
+    async def scenario():
+        try:
+            await async_connector.send(
+                'CreateOrUpdatePatient', patient, patient)
+        finally:
+            await async_connector.close()
+
+    with pytest.raises(koppeltaal.interfaces.OperationOutcomeError) as cm:
+        run(scenario())
+    assert len(cm.value.outcome.issue) == 2
+    assert server.called.get('/FHIR/Koppeltaal/Mailbox') is not None
+
+
+def test_connection_error(async_connector, server):
+    # Nothing is expected by the server: it answers with a non JSON error.
+
+    async def scenario():
+        try:
+            await async_connector.metadata()
+        finally:
+            await async_connector.close()
+
+    with pytest.raises(koppeltaal.interfaces.ConnectionError):
+        run(scenario())
+    assert len(server.errors) == 1
+
+
+def test_send_many(async_connector, server, patient):
+    server.expect(
+        'POST',
+        '/FHIR/Koppeltaal/Mailbox',
+        respond_with='fixtures/bundle_post_careplan_ok.json')
+    server.expect(
+        'POST',
+        '/FHIR/Koppeltaal/Mailbox',
+        respond_error='fixtures/operation_outcome.json')
+
+    async def scenario():
+        try:
+            return await async_connector.send_many(
+                [('CreateOrUpdateCarePlan', patient, patient)] * 2,
+                concurrency=1)
+        finally:
+            await async_connector.close()
+
+    results = run(scenario())
+    assert len(results[0]) == 3
+    assert isinstance(
+        results[1], koppeltaal.interfaces.OperationOutcomeError)
+
+
+def test_updates_ack_batcher(async_connector, server):
+    for fixture in ['bundle_one_message.json', 'bundle_one_message.json',
+                    'bundle_zero_messages.json']:
+        server.expect(
+            'GET',
+            '/FHIR/Koppeltaal/MessageHeader/_search?'
+            '_query=MessageHeader.GetNextNewAndClaim',
+            respond_with='fixtures/' + fixture)
+    # Only one acknowledgement can be sent back.
+    server.expect(
+        'PUT',
+        '/FHIR/Koppeltaal/MessageHeader/45909'
+        '/_history/2016-07-15T11:50:24:494.7839',
+        respond_with='fixtures/resource_put_message.json')
+
+    async def scenario():
+        try:
+            async with async_connector.ack_batcher(
+                    size=10, interval=None) as acks:
+                assert await async_connector.consume(
+                    lambda update: None, workers=1, acks=acks) == 2
+                # The acknowledgements wait to be sent back.
+                assert server.called == {}
+        finally:
+            await async_connector.close()
+        return acks
+
+    acks = run(scenario())
+    hamcrest.assert_that(
+        server.called.get(
+            '/FHIR/Koppeltaal/MessageHeader/45909'
+            '/_history/2016-07-15T11:50:24:494.7839'),
+        koppeltaal.testing.has_extension(
+            '#ProcessingStatus',
+            koppeltaal.testing.has_extension(
+                '#ProcessingStatusStatus',
+                hamcrest.has_entry('valueCode', 'Success'))))
+    assert len(acks.failed) == 1
+
+
+def test_ack_batcher_interval():
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def scenario():
+        acks = koppeltaal.aio.AsyncAckBatcher(send, interval=0.01)
+        await acks.add('message')
+        for index in range(500):
+            if sent:
+                break
+            await asyncio.sleep(0.01)
+        assert sent == ['message']
+        await acks.close()
+        await acks.add('other message')
+
+    run(scenario())
+    assert sent == ['message', 'other message']
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import pytest
+import koppeltaal.cache
+import koppeltaal.interfaces
+import koppeltaal.testing
+import koppeltaal.transport
+
+METADATA = '/FHIR/Koppeltaal/metadata'
+
+
+@pytest.fixture
+def server():
+    server = koppeltaal.testing.StubServer('koppeltaal.tests')
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def clock():
+    return [0.0]
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def response_cache(request, tmpdir, clock):
+    if request.param == 'memory':
+        backend = koppeltaal.cache.MemoryBackend(size=2)
+    else:
+        backend = koppeltaal.cache.DiskBackend(str(tmpdir.join('cache')))
+    return koppeltaal.cache.ResponseCache(backend, clock=lambda: clock[0])
+
+
+@pytest.fixture
+def transport(server, response_cache):
+    transport = koppeltaal.transport.Transport(
+        server.url, 'username', 'password', response_cache=response_cache)
+    yield transport
+    transport.close()
+
+
+def test_key():
+    cache = koppeltaal.cache.ResponseCache()
+    assert cache.key(METADATA) == '/FHIR/Koppeltaal/metadata? '
+    assert cache.key(
+        koppeltaal.interfaces.MESSAGE_HEADER_URL, {'_id': 45909}) == \
+        '/FHIR/Koppeltaal/MessageHeader/_search?_id=45909 '
+    # Parameters in the URL and given separately are the same.
+    assert cache.key(
+        koppeltaal.interfaces.ACTIVITY_DEFINITION_URL + '?code=A',
+        {'includearchived': 'yes'}, 'username') == cache.key(
+        koppeltaal.interfaces.ACTIVITY_DEFINITION_URL,
+        {'includearchived': 'yes', 'code': 'A'}, 'username')
+    # Only safe queries are cached.
+    assert cache.key(
+        koppeltaal.interfaces.MESSAGE_HEADER_URL,
+        {'_query': 'MessageHeader.GetNextNewAndClaim'}) is None
+    assert cache.key(
+        koppeltaal.interfaces.MESSAGE_HEADER_URL,
+        {'_summary': 'true', '_count': 100}) is None
+    assert cache.key(koppeltaal.interfaces.OAUTH_TOKEN_URL) is None
+
+
+def test_from_options(tmpdir):
+    assert koppeltaal.cache.ResponseCache.from_options({}) is None
+    cache = koppeltaal.cache.ResponseCache.from_options(
+        {'cache': 'memory', 'cache_size': '10'})
+    assert cache.backend.size == 10
+    cache = koppeltaal.cache.ResponseCache.from_options(
+        {'cache': str(tmpdir.join('cache'))})
+    assert isinstance(cache.backend, koppeltaal.cache.DiskBackend)
+
+
+def test_memory_backend_lru():
+    backend = koppeltaal.cache.MemoryBackend(size=2)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    assert backend.get('a') == 1
+    backend.set('c', 3)
+    assert backend.get('b') is None
+    assert backend.get('a') == 1
+    assert backend.get('c') == 3
+
+
+def test_fresh_response_from_cache(server, transport, clock):
+    server.expect(
+        'GET', METADATA,
+        respond_with='fixtures/bundle_zero_messages.json')
+    first = transport.query(METADATA)
+    clock[0] = 3599.0
+    second = transport.query(METADATA)
+    assert second.json == first.json
+    assert second.json is not first.json
+    assert server.fixtures.expected[METADATA] == []
+
+
+def test_revalidate(server, transport, clock):
+    server.expect(
+        'GET', METADATA,
+        respond_with='fixtures/bundle_zero_messages.json',
+        etag='"v1"',
+        cache_control='max-age=10')
+    server.expect('GET', METADATA, not_modified=True, etag='"v1"')
+    first = transport.query(METADATA)
+    clock[0] = 10.0
+    second = transport.query(METADATA)
+    assert second.json == first.json
+    assert server.fixtures.headers[METADATA]['If-None-Match'] == '"v1"'
+    # Fresh again after the revalidation.
+    clock[0] = 19.0
+    assert transport.query(METADATA).json == first.json
+    assert server.errors == []
+
+
+def test_no_store(server, transport):
+    for index in range(2):
+        server.expect(
+            'GET', METADATA,
+            respond_with='fixtures/bundle_zero_messages.json',
+            cache_control='no-store')
+    transport.query(METADATA)
+    transport.query(METADATA)
+    assert server.fixtures.expected[METADATA] == []
+
+
+def test_claim_never_cached(server, transport):
+    url = ('/FHIR/Koppeltaal/MessageHeader/_search?'
+           '_query=MessageHeader.GetNextNewAndClaim')
+    for index in range(2):
+        server.expect(
+            'GET', url,
+            respond_with='fixtures/bundle_one_message.json',
+            etag='"v1"',
+            cache_control='max-age=60')
+    for index in range(2):
+        transport.query(
+            koppeltaal.interfaces.MESSAGE_HEADER_URL,
+            {'_query': 'MessageHeader.GetNextNewAndClaim'})
+    assert server.fixtures.expected[url] == []
+    assert 'If-None-Match' not in server.fixtures.headers[url]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import json
+import pytest
+import sys
+import koppeltaal.codec
+
+DATA = {
+    'resourceType': 'Patient',
+    'name': [{'given': [u'Jöhn'], 'family': ['Doe']}],
+    'active': True,
+    'count': 3,
+    'nothing': None}
+
+
+def installed():
+    names = []
+    for factory in koppeltaal.codec.CODECS:
+        try:
+            factory()
+        except ImportError:
+            continue
+        names.append(factory.name)
+    return names
+
+
+@pytest.fixture(params=installed())
+def codec(request):
+    previous = koppeltaal.codec.codec
+    yield koppeltaal.codec.use(request.param)
+    koppeltaal.codec.codec = previous
+
+
+def test_round_trip(codec):
+    encoded = koppeltaal.codec.dumps(DATA)
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded.decode('utf-8')) == DATA
+    assert koppeltaal.codec.loads(encoded) == DATA
+    assert koppeltaal.codec.loads(encoded.decode('utf-8')) == DATA
+
+
+def test_pretty(codec):
+    text = koppeltaal.codec.pretty(DATA)
+    assert isinstance(text, type(u''))
+    assert json.loads(text) == DATA
+    # The output is stable, whatever the codec.
+    assert text == json.dumps(
+        DATA, indent=2, sort_keys=True, ensure_ascii=False)
+
+
+def test_fallback(monkeypatch):
+    previous = koppeltaal.codec.codec
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+    monkeypatch.setitem(sys.modules, 'ujson', None)
+    try:
+        assert koppeltaal.codec.use().name == 'json'
+        with pytest.raises(ImportError):
+            koppeltaal.codec.use('orjson')
+        with pytest.raises(ValueError):
+            koppeltaal.codec.use('yaml')
+    finally:
+        koppeltaal.codec.codec = previous
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+
+The generated pack and unpack functions must behave exactly as the
+packer: these tests compare both over all the test fixtures.
+"""
+
+import copy
+import datetime
+import glob
+import json
+import os.path
+import pkg_resources
+import pytest
+import koppeltaal.connector
+import koppeltaal.interfaces
+import koppeltaal.models
+import koppeltaal.fhir.xml
+
+from koppeltaal import fhir
+from koppeltaal.fhir import bundle, codegen, packer, resource
+
+
+BASE = 'https://example.com/fhir/Koppeltaal'
+
+FIXTURES = pkg_resources.resource_filename('koppeltaal.tests', 'fixtures')
+
+# Values of the wrong type for every field type.
+WRONG = [42, u'wrong', True, None, [], {}, [42], {'reference': 42}]
+
+
+def load_fixtures():
+    fixtures = []
+    for filename in sorted(glob.glob(os.path.join(FIXTURES, '*.json'))):
+        with open(filename) as fp:
+            fixtures.append((os.path.basename(filename), json.load(fp)))
+    for filename in sorted(glob.glob(os.path.join(FIXTURES, '*.xml'))):
+        fixtures.append((
+            os.path.basename(filename),
+            koppeltaal.fhir.xml.xml2json(filename)))
+    return fixtures
+
+
+FIXTURE_PAYLOADS = load_fixtures()
+
+
+@pytest.fixture(params=[name for name, _ in FIXTURE_PAYLOADS])
+def fixture(request):
+    return copy.deepcopy(dict(FIXTURE_PAYLOADS)[request.param])
+
+
+class Integration(koppeltaal.connector.Integration):
+    """Integration giving the models identifiers in the order they are
+    packed, so both packers give them the same identifiers.
+    """
+
+    def __init__(self):
+        super(Integration, self).__init__(
+            name='Test',
+            url=BASE,
+            software='Test',
+            version='0.0')
+        self._ids = {}
+
+    def model_id(self, model):
+        return self._ids.setdefault(id(model), len(self._ids) + 1)
+
+
+@pytest.fixture
+def integration():
+    return Integration()
+
+
+@pytest.fixture
+def compiled():
+    codegen.use_compiled_packer()
+    yield
+    codegen.use_compiled_packer(False)
+
+
+def contents(payload):
+    if payload.get('resourceType') == 'Bundle':
+        return [entry['content'] for entry in payload['entry']]
+    return [payload]
+
+
+def create(factory, payload):
+    integration = Integration()
+    if payload.get('resourceType') == 'Bundle':
+        packaging = bundle.Bundle('test', integration)
+    else:
+        packaging = resource.Resource('test', integration)
+    packaging.packer = factory(packaging, integration.fhir_link)
+    packaging.add_payload(payload)
+    return packaging
+
+
+def outcome(function, *args):
+    try:
+        return function(*args)
+    except Exception as error:
+        return (error.__class__, str(error))
+
+
+def described(result):
+    if isinstance(result, tuple):
+        return result
+    if isinstance(result, Exception):
+        return (result.__class__, str(result))
+    if koppeltaal.interfaces.IBrokenFHIRResource.providedBy(result):
+        return (result.__class__, str(result.error))
+    return result.__class__
+
+
+def repack(factory, models):
+    integration = Integration()
+    packaging = bundle.Bundle('test', integration)
+    packaging.packer = factory(packaging, integration.fhir_link)
+    for model in models:
+        if koppeltaal.interfaces.IFHIRResource.providedBy(model):
+            outcome(packaging.add_model, model)
+    return [outcome(entry.pack) for entry in packaging.items]
+
+
+def test_compiled_for():
+    for definition in fhir.REGISTRY:
+        compiled = codegen.compiled_for(definition)
+        assert compiled is not None
+        assert codegen.compiled_for(definition) is compiled
+
+
+def test_unpack(fixture):
+    interpreted = create(packer.Packer, copy.deepcopy(fixture))
+    generated = create(codegen.CompiledPacker, fixture)
+    expected = [outcome(entry.unpack) for entry in interpreted.items]
+    models = [outcome(entry.unpack) for entry in generated.items]
+    assert list(map(described, models)) == list(map(described, expected))
+
+    # Packing the models yields the same payloads with both packers, that
+    # are the ones of the packer.
+    payloads = repack(packer.Packer, expected)
+    assert repack(codegen.CompiledPacker, expected) == payloads
+    assert repack(packer.Packer, models) == payloads
+    assert repack(codegen.CompiledPacker, models) == payloads
+
+
+def test_validate(fixture):
+    interpreted = create(packer.Packer, copy.deepcopy(fixture))
+    generated = create(codegen.CompiledPacker, fixture)
+    for content in contents(fixture):
+        definition = fhir.REGISTRY.definition_for_type(
+            content.get('resourceType'))
+        if definition is None:
+            continue
+        assert described(outcome(
+            generated.packer.validate, content, definition)) == \
+            described(outcome(
+                interpreted.packer.validate, content, definition))
+        # Replace every field by values of the wrong type.
+        for key in sorted(content):
+            if key == 'resourceType':
+                continue
+            for wrong in WRONG:
+                broken = dict(content, **{key: wrong})
+                assert described(outcome(
+                    generated.packer.validate, broken, definition)) == \
+                    described(outcome(
+                        interpreted.packer.validate, broken, definition))
+
+
+def test_pack_invalid():
+    patient = koppeltaal.models.Patient(
+        name=[koppeltaal.models.Name(given=[u'Jane'])],
+        birth_date=datetime.date(1980, 1, 1),
+        age=40)
+    careteam = koppeltaal.models.CareTeam(
+        name=u'Team',
+        status='active',
+        subject=patient,
+        period=koppeltaal.models.Period(start=datetime.datetime(2020, 1, 1)))
+    for model, attribute in [
+            (patient, 'active'),
+            (patient, 'age'),
+            (patient, 'birth_date'),
+            (patient, 'gender'),
+            (patient, 'name'),
+            (careteam, 'status'),
+            (careteam, 'name')]:
+        original = getattr(model, attribute)
+        try:
+            for wrong in WRONG + [[None], datetime.date(2020, 1, 1)]:
+                setattr(model, attribute, wrong)
+                assert repack(codegen.CompiledPacker, [model]) \
+                    == repack(packer.Packer, [model])
+        finally:
+            setattr(model, attribute, original)
+    assert outcome(
+        codegen.CompiledPacker(None, BASE).pack,
+        patient, koppeltaal.definitions.CareTeam) == outcome(
+        packer.Packer(None, BASE).pack,
+        patient, koppeltaal.definitions.CareTeam)
+
+
+def test_use_compiled_packer(integration, compiled):
+    packaging = bundle.Bundle('test', integration)
+    assert isinstance(packaging.packer, codegen.CompiledPacker)
+    assert packaging.packer._create_validator is codegen.CompiledValidator
+    codegen.use_compiled_packer(False)
+    packaging = bundle.Bundle('test', integration)
+    assert type(packaging.packer) is packer.Packer
+    assert packaging.packer._create_validator is packer.Validator
+
+
+def test_lazy_bundle(integration, compiled):
+    with open(os.path.join(FIXTURES, 'bundle_one_error.json')) as fp:
+        payload = json.load(fp)
+    packaging = bundle.Bundle('test', integration, lazy=True)
+    packaging.add_payload(payload)
+    errors = packaging.errors()
+    assert len(errors) == 1
+    assert isinstance(
+        errors[0].error, koppeltaal.interfaces.InvalidValue)
+
+
+def test_not_compiled(fixture, monkeypatch):
+    # Definitions that cannot be compiled are (un)packed by the packer.
+    monkeypatch.setattr(codegen, 'compiled_for', lambda definition: None)
+    test_unpack(fixture)
+    test_validate(fixture)
@@ -6,7 +6,9 @@
 
 import pytest
 import hamcrest
+import threading
 import zope.interface.verify
+import koppeltaal.connector
 import koppeltaal.definitions
 import koppeltaal.interfaces
 import koppeltaal.testing
@@ -37,6 +39,114 @@ def test_search_message_id_from_fixture(connector, transport):
         koppeltaal.definitions.Patient, message.patient)
 
 
+def test_search_stream_from_fixture(connector, transport):
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?_summary=true&_count=2',
+        respond_with='fixtures/bundle_search_page_1.json')
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_summary=true&_count=2&page=2',
+        respond_with='fixtures/bundle_search_page_2.json')
+
+    messages = connector.search_stream(batch_size=2)
+    message = next(messages)
+    assert zope.interface.verify.verifyObject(
+        koppeltaal.definitions.MessageHeader, message)
+    assert message.fhir_link.startswith(
+        'https://edgekoppeltaal.vhscloud.nl/FHIR/Koppeltaal/'
+        'MessageHeader/45909/')
+    assert message.event == 'CreateOrUpdateCarePlan'
+    # The second page is only requested when the first one is consumed.
+    assert len(transport.expected[
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_summary=true&_count=2&page=2']) == 1
+
+    messages = [message] + list(messages)
+    assert [m.event for m in messages] == [
+        'CreateOrUpdateCarePlan',
+        'CreateOrUpdatePatient',
+        'CreateOrUpdateCarePlan']
+    assert [m.fhir_link.split('/')[6] for m in messages] == [
+        '45909', '45910', '45911']
+
+
+def test_search_stream_batch_count(connector, transport):
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?_summary=true&_count=2',
+        respond_with='fixtures/bundle_search_page_1.json')
+
+    messages = list(connector.search_stream(batch_size=2, batch_count=1))
+    assert len(messages) == 2
+
+
+def test_search_stream_prefetch(connector, transport):
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?_summary=true&_count=2',
+        respond_with='fixtures/bundle_search_page_1.json')
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_summary=true&_count=2&page=2',
+        respond_with='fixtures/bundle_search_page_2.json')
+
+    messages = list(connector.search_stream(batch_size=2, prefetch=1))
+    assert [m.fhir_link.split('/')[6] for m in messages] == [
+        '45909', '45910', '45911']
+
+    # Errors while prefetching are raised when the page is consumed.
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?_summary=true&_count=2',
+        respond_with='fixtures/bundle_search_page_1.json')
+    messages = connector.search_stream(batch_size=2, prefetch=1)
+    assert next(messages).event == 'CreateOrUpdateCarePlan'
+    assert next(messages).event == 'CreateOrUpdatePatient'
+    with pytest.raises(AssertionError):
+        next(messages)
+
+
+def test_search_stream_prefetch_stop(connector, transport):
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?_summary=true&_count=2',
+        respond_with='fixtures/bundle_search_page_1.json')
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_summary=true&_count=2&page=2',
+        respond_with='fixtures/bundle_search_page_1.json')
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_summary=true&_count=2&page=2',
+        respond_with='fixtures/bundle_search_page_1.json')
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_summary=true&_count=2&page=2',
+        respond_with='fixtures/bundle_search_page_1.json')
+
+    messages = connector.search_stream(batch_size=2, prefetch=1)
+    assert next(messages).event == 'CreateOrUpdateCarePlan'
+    messages.close()
+
+    for thread in threading.enumerate():
+        if thread.name == 'koppeltaal-prefetch':
+            thread.join(5)
+            assert not thread.is_alive()
+    # The next page links to itself, so the pages would never end. Only
+    # the first page is consumed, a second one is prefetched and a third
+    # one may be waiting to be queued. No page is queried after that, so
+    # the last expected page is left.
+    assert len(transport.expected[
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_summary=true&_count=2&page=2']) >= 1
+
+
 def test_send_careplan_success_from_fixture(
         connector, transport, careplan_from_fixture):
     transport.expect(
@@ -155,6 +265,97 @@ def test_send_careplan_operation_outcome_error_from_fixture(
         'this Message and apply changes before resubmit.')
 
 
+def test_send_many_from_fixture(
+        connector, transport, careplan_from_fixture):
+    for index in range(3):
+        transport.expect(
+            'POST',
+            '/FHIR/Koppeltaal/Mailbox',
+            respond_with='fixtures/bundle_post_careplan_ok.json')
+    items = [('CreateOrUpdateCarePlan',
+              careplan_from_fixture,
+              careplan_from_fixture.patient)] * 3
+    results = connector.send_many(items, concurrency=2)
+    assert len(results) == 3
+    for response_data in results:
+        assert len(response_data) == 3
+        assert response_data[0].fhir_link == (
+            'https://example.com/fhir/Koppeltaal/CarePlan/1/'
+            '_history/1970-01-01T01:01:01:01.1')
+    assert transport.expected['/FHIR/Koppeltaal/Mailbox'] == []
+
+
+def test_send_many_errors_in_order(
+        connector, transport, careplan_from_fixture):
+    for fixture in ['bundle_post_careplan_ok.json',
+                    'operation_outcome.json',
+                    'bundle_post_careplan_ok.json']:
+        if fixture == 'operation_outcome.json':
+            transport.expect(
+                'POST',
+                '/FHIR/Koppeltaal/Mailbox',
+                respond_error='fixtures/' + fixture)
+        else:
+            transport.expect(
+                'POST',
+                '/FHIR/Koppeltaal/Mailbox',
+                respond_with='fixtures/' + fixture)
+    items = [('CreateOrUpdateCarePlan',
+              careplan_from_fixture,
+              careplan_from_fixture.patient)] * 3
+    results = connector.send_many(items, concurrency=1)
+    assert len(results[0]) == 3
+    assert isinstance(
+        results[1], koppeltaal.interfaces.OperationOutcomeError)
+    assert len(results[1].outcome.issue) == 2
+    assert len(results[2]) == 3
+
+
+def test_send_many_unexpected_error(
+        connector, transport, careplan_from_fixture, monkeypatch):
+    for index in range(3):
+        transport.expect(
+            'POST',
+            '/FHIR/Koppeltaal/Mailbox',
+            respond_with='fixtures/bundle_post_careplan_ok.json')
+    send = connector.send
+
+    def failing_send(event, data, patient):
+        if data is None:
+            raise ValueError('Broken item')
+        return send(event, data, patient)
+
+    monkeypatch.setattr(connector, 'send', failing_send)
+    item = ('CreateOrUpdateCarePlan',
+            careplan_from_fixture,
+            careplan_from_fixture.patient)
+    items = [item, ('CreateOrUpdateCarePlan', None, None), item, item]
+    with pytest.raises(ValueError):
+        connector.send_many(items, concurrency=1)
+    # The other items are sent nevertheless.
+    assert transport.expected['/FHIR/Koppeltaal/Mailbox'] == []
+
+
+def test_send_many_malformed_item(
+        connector, transport, careplan_from_fixture):
+    for index in range(3):
+        transport.expect(
+            'POST',
+            '/FHIR/Koppeltaal/Mailbox',
+            respond_with='fixtures/bundle_post_careplan_ok.json')
+    item = ('CreateOrUpdateCarePlan',
+            careplan_from_fixture,
+            careplan_from_fixture.patient)
+    # An item that is not an (event, data, patient) triple is raised, it
+    # does not end the worker with its result left to None.
+    with pytest.raises(ValueError):
+        connector.send_many(
+            [item, ('CreateOrUpdateCarePlan', None), item], concurrency=1)
+    with pytest.raises(TypeError):
+        connector.send_many([item, None], concurrency=1)
+    assert transport.expected['/FHIR/Koppeltaal/Mailbox'] == []
+
+
 def test_updates_implicit_success_from_fixture(connector, transport):
     transport.expect(
         'GET',
@@ -436,6 +637,224 @@ def test_updates_error_from_fixture(connector, transport):
             )))
 
 
+def test_updates_lazy_from_fixture(connector, transport):
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_query=MessageHeader.GetNextNewAndClaim',
+        respond_with='fixtures/bundle_one_error.json')
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_query=MessageHeader.GetNextNewAndClaim',
+        respond_with='fixtures/bundle_one_message.json')
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_query=MessageHeader.GetNextNewAndClaim',
+        respond_with='fixtures/bundle_zero_messages.json')
+    transport.expect(
+        'PUT',
+        '/FHIR/Koppeltaal/MessageHeader/45909'
+        '/_history/2016-07-15T11:50:24:494.7839',
+        respond_with='fixtures/resource_put_message.json')
+    transport.expect(
+        'PUT',
+        '/FHIR/Koppeltaal/MessageHeader/45909'
+        '/_history/2016-07-15T11:50:24:494.7839',
+        respond_with='fixtures/resource_put_message.json')
+
+    updates = connector.updates(lazy=True)
+    update = next(updates)
+    # The message with the error was failed before getting here.
+    hamcrest.assert_that(
+        transport.called.get(
+            '/FHIR/Koppeltaal/MessageHeader/45909'
+            '/_history/2016-07-15T11:50:24:494.7839'),
+        koppeltaal.testing.has_exception(
+            hamcrest.ends_with(
+                "RequiredMissing: 'startDate' required but missing.")))
+    with update:
+        assert update.message.event == 'CreateOrUpdateCarePlan'
+        assert zope.interface.verify.verifyObject(
+            koppeltaal.definitions.CarePlan, update.data)
+        assert zope.interface.verify.verifyObject(
+            koppeltaal.definitions.Patient, update.patient)
+    assert list(updates) == []
+
+
+def test_consume_from_fixture(connector, transport):
+    for fixture in ['bundle_one_message.json', 'bundle_one_message.json',
+                    'bundle_zero_messages.json', 'bundle_zero_messages.json']:
+        transport.expect(
+            'GET',
+            '/FHIR/Koppeltaal/MessageHeader/_search?'
+            '_query=MessageHeader.GetNextNewAndClaim',
+            respond_with='fixtures/' + fixture)
+    for index in range(2):
+        transport.expect(
+            'PUT',
+            '/FHIR/Koppeltaal/MessageHeader/45909'
+            '/_history/2016-07-15T11:50:24:494.7839',
+            respond_with='fixtures/resource_put_message.json')
+
+    handled = []
+
+    def handler(update):
+        assert zope.interface.verify.verifyObject(
+            koppeltaal.definitions.CarePlan, update.data)
+        handled.append(threading.current_thread().name)
+
+    assert connector.consume(handler, workers=2) == 2
+    assert len(handled) == 2
+    assert transport.expected[
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_query=MessageHeader.GetNextNewAndClaim'] == []
+    hamcrest.assert_that(
+        transport.called.get(
+            '/FHIR/Koppeltaal/MessageHeader/45909'
+            '/_history/2016-07-15T11:50:24:494.7839'),
+        koppeltaal.testing.has_extension(
+            '#ProcessingStatus',
+            koppeltaal.testing.has_extension(
+                '#ProcessingStatusStatus',
+                hamcrest.has_entry('valueCode', 'Success'))))
+
+
+def test_consume_handler_error(connector, transport):
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_query=MessageHeader.GetNextNewAndClaim',
+        respond_with='fixtures/bundle_one_message.json')
+    transport.expect(
+        'PUT',
+        '/FHIR/Koppeltaal/MessageHeader/45909'
+        '/_history/2016-07-15T11:50:24:494.7839',
+        respond_with='fixtures/resource_put_message.json')
+
+    def handler(update):
+        raise ValueError('Cannot handle update')
+
+    with pytest.raises(ValueError):
+        connector.consume(handler, workers=1)
+
+    # The message is put back to be processed later.
+    hamcrest.assert_that(
+        transport.called.get(
+            '/FHIR/Koppeltaal/MessageHeader/45909'
+            '/_history/2016-07-15T11:50:24:494.7839'),
+        koppeltaal.testing.has_extension(
+            '#ProcessingStatus',
+            koppeltaal.testing.has_extension(
+                '#ProcessingStatusStatus',
+                hamcrest.has_entry('valueCode', 'New'))))
+
+
+def test_consume_stop(connector, transport):
+    transport.expect(
+        'GET',
+        '/FHIR/Koppeltaal/MessageHeader/_search?'
+        '_query=MessageHeader.GetNextNewAndClaim',
+        respond_with='fixtures/bundle_one_message.json')
+    transport.expect(
+        'PUT',
+        '/FHIR/Koppeltaal/MessageHeader/45909'
+        '/_history/2016-07-15T11:50:24:494.7839',
+        respond_with='fixtures/resource_put_message.json')
+
+    stop = threading.Event()
+
+    def handler(update):
+        stop.set()
+
+    # No other message is claimed after stop is set.
+    assert connector.consume(handler, workers=1, stop=stop) == 1
+
+
+def test_updates_ack_batcher(connector, transport, monkeypatch):
+    for fixture in ['bundle_one_message.json', 'bundle_zero_messages.json']:
+        transport.expect(
+            'GET',
+            '/FHIR/Koppeltaal/MessageHeader/_search?'
+            '_query=MessageHeader.GetNextNewAndClaim',
+            respond_with='fixtures/' + fixture)
+    transport.expect(
+        'PUT',
+        '/FHIR/Koppeltaal/MessageHeader/45909'
+        '/_history/2016-07-15T11:50:24:494.7839',
+        respond_with='fixtures/resource_put_message.json')
+
+    hooked = []
+
+    def transaction_hook(commit_function, message):
+        hooked.append(message.fhir_link)
+        return commit_function(message)
+
+    monkeypatch.setattr(
+        connector.integration, 'transaction_hook', transaction_hook)
+
+    with connector.ack_batcher(size=10, interval=None) as acks:
+        for update in connector.updates(acks=acks):
+            with update:
+                update.success()
+        # The acknowledgement goes through the transaction hook, but
+        # waits to be sent back.
+        assert len(hooked) == 1
+        assert transport.called == {}
+    hamcrest.assert_that(
+        transport.called.get(
+            '/FHIR/Koppeltaal/MessageHeader/45909'
+            '/_history/2016-07-15T11:50:24:494.7839'),
+        koppeltaal.testing.has_extension(
+            '#ProcessingStatus',
+            koppeltaal.testing.has_extension(
+                '#ProcessingStatusStatus',
+                hamcrest.has_entry('valueCode', 'Success'))))
+    assert acks.failed == []
+
+
+def test_consume_ack_batcher(connector, transport):
+    for fixture in ['bundle_one_message.json', 'bundle_one_message.json',
+                    'bundle_one_message.json', 'bundle_zero_messages.json']:
+        transport.expect(
+            'GET',
+            '/FHIR/Koppeltaal/MessageHeader/_search?'
+            '_query=MessageHeader.GetNextNewAndClaim',
+            respond_with='fixtures/' + fixture)
+    # Only two acknowledgements can be sent back.
+    for index in range(2):
+        transport.expect(
+            'PUT',
+            '/FHIR/Koppeltaal/MessageHeader/45909'
+            '/_history/2016-07-15T11:50:24:494.7839',
+            respond_with='fixtures/resource_put_message.json')
+
+    with connector.ack_batcher(size=2, interval=None) as acks:
+        assert connector.consume(lambda u: None, workers=1, acks=acks) == 3
+        # A first batch was sent back when it was full, the third
+        # acknowledgement is waiting.
+        assert transport.expected[
+            '/FHIR/Koppeltaal/MessageHeader/45909'
+            '/_history/2016-07-15T11:50:24:494.7839'] == []
+        assert acks.failed == []
+    assert len(acks.failed) == 1
+
+
+def test_ack_batcher_interval():
+    sent = []
+    acks = koppeltaal.connector.AckBatcher(sent.append, interval=0.01)
+    acks.add('message')
+    for index in range(500):
+        if sent:
+            break
+        threading.Event().wait(0.01)
+    assert sent == ['message']
+    acks.close()
+    acks.add('other message')
+    assert sent == ['message', 'other message']
+
+
 def test_updates_expected_event(connector, transport):
     transport.expect(
         'GET',
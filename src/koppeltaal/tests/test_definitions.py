@@ -5,6 +5,7 @@
 """
 
 import datetime
+import pickle
 import pytest
 import zope.interface.verify
 import koppeltaal.codes
@@ -69,9 +70,35 @@ def test_coding(packer, namespace):
         'code': 'human',
         'system': namespace + 'Vertebrate'}
 
+    # Codings are shared and cannot be modified.
+    assert vertebrates.pack_coding('human') is coding
+    with pytest.raises(TypeError):
+        coding['display'] = 'Human'
+    with pytest.raises(TypeError):
+        coding |= {'display': 'Human'}
+    assert coding.copy() == {
+        'code': 'human',
+        'system': namespace + 'Vertebrate'}
+    assert pickle.loads(pickle.dumps(coding)) == coding
+
     with pytest.raises(koppeltaal.interfaces.InvalidCode):
         vertebrates.pack_coding('sponges')
 
+    # Codes cannot be modified either.
+    for modify in [
+            lambda: vertebrates.update({'sponges': 'Sponges'}),
+            lambda: vertebrates.__setitem__('sponges', 'Sponges'),
+            lambda: vertebrates.__ior__({'sponges': 'Sponges'}),
+            lambda: vertebrates.pop('human')]:
+        with pytest.raises(TypeError):
+            modify()
+    assert 'sponges' not in vertebrates
+    assert 'human' in vertebrates
+    copied = pickle.loads(pickle.dumps(vertebrates))
+    assert copied == vertebrates
+    assert copied.system == vertebrates.system
+    assert copied.pack_coding('human') == coding
+
     unpacked = vertebrates.unpack_code('amphibians')
     assert unpacked == 'amphibians'
 
@@ -1057,3 +1084,24 @@ def test_pack_organization(packer):
         'id': 'ref003',
         'name': 'Example',
         'type': 'team'}
+
+
+def test_plan():
+    plan = koppeltaal.fhir.packer.plan_for(koppeltaal.definitions.Patient)
+    assert koppeltaal.fhir.packer.plan_for(
+        koppeltaal.definitions.Patient) is plan
+
+    assert [entry.name for entry in plan.fields if entry.is_extension] == [
+        'age']
+    assert plan.has_native
+    assert plan.has_extension
+    for name, field, is_extension, unpack_item, pack_item in plan.fields:
+        assert isinstance(field, koppeltaal.definitions.Field)
+        assert is_extension == (field.extension is not None)
+        handlers = (koppeltaal.fhir.packer.Native,
+                    koppeltaal.fhir.packer.Extension)[is_extension]
+        assert unpack_item is handlers._unpackers[field.field_type]
+        assert pack_item is handlers._packers[field.field_type]
+
+    plan = koppeltaal.fhir.packer.plan_for(koppeltaal.definitions.Name)
+    assert not plan.has_extension
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import pytest
+import sys
+import koppeltaal.connector
+import koppeltaal.interfaces
+import koppeltaal.loadtest
+import koppeltaal.utils
+
+
+@pytest.fixture
+def stand_in():
+    with koppeltaal.loadtest.StandInServer(page_size=3, seed=42) as server:
+        yield server
+
+
+def make_connector(server, name, **options):
+    credentials = koppeltaal.utils.Credentials(
+        server.url, 'username', 'password', 'StandIn', options)
+    return koppeltaal.connector.Connector(
+        credentials, koppeltaal.loadtest.Integration(
+            name, 'https://{}.example.com/fhir/Koppeltaal'.format(name)))
+
+
+@pytest.fixture
+def sender(stand_in):
+    connector = make_connector(stand_in, 'sender')
+    yield connector
+    connector.close()
+
+
+@pytest.fixture
+def receiver(stand_in):
+    connector = make_connector(stand_in, 'receiver')
+    yield connector
+    connector.close()
+
+
+def send_patients(sender, count):
+    return sender.send_many([
+        koppeltaal.loadtest.patient_message(index) for index in range(count)])
+
+
+def test_send_and_consume(stand_in, sender, receiver):
+    results = send_patients(sender, 5)
+    assert all(isinstance(result, list) for result in results)
+    assert len(stand_in.messages) == 5
+    assert {m.status for m in stand_in.messages.values()} == {'New'}
+
+    # The sender acknowledges its own messages without processing them.
+    patients = []
+    for update in receiver.updates():
+        with update:
+            patients.append(update.data.name[0].family)
+    assert sorted(patients) == [
+        [u'Test {}'.format(index)] for index in range(5)]
+    assert {m.status for m in stand_in.messages.values()} == {'Success'}
+    assert list(receiver.updates()) == []
+
+
+def test_postpone(stand_in, sender, receiver):
+    send_patients(sender, 1)
+    with pytest.raises(ValueError):
+        for update in receiver.updates():
+            with update:
+                raise ValueError('Try again')
+    message, = stand_in.messages.values()
+    assert message.status == 'New'
+    assert receiver.consume(lambda update: update.fail('Broken')) == 1
+    assert message.status == 'Failed'
+
+
+def test_search(stand_in, sender):
+    send_patients(sender, 7)
+    messages = list(sender.search_stream(batch_size=3))
+    assert len(messages) == 7
+    assert stand_in.requests['search'] == 3
+    assert list(sender.search_stream(
+        status='Success', batch_size=3)) == []
+    message, patient = sender.search(message_id='4')
+    assert message.patient is patient
+    assert message.fhir_link.startswith(
+        stand_in.url + '/FHIR/Koppeltaal/MessageHeader/4/_history/')
+
+
+def test_version_conflict(stand_in, sender, receiver):
+    send_patients(sender, 1)
+    update = next(receiver.updates())
+    message, = stand_in.messages.values()
+    message.version += 1
+    with pytest.raises(koppeltaal.interfaces.ResponseError):
+        with update:
+            pass
+    assert message.status == 'Claimed'
+
+
+def test_metadata_activities_and_launch(stand_in, sender):
+    assert sender.metadata()['name'] == 'Koppeltaal stand-in'
+    activity = sender.activity('KTSTESTGAME')
+    assert activity is not None
+    location = sender.launch_from_parameters(
+        'my-app', 'https://example.com/Patient/1',
+        'https://example.com/Patient/1', 'activity-1')
+    assert location.startswith(
+        stand_in.url + '/Application/my-app/launch?iss=')
+
+
+def test_error_injection(stand_in):
+    stand_in.error_rate = 0.5
+    failing = make_connector(stand_in, 'failing')
+    retrying = make_connector(
+        stand_in, 'retrying', retries=10, retry_budget=1, retry_backoff=0)
+    try:
+        with pytest.raises(koppeltaal.interfaces.ResponseError):
+            for _ in range(10):
+                failing.metadata()
+        for _ in range(10):
+            assert retrying.metadata()['name'] == 'Koppeltaal stand-in'
+    finally:
+        failing.close()
+        retrying.close()
+    assert stand_in.errors['metadata'] > 0
+
+
+def test_latency(stand_in, sender):
+    stand_in.latency = 0.05
+    report = koppeltaal.loadtest.run_send(sender, 4, concurrency=4)
+    assert report.count == 4
+    assert report.errors == 0
+    assert report.elapsed < 0.2
+    assert min(report.durations['POST']) >= 0.05
+
+
+def test_loadtest(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', [
+        'koppeltaal-loadtest', '--messages', '10', '--concurrency', '2'])
+    koppeltaal.loadtest.loadtest()
+    output = capsys.readouterr().out
+    assert 'send: 10 messages in' in output
+    assert 'consume: 10 messages in' in output
+    assert 'POST       10 requests, latency p50=' in output
+
+
+def test_consume_errors(stand_in, sender, receiver):
+    send_patients(sender, 6)
+
+    def handler(update):
+        if update.data.name[0].family == [u'Test 3']:
+            raise ValueError('Broken')
+        update.success()
+
+    report = koppeltaal.loadtest.run_consume(receiver, 2, handler)
+    assert report.count == 5
+    assert report.errors == 1
+
+
+def test_consume_ack_errors(stand_in, sender, receiver, monkeypatch):
+    send_patients(sender, 4)
+    send_back = receiver._send_back
+    failed = []
+
+    def failing(message):
+        if not failed:
+            failed.append(message)
+            raise koppeltaal.interfaces.TransportError('Unavailable')
+        send_back(message)
+
+    monkeypatch.setattr(receiver, '_send_back', failing)
+    report = koppeltaal.loadtest.run_consume(receiver, 2)
+    assert report.count == 3
+    assert report.errors == 1
+    assert 'consume: 3 messages in' in str(report)
+    assert '1 errors' in str(report)
+
+
+def test_loadtest_errors(monkeypatch, capsys):
+    # Failed sends, claims and acknowledgements are reported, they do not
+    # stop the load test.
+    monkeypatch.setattr(sys, 'argv', [
+        'koppeltaal-loadtest', '--messages', '20', '--concurrency', '2',
+        '--error-rate', '0.3', '--seed', '1'])
+    koppeltaal.loadtest.loadtest()
+    output = capsys.readouterr().out
+    assert 'send: ' in output
+    assert 'consume: ' in output
+    assert 'injected errors' in output
+
+
+def test_loadtest_server(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', [
+        'koppeltaal-loadtest', '--server', 'https://example.com'])
+    with pytest.raises(SystemExit):
+        koppeltaal.loadtest.loadtest()
+    assert '--claim-all' in capsys.readouterr().err
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import logging
+import koppeltaal.codec
+import koppeltaal.logger
+
+
+def test_debug_json_disabled(caplog, monkeypatch):
+    rendered = []
+    monkeypatch.setattr(koppeltaal.codec, 'pretty', rendered.append)
+    caplog.set_level(logging.INFO, logger='koppeltaal.connector')
+    koppeltaal.logger.debug_json('Payload {json}', json={'a': 1})
+    assert rendered == []
+    assert caplog.records == []
+
+
+def test_debug_json_enabled(caplog):
+    caplog.set_level(logging.DEBUG, logger='koppeltaal.connector')
+    koppeltaal.logger.debug_json(
+        'Payload of {id}: {json}', id='abc', json={'b': 2, 'a': 1})
+    assert caplog.messages == [
+        'Payload of abc: {\n  "a": 1,\n  "b": 2\n}']
+
+
+def test_event(caplog):
+    caplog.set_level(logging.DEBUG, logger='koppeltaal.connector')
+    koppeltaal.logger.event(
+        'message.sent', message_id='abc', size=12, duration=0.5)
+    record, = caplog.records
+    assert record.levelno == logging.DEBUG
+    assert record.event == 'message.sent'
+    assert record.message_id == 'abc'
+    assert record.size == 12
+    assert record.duration == 0.5
+    assert record.getMessage() == (
+        'message.sent duration=0.5 message_id=abc size=12')
+
+
+def test_event_disabled(caplog):
+    caplog.set_level(logging.INFO, logger='koppeltaal.connector')
+    koppeltaal.logger.event('message.sent', message_id='abc')
+    assert caplog.records == []
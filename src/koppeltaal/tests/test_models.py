@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import inspect
+import json
+import pickle
+import pkg_resources
+import pytest
+import zope.interface
+import koppeltaal.connector
+import koppeltaal.definitions
+import koppeltaal.fhir
+import koppeltaal.fhir.bundle
+import koppeltaal.interfaces
+import koppeltaal.models
+
+
+BASE = 'https://example.com/fhir/Koppeltaal'
+
+
+@pytest.fixture
+def integration():
+    return koppeltaal.connector.Integration(
+        name='Test',
+        url=BASE,
+        software='Test',
+        version='0.0')
+
+
+@pytest.fixture
+def slotted_models():
+    koppeltaal.fhir.use_slotted_models()
+    yield
+    koppeltaal.fhir.use_slotted_models(False)
+
+
+def load_fixture(name):
+    filename = pkg_resources.resource_filename(
+        'koppeltaal.tests', 'fixtures/{}'.format(name))
+    with open(filename) as fp:
+        return json.load(fp)
+
+
+def signature(cls):
+    getargspec = getattr(inspect, 'getfullargspec', None) or \
+        inspect.getargspec
+    spec = getargspec(cls.__init__)
+    return spec.args, spec.defaults
+
+
+def roundtrip(integration, name):
+    bundle = koppeltaal.fhir.bundle.Bundle('test', integration)
+    bundle.add_payload(load_fixture(name))
+    message = bundle.unpack_model(koppeltaal.definitions.MessageHeader)
+    packed = koppeltaal.fhir.bundle.Bundle('test', integration)
+    packed.add_model(message)
+    return message, packed.get_payload()
+
+
+def test_slotted():
+    for cls in koppeltaal.fhir.MODELS.values():
+        variant = koppeltaal.models.slotted(cls)
+        assert variant is koppeltaal.models.slotted(cls)
+        assert variant.__name__ == 'Slotted' + cls.__name__
+        assert getattr(koppeltaal.models, variant.__name__) is variant
+        assert signature(variant) == signature(cls)
+        assert list(zope.interface.implementedBy(variant)) == \
+            list(zope.interface.implementedBy(cls))
+        assert not hasattr(variant(), '__dict__')
+
+
+def test_slotted_resource():
+    registry = koppeltaal.fhir.REGISTRY
+    patient = koppeltaal.models.SlottedPatient(
+        name=[koppeltaal.models.SlottedName(given=[u'Jane'])],
+        active=True)
+    assert koppeltaal.definitions.Patient.providedBy(patient)
+    assert koppeltaal.interfaces.IFHIRResource.providedBy(patient)
+    assert registry.definition_for_model(patient) is \
+        koppeltaal.definitions.Patient
+    assert registry.definition_for_model(patient.name[0]) is \
+        koppeltaal.definitions.Name
+    assert patient.fhir_link is None
+    patient.fhir_link = BASE + '/Patient/1/_history/1'
+    assert patient.fhir_link == BASE + '/Patient/1/_history/1'
+    with pytest.raises(AttributeError):
+        patient.nickname = u'J'
+    copy = pickle.loads(pickle.dumps(patient))
+    assert copy.name[0].given == [u'Jane']
+    assert copy.fhir_link == patient.fhir_link
+
+
+def test_use_slotted_models(integration, slotted_models):
+    message, payload = roundtrip(integration, 'bundle_one_message.json')
+    assert isinstance(message, koppeltaal.models.SlottedMessageHeader)
+    assert isinstance(message.patient, koppeltaal.models.SlottedPatient)
+    koppeltaal.fhir.use_slotted_models(False)
+    message, expected = roundtrip(integration, 'bundle_one_message.json')
+    assert isinstance(message, koppeltaal.models.MessageHeader)
+    assert payload['entry'] == expected['entry']
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import zope.interface
+import koppeltaal.definitions
+import koppeltaal.fhir
+import koppeltaal.fhir.registry
+import koppeltaal.models
+
+
+@zope.interface.implementer(koppeltaal.definitions.Patient)
+class Patient(koppeltaal.models.FHIRResource):
+    pass
+
+
+def test_definition_for_type():
+    registry = koppeltaal.fhir.REGISTRY
+    assert registry.definition_for_type('Patient') is \
+        koppeltaal.definitions.Patient
+    assert registry.definition_for_type('CarePlanActivityStatus') is \
+        koppeltaal.definitions.CarePlanActivityStatus
+    assert registry.definition_for_type('Observation') is None
+
+
+def test_definition_for_model():
+    registry = koppeltaal.fhir.REGISTRY
+    assert registry.definition_for_model(koppeltaal.models.Patient()) is \
+        koppeltaal.definitions.Patient
+    assert registry.definition_for_model(koppeltaal.models.Name()) is \
+        koppeltaal.definitions.Name
+    assert registry.definition_for_model(object()) is None
+    assert registry.type_for_model(koppeltaal.models.Patient()) == \
+        ('Patient', True)
+
+
+def test_repeatable_field_names():
+    registry = koppeltaal.fhir.REGISTRY
+    fields = registry.repeatable_field_names('Patient')
+    assert {'extension', 'coding', 'name', 'given', 'telecom'} <= fields
+    assert 'gender' not in fields
+    assert registry.repeatable_field_names('Patient') is fields
+    assert registry.repeatable_field_names('Other') == {
+        'extension', 'coding'}
+
+
+def test_field_type():
+    registry = koppeltaal.fhir.REGISTRY
+    assert registry.field_type('Patient', 'active') == 'boolean'
+    assert registry.field_type('Organization', 'active') == 'boolean'
+    assert registry.field_type('activity', 'prohibited') == 'boolean'
+    assert registry.field_type('Patient', 'birthDate') == 'datetime'
+    # Extensions are not fields of the resource in XML or JSON.
+    assert registry.field_type('Patient', 'age') is None
+    assert registry.field_type('Patient', 'unknown') is None
+
+
+def test_invalidate_on_change():
+    registry = koppeltaal.fhir.registry.Registry(koppeltaal.fhir.REGISTRY)
+    model = Patient()
+    assert registry.definition_for_type('Patient') is \
+        koppeltaal.definitions.Patient
+    assert registry.definition_for_model(model) is \
+        koppeltaal.definitions.Patient
+    assert 'name' in registry.repeatable_field_names('Patient')
+    assert registry.field_type('Patient', 'active') == 'boolean'
+
+    del registry[koppeltaal.definitions.Patient]
+    assert registry.definition_for_type('Patient') is None
+    assert registry.definition_for_model(model) is None
+    assert 'name' not in registry.repeatable_field_names('Patient')
+    assert registry.field_type('Patient', 'active') is None
+
+    registry[koppeltaal.definitions.Patient] = Patient
+    assert registry.definition_for_type('Patient') is \
+        koppeltaal.definitions.Patient
+    assert registry.definition_for_model(model) is \
+        koppeltaal.definitions.Patient
+    assert registry.model_for_definition(
+        koppeltaal.definitions.Patient) is Patient
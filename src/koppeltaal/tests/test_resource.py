@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import json
+import pkg_resources
+import pytest
+import koppeltaal.connector
+import koppeltaal.definitions
+import koppeltaal.fhir.bundle
+import koppeltaal.fhir.resource
+import koppeltaal.models
+
+
+BASE = 'https://example.com/fhir/Koppeltaal'
+
+
+@pytest.fixture
+def integration():
+    return koppeltaal.connector.Integration(
+        name='Test',
+        url=BASE,
+        software='Test',
+        version='0.0')
+
+
+def patient_entry(identifier, version=1):
+    return {
+        'id': '{}/Patient/{}'.format(BASE, identifier),
+        'link': [{
+            'rel': 'self',
+            'href': '{}/Patient/{}/_history/{}'.format(
+                BASE, identifier, version)}],
+        'content': {
+            'resourceType': 'Patient',
+            'name': [{'given': [u'Patient {}'.format(identifier)]}]}}
+
+
+def test_bundle_find(integration):
+    bundle = koppeltaal.fhir.bundle.Bundle('test', integration)
+    bundle.add_payload({
+        'resourceType': 'Bundle',
+        'entry': [patient_entry(i) for i in range(50)]})
+
+    entry = bundle.find(
+        {'reference': BASE + '/Patient/42/_history/1'})
+    assert entry is bundle.items[42]
+    assert bundle.find({'reference': BASE + '/Patient/42'}) is entry
+    assert bundle.find({'reference': BASE + '/Patient/42/_history/2'}) \
+        is None
+    assert bundle.find({'display': 'Patient 42'}) is None
+
+    # Before the entry is unpacked, it is found with the fhir link of a
+    # model, afterwards only with the unpacked model itself.
+    other = koppeltaal.models.Patient(name=[])
+    other.fhir_link = BASE + '/Patient/42/_history/1'
+    assert bundle.find(other) is entry
+    model = entry.unpack()
+    assert model.fhir_link == other.fhir_link
+    assert bundle.find(model) is entry
+    assert bundle.find(other) is None
+
+    # Adding more payload updates the indexes.
+    bundle.add_payload({
+        'resourceType': 'Bundle',
+        'entry': [patient_entry(50)]})
+    assert bundle.find({'reference': BASE + '/Patient/50'}) is \
+        bundle.items[50]
+
+
+def test_bundle_find_atom_id(integration):
+    bundle = koppeltaal.fhir.bundle.Bundle('test', integration)
+    payload = patient_entry(1)
+    payload['id'] = 'urn:uuid:5cab9885-ea21-4ffb-be3e-42428cce91bd'
+    bundle.add_payload({'resourceType': 'Bundle', 'entry': [payload]})
+    assert bundle.find(
+        {'reference': 'urn:uuid:5cab9885-ea21-4ffb-be3e-42428cce91bd'}) is \
+        bundle.items[0]
+
+
+def test_resource_add_model(integration):
+    resource = koppeltaal.fhir.resource.Resource('test', integration)
+    patient = koppeltaal.models.Patient(name=[])
+    entry = resource.add_model(patient)
+    assert resource.add_model(patient) is entry
+    assert len(resource.items) == 1
+    # The fhir link is not computed by looking up models.
+    assert patient.fhir_link is None
+
+    other = koppeltaal.models.Patient(name=[])
+    assert resource.add_model(other) is not entry
+    assert len(resource.items) == 2
+
+    # Once the fhir link is computed, the entry is found with it.
+    link = entry.fhir_link
+    assert patient.fhir_link == link
+    assert resource.find({'reference': link}) is entry
+
+
+def load_fixture(name):
+    filename = pkg_resources.resource_filename(
+        'koppeltaal.tests', 'fixtures/{}'.format(name))
+    with open(filename) as fp:
+        return json.load(fp)
+
+
+def test_bundle_lazy_errors(integration):
+    payload = load_fixture('bundle_one_error.json')
+
+    eager = koppeltaal.fhir.bundle.Bundle('test', integration)
+    eager.add_payload(payload)
+    expected = [(e.fhir_link, str(e.error)) for e in eager.errors()]
+    assert len(expected) == 1
+
+    lazy = koppeltaal.fhir.bundle.Bundle('test', integration, lazy=True)
+    lazy.add_payload(load_fixture('bundle_one_error.json'))
+    errors = lazy.errors()
+    assert [(e.fhir_link, str(e.error)) for e in errors] == expected
+    # Nothing got unpacked to validate the bundle.
+    for item in lazy.items:
+        assert item._model is koppeltaal.fhir.resource.MARKER
+
+    # Once unpacked, the broken model itself is reported.
+    message = lazy.unpack_model(koppeltaal.definitions.MessageHeader)
+    assert lazy.errors() == [message.data[0]]
+
+
+def test_bundle_lazy_unpack_model(integration):
+    payload = load_fixture('bundle_one_message.json')
+    # Add a patient that is not referred to by the message.
+    payload['entry'].append(patient_entry(1))
+
+    lazy = koppeltaal.fhir.bundle.Bundle('test', integration, lazy=True)
+    lazy.add_payload(payload)
+    assert lazy.errors() == []
+
+    message = lazy.unpack_model(koppeltaal.definitions.MessageHeader)
+    assert message.event == 'CreateOrUpdateCarePlan'
+    assert koppeltaal.definitions.CarePlan.providedBy(message.data[0])
+
+    unpacked = [
+        item.resource_type for item in lazy.items
+        if item._model is not koppeltaal.fhir.resource.MARKER]
+    assert unpacked == [
+        'MessageHeader', 'Patient', 'CarePlan', 'Practitioner',
+        'Practitioner', 'Practitioner', 'CareTeam', 'CareTeam']
+    # The care plan unpacked through the message is the one in the bundle.
+    assert message.data[0] in list(lazy.unpack())
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import pytest
+import requests
+import socket
+import urllib3
+import koppeltaal.connector
+import koppeltaal.interfaces
+import koppeltaal.testing
+import koppeltaal.transport
+import koppeltaal.utils
+
+
+@pytest.fixture
+def server():
+    server = koppeltaal.testing.StubServer('koppeltaal.tests')
+    server.start()
+    yield server
+    server.stop()
+
+
+def expect_metadata(server, count):
+    for index in range(count):
+        server.expect(
+            'GET',
+            '/FHIR/Koppeltaal/metadata',
+            respond_with='fixtures/bundle_zero_messages.json')
+
+
+def test_pool_options():
+    options = koppeltaal.transport.PoolOptions()
+    assert options.pool_connections == 10
+    assert options.pool_maxsize == 10
+    assert options.keep_alive is True
+    assert options.tcp_nodelay is True
+
+    # Options read from ~/.koppeltaal.cfg are strings.
+    options = koppeltaal.transport.PoolOptions({
+        'pool_connections': '2',
+        'pool_maxsize': '20',
+        'keep_alive': 'no',
+        'tcp_nodelay': 'false'})
+    assert options.pool_connections == 2
+    assert options.pool_maxsize == 20
+    assert options.keep_alive is False
+    assert options.tcp_nodelay is False
+    assert (socket.IPPROTO_TCP, socket.TCP_NODELAY, 0) in \
+        options.socket_options()
+
+
+def test_statistics_keep_alive(server):
+    expect_metadata(server, 3)
+    transport = koppeltaal.transport.Transport(
+        server.url, 'username', 'password', options={'pool_maxsize': '2'})
+    assert transport.statistics() == {'created': 0, 'reused': 0, 'in_use': 0}
+    for index in range(3):
+        transport.query('/FHIR/Koppeltaal/metadata')
+    assert transport.statistics() == {'created': 1, 'reused': 2, 'in_use': 0}
+    transport.close()
+
+
+def test_statistics_no_keep_alive(server):
+    expect_metadata(server, 3)
+    transport = koppeltaal.transport.Transport(
+        server.url, 'username', 'password', options={'keep_alive': 'false'})
+    for index in range(3):
+        transport.query('/FHIR/Koppeltaal/metadata')
+    assert transport.statistics()['created'] == 3
+    transport.close()
+
+
+class FakeSession(object):
+    """Session answering requests with the given responses or errors.
+    """
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.methods = []
+
+    def request(self, method, url, **kwargs):
+        self.methods.append(method)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        response.headers['content-type'] = 'application/json'
+        response._content = b'{}'
+        return response
+
+    def close(self):
+        pass
+
+
+def retrying_transport(*outcomes, **settings):
+    sleeps = []
+    clock = [0.0]
+    policy = koppeltaal.transport.RetryPolicy(
+        sleep=sleeps.append,
+        clock=lambda: clock[0],
+        random=lambda: 1.0,
+        **settings)
+    transport = koppeltaal.transport.Transport(
+        'https://example.com', 'username', 'password', retry_policy=policy)
+    transport.session = FakeSession(*outcomes)
+    return transport, sleeps, clock
+
+
+def connect_error():
+    return requests.exceptions.ConnectionError(
+        urllib3.exceptions.MaxRetryError(
+            None, '/', urllib3.exceptions.NewConnectionError(
+                None, 'Connection refused')))
+
+
+def test_retry_policy_options():
+    policy = koppeltaal.transport.RetryPolicy.from_options({})
+    assert policy.retries == 0
+    assert policy.breaker_threshold == 0
+    policy = koppeltaal.transport.RetryPolicy.from_options({
+        'retries': '3',
+        'retry_backoff': '0.1',
+        'retry_budget_maximum': '4',
+        'breaker_threshold': '5'})
+    assert policy.retries == 3
+    assert policy.budget_maximum == 4
+    assert policy.backoff == 0.1
+    assert policy.breaker_threshold == 5
+
+
+def test_no_retries_by_default():
+    transport, sleeps, clock = retrying_transport(503)
+    with pytest.raises(koppeltaal.interfaces.ResponseError):
+        transport.query('/FHIR/Koppeltaal/metadata')
+    assert sleeps == []
+
+
+def test_retry_query_and_update_with_backoff():
+    transport, sleeps, clock = retrying_transport(
+        503, requests.exceptions.ReadTimeout(), 502, 200, 504, 200,
+        retries=3, backoff=1.0, max_backoff=3.0)
+    assert transport.query('/FHIR/Koppeltaal/metadata').json == {}
+    assert sleeps == [1.0, 2.0, 3.0]
+    assert transport.update('/FHIR/Koppeltaal/Other/1', {}).json == {}
+    assert transport.session.methods == ['GET'] * 4 + ['PUT'] * 2
+
+
+def test_retry_gives_up():
+    transport, sleeps, clock = retrying_transport(
+        requests.exceptions.ReadTimeout(), requests.exceptions.ReadTimeout(),
+        retries=1)
+    with pytest.raises(koppeltaal.interfaces.ConnectionError):
+        transport.query('/FHIR/Koppeltaal/metadata')
+    assert len(sleeps) == 1
+
+
+def test_retry_create_only_when_safe():
+    # The server might have processed the message already.
+    transport, sleeps, clock = retrying_transport(503, retries=3)
+    with pytest.raises(koppeltaal.interfaces.ResponseError):
+        transport.create('/FHIR/Koppeltaal/Mailbox', {})
+    transport, sleeps, clock = retrying_transport(
+        requests.exceptions.ConnectionError('Connection aborted.'),
+        retries=3)
+    with pytest.raises(koppeltaal.interfaces.ConnectionError):
+        transport.create('/FHIR/Koppeltaal/Mailbox', {})
+    assert sleeps == []
+
+    # The server was not reached.
+    transport, sleeps, clock = retrying_transport(
+        connect_error(), requests.exceptions.ConnectTimeout(), 200,
+        retries=3)
+    assert transport.create('/FHIR/Koppeltaal/Mailbox', {}).json == {}
+    assert len(sleeps) == 2
+
+
+def test_retry_claim_only_when_safe():
+    # Claiming a message is not replayed: the server might have claimed
+    # a message already.
+    transport, sleeps, clock = retrying_transport(
+        requests.exceptions.ReadTimeout(), 200, retries=3)
+    with pytest.raises(koppeltaal.interfaces.ConnectionError):
+        transport.query(
+            '/FHIR/Koppeltaal/MessageHeader/_search',
+            {'_query': 'MessageHeader.GetNextNewAndClaim'},
+            replay=False)
+    assert transport.session.methods == ['GET']
+
+    transport, sleeps, clock = retrying_transport(
+        connect_error(), 200, retries=3)
+    assert transport.query(
+        '/FHIR/Koppeltaal/MessageHeader/_search',
+        {'_query': 'MessageHeader.GetNextNewAndClaim'},
+        replay=False).json == {}
+    assert transport.session.methods == ['GET'] * 2
+
+
+def test_updates_lost_claim_response():
+    transport, sleeps, clock = retrying_transport(
+        requests.exceptions.ReadTimeout(), 200, retries=3)
+    connector = koppeltaal.connector.Connector(
+        koppeltaal.utils.Credentials(
+            'https://example.com', 'username', 'password', 'Test', {}),
+        koppeltaal.connector.Integration(
+            name='Test',
+            url='https://example.com/fhir/Koppeltaal',
+            software='Test',
+            version='0.0'))
+    connector.transport = transport
+    # The claim is not sent again, that would claim the next message.
+    assert list(connector.updates()) == []
+    assert transport.session.methods == ['GET']
+    assert sleeps == []
+
+
+def test_retry_budget():
+    transport, sleeps, clock = retrying_transport(
+        503, 503, 503, 503, retries=3, budget=0.0, budget_maximum=1)
+    with pytest.raises(koppeltaal.interfaces.ResponseError):
+        transport.query('/FHIR/Koppeltaal/metadata')
+    assert len(sleeps) == 1
+    with pytest.raises(koppeltaal.interfaces.ResponseError):
+        transport.query('/FHIR/Koppeltaal/metadata')
+    assert len(sleeps) == 1
+
+
+def test_circuit_breaker():
+    transport, sleeps, clock = retrying_transport(
+        503, 503, 200, breaker_threshold=2, breaker_timeout=10.0)
+    for index in range(2):
+        with pytest.raises(koppeltaal.interfaces.ResponseError):
+            transport.query('/FHIR/Koppeltaal/metadata')
+    # The circuit is open, the server is not queried.
+    with pytest.raises(koppeltaal.interfaces.ConnectionError):
+        transport.query('/FHIR/Koppeltaal/metadata')
+    assert len(transport.session.methods) == 2
+
+    clock[0] = 10.0
+    assert transport.query('/FHIR/Koppeltaal/metadata').json == {}
+    assert len(transport.session.methods) == 3
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import datetime
+import dateutil.parser
+import pytest
+import koppeltaal.utils
+
+
+VALUES = [
+    u'2016-07-15T11:52:44+02:00',
+    u'2016-07-15T11:52:44-05:30',
+    u'2016-07-15T11:52:44+00:00',
+    u'2016-07-15T11:52:44Z',
+    u'2016-07-15T11:52:44',
+    u'2016-07-15T11:52:44.5+02:00',
+    u'2016-07-15T11:52:44.123456Z',
+    u'2016-07-15T11:52:44.1234567Z',
+    u'2016-07-15',
+    # Not in the fast path.
+    u'2016-07-15T11:52+02:00',
+    u'2016-07-15 11:52:44',
+    u'20160715T115244Z',
+]
+
+
+@pytest.mark.parametrize('value', VALUES)
+def test_parse_datetime(value):
+    expected = dateutil.parser.parse(value)
+    parsed = koppeltaal.utils.parse_datetime(value)
+    assert parsed == expected
+    assert parsed.utcoffset() == expected.utcoffset()
+    assert parsed.isoformat() == expected.isoformat()
+    assert koppeltaal.utils.parse_date(value) == expected.date()
+
+
+def test_parse_datetime_memoized():
+    value = u'2016-07-15T11:52:44+02:00'
+    assert koppeltaal.utils.parse_datetime(value) is \
+        koppeltaal.utils.parse_datetime(value)
+
+
+def test_parse_date():
+    assert koppeltaal.utils.parse_date(u'1983-04-25') == \
+        datetime.date(1983, 4, 25)
+
+
+@pytest.mark.parametrize('value', [
+    u'2016-13-15T11:52:44Z',
+    u'2016-02-30',
+    u'2016-07-15T25:52:44Z',
+    u'not a date',
+])
+def test_parse_invalid(value):
+    with pytest.raises(ValueError):
+        koppeltaal.utils.parse_datetime(value)
+    with pytest.raises(ValueError):
+        koppeltaal.utils.parse_date(value)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2015 - 2017 Stichting Koppeltaal
+:license: AGPL, see `LICENSE.md` for more details.
+"""
+
+import io
+import pkg_resources
+import pytest
+import koppeltaal.connector
+import koppeltaal.definitions
+import koppeltaal.fhir.bundle
+import koppeltaal.fhir.xml
+import koppeltaal.interfaces
+
+
+BASE = 'https://example.com/fhir/Koppeltaal'
+
+PATIENT_ENTRY = u'''
+  <entry>
+    <id>{base}/Patient/{index}</id>
+    <link rel="self" href="{base}/Patient/{index}/_history/1"/>
+    <content type="text/xml">
+      <Patient xmlns="http://hl7.org/fhir">
+        <name><given value="Patient {index}"/></name>
+        <active value="true"/>
+      </Patient>
+    </content>
+  </entry>'''
+
+
+@pytest.fixture
+def integration():
+    return koppeltaal.connector.Integration(
+        name='Test',
+        url=BASE,
+        software='Test',
+        version='0.0')
+
+
+def fixture_file(name):
+    return pkg_resources.resource_filename(
+        'koppeltaal.tests', 'fixtures/{}'.format(name))
+
+
+def feed(count):
+    entries = u''.join(
+        PATIENT_ENTRY.format(base=BASE, index=index)
+        for index in range(count))
+    return io.BytesIO(
+        u'<feed xmlns="http://www.w3.org/2005/Atom">'
+        u'<id>urn:uuid:feed</id>{}<updated>2016-07-15T11:52:44Z</updated>'
+        u'</feed>'.format(entries).encode('utf-8'))
+
+
+def test_type_for():
+    type_for = koppeltaal.fhir.xml.type_for
+    assert type_for('Patient', 'active') == 'boolean'
+    assert type_for('Organization', 'active') == 'boolean'
+    assert type_for('activity', 'prohibited') == 'boolean'
+    assert type_for('extension', 'valueInteger') == 'int'
+    assert type_for('extension', 'valueDecimal') == 'float'
+    assert type_for('extension', 'valueCode') == 'string'
+    assert type_for('Patient', 'birthDate') == 'string'
+
+
+def test_iterxml2json():
+    filename = fixture_file('bundle_one_message.xml')
+    payload = koppeltaal.fhir.xml.iterxml2json(filename)
+    assert payload['id'] == 'urn:uuid:5da8bf14-d013-4aa6-8fc3-fbdb2c3669a1'
+    assert len(payload['category']) == 2
+    payload['entry'] = list(payload['entry'])
+    assert payload == koppeltaal.fhir.xml.xml2json(filename)
+
+
+def test_iterxml2json_bundle(integration):
+    payload = koppeltaal.fhir.xml.iterxml2json(
+        fixture_file('bundle_one_message.xml'))
+    bundle = koppeltaal.fhir.bundle.Bundle('test', integration)
+    bundle.add_payload(payload)
+    assert bundle.errors() == []
+    message = bundle.unpack_model(koppeltaal.definitions.MessageHeader)
+    assert message.event == 'CreateOrUpdatePatient'
+    assert message.patient.name[0].family == ['Ahmed']
+    assert message.patient.age == 33
+    assert message.data == [message.patient]
+
+
+def test_iterxml2json_streams():
+    payload = koppeltaal.fhir.xml.iterxml2json(feed(100))
+    # Elements following the entries are read with the last entry.
+    assert 'updated' not in payload
+    entries = payload['entry']
+    first = next(entries)
+    assert first['id'] == BASE + '/Patient/0'
+    assert first['content'] == {
+        'resourceType': 'Patient',
+        'name': [{'given': ['Patient 0']}],
+        'active': True}
+    rest = list(entries)
+    assert len(rest) == 99
+    assert rest[-1]['id'] == BASE + '/Patient/99'
+    assert payload['updated'] == '2016-07-15T11:52:44Z'
+
+
+def test_iterxml2json_no_entries(integration):
+    payload = koppeltaal.fhir.xml.iterxml2json(feed(0))
+    assert payload == {
+        'resourceType': 'Bundle',
+        'id': 'urn:uuid:feed',
+        'updated': '2016-07-15T11:52:44Z'}
+    bundle = koppeltaal.fhir.bundle.Bundle('test', integration)
+    with pytest.raises(koppeltaal.interfaces.InvalidBundle):
+        bundle.add_payload(payload)
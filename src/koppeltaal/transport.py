@@ -4,26 +4,313 @@
 :license: AGPL, see `LICENSE.md` for more details.
 """
 
+import random
 import requests
+import requests.adapters
 import six
+import socket
+import threading
+import time
+import urllib3
 
-from koppeltaal import (interfaces, logger)
+from koppeltaal import (cache, codec, interfaces, logger)
 from six.moves.urllib.parse import urlparse, urlunparse
+from urllib3.connection import HTTPConnection
 
 
 unicode = six.text_type
 
+RETRY_STATUSES = frozenset((502, 503, 504))
+
+JSON_HEADERS = {
+    'Accept': 'application/json',
+    'Content-Type': 'application/json; charset=utf-8'}
+
+DEFAULT_POOL_CONNECTIONS = requests.adapters.DEFAULT_POOLSIZE
+DEFAULT_POOL_MAXSIZE = requests.adapters.DEFAULT_POOLSIZE
+
+
+def option(options, name, default, convert):
+    """Return the option `name` converted with `convert`. Options read
+    from the configuration file are strings.
+    """
+    value = (options or {}).get(name)
+    if value is None or value == '':
+        return default
+    return convert(value)
+
+
+def boolean(value):
+    if isinstance(value, six.string_types):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+class PoolOptions(object):
+    """Connection pool settings of a transport, read from the options of
+    the credentials:
+
+    - `pool_connections`: number of servers to keep a pool for.
+
+    - `pool_maxsize`: maximum number of connections kept per server.
+
+    - `keep_alive`: reuse connections between requests (default true).
+
+    - `tcp_nodelay`: disable Nagle's algorithm on the sockets (default
+      true).
+    """
+
+    def __init__(self, options=None):
+        self.pool_connections = option(
+            options, 'pool_connections', DEFAULT_POOL_CONNECTIONS, int)
+        self.pool_maxsize = option(
+            options, 'pool_maxsize', DEFAULT_POOL_MAXSIZE, int)
+        self.keep_alive = option(options, 'keep_alive', True, boolean)
+        self.tcp_nodelay = option(options, 'tcp_nodelay', True, boolean)
+
+    def socket_options(self):
+        socket_options = [
+            o for o in HTTPConnection.default_socket_options
+            if o[:2] != (socket.IPPROTO_TCP, socket.TCP_NODELAY)]
+        socket_options.append(
+            (socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.tcp_nodelay)))
+        return socket_options
+
+
+class PoolStatistics(object):
+    """Count the connections opened and reused for requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def count(self, connection):
+        # A connection without socket is (re)connected for the request.
+        with self._lock:
+            if getattr(connection, 'sock', None) is None:
+                self.created += 1
+            else:
+                self.reused += 1
+
+
+class CountingPool(object):
+    statistics = None
+
+    def _make_request(self, conn, *args, **kwargs):
+        if self.statistics is not None:
+            self.statistics.count(conn)
+        return super(CountingPool, self)._make_request(conn, *args, **kwargs)
+
+
+class HTTPConnectionPool(CountingPool, urllib3.HTTPConnectionPool):
+    pass
+
+
+class HTTPSConnectionPool(CountingPool, urllib3.HTTPSConnectionPool):
+    pass
+
+
+class PoolManager(urllib3.PoolManager):
+
+    def __init__(self, statistics, *args, **kwargs):
+        super(PoolManager, self).__init__(*args, **kwargs)
+        self.statistics = statistics
+        self.pool_classes_by_scheme = {
+            'http': HTTPConnectionPool,
+            'https': HTTPSConnectionPool}
+
+    def _new_pool(self, *args, **kwargs):
+        pool = super(PoolManager, self)._new_pool(*args, **kwargs)
+        pool.statistics = self.statistics
+        return pool
+
+
+class HTTPAdapter(requests.adapters.HTTPAdapter):
+    """HTTP adapter creating connections with the given socket options and
+    keeping statistics about them.
+    """
+    __attrs__ = requests.adapters.HTTPAdapter.__attrs__ + ['socket_options']
+
+    pool_statistics = None
+
+    def __init__(self, socket_options=None, **kwargs):
+        self.socket_options = socket_options
+        super(HTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(
+            self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        if self.pool_statistics is None:
+            self.pool_statistics = PoolStatistics()
+        if self.socket_options is not None:
+            pool_kwargs['socket_options'] = self.socket_options
+        self.poolmanager = PoolManager(
+            self.pool_statistics,
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            **pool_kwargs)
+
+    def statistics(self):
+        in_use = 0
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None and pool.pool is not None:
+                in_use += pool.pool.maxsize - pool.pool.qsize()
+        return {
+            'created': self.pool_statistics.created,
+            'reused': self.pool_statistics.reused,
+            'in_use': in_use}
+
+
+def safe_to_replay(error):
+    """Tell whether the request that failed with `error` surely did not
+    reach the server, because no connection could be made.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError):
+        reason = error.args[0] if error.args else None
+        reason = getattr(reason, 'reason', reason)
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+    return False
+
+
+class RetryPolicy(object):
+    """Retry failed requests with exponential backoff and full jitter, read
+    from the options of the credentials:
+
+    - `retries`: maximum number of retries of a request (default 0, no
+      retries).
+
+    - `retry_backoff`: base delay in seconds, doubled for every retry.
+
+    - `retry_max_backoff`: maximum delay in seconds.
+
+    - `retry_budget`: retries earned by every request, to limit the
+      retries to a fraction of the requests.
+
+    - `retry_budget_maximum`: maximum number of retries that can be saved
+      up (default 10). The budget starts full.
+
+    - `breaker_threshold`: number of consecutive failures after which
+      requests fail right away (default 0, never).
+
+    - `breaker_timeout`: seconds after which a request is let through
+      again to probe the server.
+    """
+
+    def __init__(
+            self,
+            retries=0,
+            backoff=0.5,
+            max_backoff=30.0,
+            budget=0.2,
+            budget_maximum=10,
+            breaker_threshold=0,
+            breaker_timeout=30.0,
+            sleep=time.sleep,
+            clock=getattr(time, 'monotonic', time.time),
+            random=random.random):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.budget_maximum = budget_maximum
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+        self.sleep = sleep
+        self.clock = clock
+        self.random = random
+        self._lock = threading.Lock()
+        self._tokens = float(budget_maximum)
+        self._failures = 0
+        self._opened = None
+
+    @classmethod
+    def from_options(cls, options=None):
+        return cls(
+            retries=option(options, 'retries', 0, int),
+            backoff=option(options, 'retry_backoff', 0.5, float),
+            max_backoff=option(options, 'retry_max_backoff', 30.0, float),
+            budget=option(options, 'retry_budget', 0.2, float),
+            budget_maximum=option(
+                options, 'retry_budget_maximum', 10, int),
+            breaker_threshold=option(options, 'breaker_threshold', 0, int),
+            breaker_timeout=option(options, 'breaker_timeout', 30.0, float))
+
+    def check(self, attempt):
+        """Raise a connection error while the circuit is open.
+        """
+        with self._lock:
+            if attempt == 0:
+                self._tokens = min(
+                    self._tokens + self.budget, self.budget_maximum)
+            if self._opened is None:
+                return
+            if self.clock() - self._opened < self.breaker_timeout:
+                raise interfaces.ConnectionError(
+                    'Circuit open after {} failures.'.format(self._failures))
+            # Let this request through to probe the server. The others
+            # keep failing until it succeeds.
+            self._opened = self.clock()
+
+    def succeeded(self):
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+
+    def failed(self):
+        with self._lock:
+            self._failures += 1
+            if (self.breaker_threshold and
+                    self._failures >= self.breaker_threshold):
+                self._opened = self.clock()
+
+    def delay(self, attempt, http_response=None):
+        """Return the seconds to wait before retrying, or None to give up.
+        """
+        with self._lock:
+            if (attempt >= self.retries or
+                    self._opened is not None or
+                    self._tokens < 1):
+                return None
+            self._tokens -= 1
+        delay = self.random() * min(
+            self.max_backoff, self.backoff * 2 ** attempt)
+        retry_after = None
+        if http_response is not None:
+            retry_after = http_response.headers.get('retry-after')
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.max_backoff))
+        return delay
+
 
 class Response(object):
+    etag = None
+    last_modified = None
+    not_modified = False
 
-    def __init__(self, json=None, location=None):
+    def __init__(
+            self, json=None, location=None, etag=None, last_modified=None,
+            not_modified=False):
         self.json = json
         self.location = location
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = not_modified
 
 
 class Transport(object):
 
-    def __init__(self, server, username, password):
+    def __init__(
+            self, server, username, password, options=None,
+            retry_policy=None, response_cache=None):
         parts = urlparse(server)
 
         self.server = server
@@ -31,84 +318,187 @@ class Transport(object):
         self.netloc = parts.netloc
         self.username = username
         self.password = password
+        self.pool_options = PoolOptions(options)
 
         self.session = requests.Session()
+        self.adapter = HTTPAdapter(
+            socket_options=self.pool_options.socket_options(),
+            pool_connections=self.pool_options.pool_connections,
+            pool_maxsize=self.pool_options.pool_maxsize)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        if not self.pool_options.keep_alive:
+            self.session.headers['Connection'] = 'close'
+        if retry_policy is None:
+            retry_policy = RetryPolicy.from_options(options)
+        self.retry_policy = retry_policy
+        if response_cache is None:
+            response_cache = cache.ResponseCache.from_options(options)
+        self.response_cache = response_cache
+
+    def statistics(self):
+        """Return the number of connections created, reused and in use.
+        """
+        return self.adapter.statistics()
 
     def absolute_url(self, url):
         # Make sure we talk to the proper server by updating the URL.
         parts = list(map(unicode, urlparse(url)[2:]))
         return urlunparse([unicode(self.scheme), unicode(self.netloc)] + parts)
 
+    def _request(self, method, url, replay, **kwargs):
+        # Requests that failed before reaching the server are always
+        # retried. The others only if `replay` is true, as the server
+        # might have processed them.
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            policy.check(attempt)
+            error = http_response = None
+            try:
+                http_response = self.session.request(
+                    method,
+                    self.absolute_url(url),
+                    timeout=interfaces.TIMEOUT,
+                    allow_redirects=False,
+                    **kwargs)
+            except requests.RequestException as request_error:
+                error = request_error
+                retry = replay or safe_to_replay(error)
+            else:
+                logger.event(
+                    'http.response',
+                    method=method,
+                    url=url,
+                    status=http_response.status_code,
+                    size=len(http_response.content),
+                    duration=http_response.elapsed.total_seconds(),
+                    attempt=attempt)
+                if http_response.status_code not in RETRY_STATUSES:
+                    policy.succeeded()
+                    return http_response
+                retry = replay
+            policy.failed()
+            delay = None
+            if retry:
+                delay = policy.delay(attempt, http_response)
+            if delay is None:
+                if error is not None:
+                    raise interfaces.ConnectionError(error)
+                return http_response
+            logger.warning(
+                'Retrying {} {} in {:.2f} seconds after: {}'.format(
+                    method, url, delay,
+                    error if error is not None else http_response.status_code))
+            policy.sleep(delay)
+            attempt += 1
+
     def _read_http_response(self, http_response):
+        if http_response.status_code == 304:
+            return Response(
+                etag=http_response.headers.get('etag'),
+                last_modified=http_response.headers.get('last-modified'),
+                not_modified=True)
         if not http_response.headers['content-type'].startswith(
                 'application/json'):
             raise interfaces.ConnectionError(http_response)
         response = Response(
-            json=http_response.json() if http_response.text else None,
-            location=http_response.headers.get('content-location'))
+            json=codec.loads(http_response.content)
+            if http_response.content else None,
+            location=http_response.headers.get('content-location'),
+            etag=http_response.headers.get('etag'),
+            last_modified=http_response.headers.get('last-modified'))
         if 400 <= http_response.status_code < 600:
             raise interfaces.ResponseError(response)
         return response
 
-    def query(self, url, params=None, username=None, password=None):
-        """Query a url.
+    def _cached_response(self, entry):
+        return Response(
+            json=codec.loads(entry['body']) if entry['body'] else None,
+            location=entry['location'],
+            etag=entry['etag'],
+            last_modified=entry['last_modified'])
+
+    def query(
+            self, url, params=None, username=None, password=None,
+            headers=None, replay=True):
+        """Query a url. Extra request `headers` can be given, for instance
+        to make a conditional request. If the resource was not modified,
+        the response is flagged `not_modified` and has no JSON.
+
+        Responses are taken from the response cache, if any, unless extra
+        headers are given.
+
+        Queries changing the state of the server, as claiming a message,
+        must not be replayed: they are only retried if the server was not
+        reached.
         """
-        try:
-            http_response = self.session.get(
-                self.absolute_url(url),
-                params=params,
-                auth=(username or self.username, password or self.password),
-                headers={'Accept': 'application/json'},
-                timeout=interfaces.TIMEOUT,
-                allow_redirects=False)
-        except requests.RequestException as error:
-            raise interfaces.ConnectionError(error)
+        request_headers = {'Accept': 'application/json'}
+        key = entry = None
+        if headers:
+            request_headers.update(headers)
+        elif self.response_cache is not None:
+            key = self.response_cache.key(url, params, username)
+        if key is not None:
+            entry, fresh = self.response_cache.get(key)
+            if fresh:
+                return self._cached_response(entry)
+            if entry is not None:
+                request_headers.update(self.response_cache.conditions(entry))
+        http_response = self._request(
+            'GET',
+            url,
+            replay=replay,
+            params=params,
+            auth=(username or self.username, password or self.password),
+            headers=request_headers)
+        if key is not None:
+            if http_response.status_code == 304 and entry is not None:
+                return self._cached_response(self.response_cache.refresh(
+                    key, entry, http_response.headers))
+            response = self._read_http_response(http_response)
+            if http_response.status_code == 200:
+                self.response_cache.store(
+                    key, http_response.text, http_response.headers)
+            return response
         return self._read_http_response(http_response)
 
     def query_redirect(self, url, params=None):
         """Query a url for a redirect.
         """
-        try:
-            http_response = self.session.get(
-                self.absolute_url(url),
-                params=params,
-                auth=(self.username, self.password),
-                timeout=interfaces.TIMEOUT,
-                allow_redirects=False)
-        except requests.RequestException as error:
-            raise interfaces.ConnectionError(error)
+        http_response = self._request(
+            'GET',
+            url,
+            replay=True,
+            params=params,
+            auth=(self.username, self.password))
         if not http_response.is_redirect:
             raise interfaces.ConnectionError(http_response)
         return Response(location=http_response.headers.get('location'))
 
     def create(self, url, data):
-        """Create a new resource at the given url with JSON data.
+        """Create a new resource at the given url with JSON data. This is
+        only retried when the server could not be reached.
         """
-        try:
-            http_response = self.session.post(
-                self.absolute_url(url),
-                auth=(self.username, self.password),
-                json=data,
-                headers={'Accept': 'application/json'},
-                timeout=interfaces.TIMEOUT,
-                allow_redirects=False)
-        except requests.RequestException as error:
-            raise interfaces.ConnectionError(error)
+        http_response = self._request(
+            'POST',
+            url,
+            replay=False,
+            auth=(self.username, self.password),
+            data=codec.dumps(data),
+            headers=JSON_HEADERS)
         return self._read_http_response(http_response)
 
     def update(self, url, data):
         """Update an existing resource at the given url with JSON data.
         """
-        try:
-            http_response = self.session.put(
-                self.absolute_url(url),
-                auth=(self.username, self.password),
-                json=data,
-                headers={'Accept': 'application/json'},
-                timeout=interfaces.TIMEOUT,
-                allow_redirects=False)
-        except requests.RequestException as error:
-            raise interfaces.ConnectionError(error)
+        http_response = self._request(
+            'PUT',
+            url,
+            replay=True,
+            auth=(self.username, self.password),
+            data=codec.dumps(data),
+            headers=JSON_HEADERS)
         return self._read_http_response(http_response)
 
     def close(self):
@@ -6,7 +6,10 @@
 
 import collections
 import datetime
+import dateutil.parser
+import dateutil.tz
 import os.path
+import re
 import six
 import uuid
 
@@ -59,6 +62,82 @@ def now():
     return datetime.datetime.utcnow().replace(microsecond=0, tzinfo=utc)
 
 
+DATE = re.compile(r'(\d{4})-(\d{2})-(\d{2})$')
+
+DATETIME = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})'
+    r'(?:T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6})\d*)?'
+    r'(Z|([+-])(\d{2}):(\d{2}))?)?$')
+
+TZUTC = dateutil.tz.tzutc()
+
+_timezones = {}
+
+_parsed = {}
+
+PARSED_SIZE = 1024
+
+
+def _timezone(sign, hours, minutes):
+    offset = (int(hours) * 60 + int(minutes)) * 60
+    if sign == '-':
+        offset = -offset
+    if not offset:
+        return TZUTC
+    timezone = _timezones.get(offset)
+    if timezone is None:
+        timezone = _timezones[offset] = dateutil.tz.tzoffset(None, offset)
+    return timezone
+
+
+def _parse_datetime(value):
+    match = DATETIME.match(value)
+    if match is None:
+        # Partial dates and other unusual formats.
+        return dateutil.parser.parse(value)
+    (year, month, day, hour, minute, second, fraction,
+     zone, sign, hours, minutes) = match.groups()
+    if hour is None:
+        return datetime.datetime(int(year), int(month), int(day))
+    if zone is None:
+        tzinfo = None
+    elif zone == 'Z':
+        tzinfo = TZUTC
+    else:
+        tzinfo = _timezone(sign, hours, minutes)
+    return datetime.datetime(
+        int(year), int(month), int(day),
+        int(hour), int(minute), int(second),
+        int(fraction.ljust(6, '0')) if fraction else 0,
+        tzinfo)
+
+
+def parse_datetime(value):
+    """Parse a FHIR date, dateTime or instant to a datetime. The formats
+    emitted by the server are parsed directly, others by dateutil. Raise
+    ValueError for invalid values.
+
+    The results are memoized, as the same timestamps are found in many
+    messages.
+    """
+    parsed = _parsed.get(value)
+    if parsed is None:
+        parsed = _parse_datetime(value)
+        if len(_parsed) >= PARSED_SIZE:
+            _parsed.clear()
+        _parsed[value] = parsed
+    return parsed
+
+
+def parse_date(value):
+    """Parse a FHIR date to a date. Raise ValueError for invalid values.
+    """
+    match = DATE.match(value)
+    if match is None:
+        return parse_datetime(value).date()
+    return datetime.date(*map(int, match.groups()))
+
+
 Credentials = collections.namedtuple(
     'Credentials',
     ['url', 'username', 'password', 'domain', 'options'])